@@ -0,0 +1,217 @@
+'''I run many scripts in the proper order.
+
+A script depends on another one, if one of its Inputs is an Outputs
+of the other script.
+Scripts not depending on each other are run in parallel.
+'''
+
+import fnmatch
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+try:
+    import queue
+except ImportError:  # pragma: nocover
+    import Queue as queue
+
+from replay import patterns
+from replay import plugins
+
+
+log = logging.getLogger(__name__)
+
+SCRIPT_PATTERN = '*.script'
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+# not run, because a script it depends on has failed
+SKIPPED = 'skipped'
+
+
+class ScriptSpec(object):
+
+    '''I am the datastore interface of a script: its inputs and outputs'''
+
+    def __init__(self, path, inputs, outputs):
+        self.path = path
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+
+def script_spec(path, plugins_):
+    '''I return the ScriptSpec of the script at `path` with `plugins_`'''
+    inputs = []
+    outputs = []
+    for plugin in plugins_:
+        if isinstance(plugin, plugins.Inputs):
+            inputs.extend(plugin.datastore_paths())
+        elif isinstance(plugin, plugins.Outputs):
+            outputs.extend(plugin.datastore_paths())
+    return ScriptSpec(path, inputs, outputs)
+
+
+def load_script_spec(context, path):
+    return script_spec(path, context.load_script(path))
+
+
+def find_script_paths(paths, pattern=SCRIPT_PATTERN):
+    '''I yield script paths: files in `paths` are yielded as is, \
+    directories are searched recursively for files matching `pattern`.
+    '''
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(fnmatch.filter(filenames, pattern)):
+                    yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+
+class DependencyGraph(object):
+
+    '''I know which scripts must run before a given script'''
+
+    def __init__(self, specs):
+        self.specs = list(specs)
+
+        producers = {}
+        # (pattern, script path) of outputs with patterns
+        pattern_producers = []
+        for spec in self.specs:
+            for output in spec.outputs:
+                if patterns.is_pattern(output):
+                    pattern_producers.append((output, spec.path))
+                    continue
+                if output in producers:
+                    msg = '{} is an output of both {} and {}'.format(
+                        output, producers[output], spec.path)
+                    raise ValueError(msg)
+                producers[output] = spec.path
+
+        def input_producers(input):
+            if input in producers:
+                yield producers[input]
+            if patterns.is_pattern(input):
+                for output, path in producers.items():
+                    if patterns.matches(input, output):
+                        yield path
+            for output, path in pattern_producers:
+                if patterns.overlap(input, output):
+                    yield path
+
+        self.dependencies = dict(
+            (
+                spec.path,
+                set(
+                    producer
+                    for input in spec.inputs
+                    for producer in input_producers(input)
+                ) - set([spec.path])
+            )
+            for spec in self.specs)
+
+        self.dependents = dict((spec.path, set()) for spec in self.specs)
+        for path, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                self.dependents[dependency].add(path)
+
+        self._check_for_cycles()
+
+    @property
+    def paths(self):
+        return [spec.path for spec in self.specs]
+
+    def _check_for_cycles(self):
+        self.topological_order()
+
+    def topological_order(self):
+        '''I return the script paths, each after those it depends on'''
+        order = []
+        remaining = dict(
+            (path, set(dependencies))
+            for path, dependencies in self.dependencies.items())
+        ready = sorted(
+            (path for path, deps in remaining.items() if not deps),
+            reverse=True)
+        while ready:
+            path = ready.pop()
+            order.append(path)
+            del remaining[path]
+            for dependent in sorted(self.dependents[path], reverse=True):
+                remaining[dependent].discard(path)
+                if not remaining[dependent]:
+                    ready.append(dependent)
+        if remaining:
+            msg = 'circular dependency between scripts: ' + ', '.join(
+                sorted(remaining))
+            raise ValueError(msg)
+        return order
+
+    def transitive_dependents(self, path):
+        dependents = set()
+        todo = [path]
+        while todo:
+            for dependent in self.dependents[todo.pop()]:
+                if dependent not in dependents:
+                    dependents.add(dependent)
+                    todo.append(dependent)
+        return dependents
+
+
+def build(graph, run_script, jobs=1):
+    '''I run all scripts in `graph` with at most `jobs` in parallel.
+
+    `run_script` is called with a script path and should return true
+    on success.
+    A script is run only after all the scripts it depends on succeeded.
+
+    I return a mapping from script path to one of
+    SUCCEEDED, FAILED or SKIPPED.
+    '''
+    status = {}
+    waiting_for = dict(
+        (path, set(dependencies))
+        for path, dependencies in graph.dependencies.items())
+    ready = sorted(path for path, deps in waiting_for.items() if not deps)
+    finished = queue.Queue()
+    running = 0
+
+    def run(path):
+        try:
+            succeeded = bool(run_script(path))
+        except Exception:
+            log.exception('build: %s raised an exception', path)
+            succeeded = False
+        return path, succeeded
+
+    pool = ThreadPool(max(1, jobs))
+    try:
+        while ready or running:
+            for path in ready:
+                log.debug('build: start %s', path)
+                pool.apply_async(run, (path,), callback=finished.put)
+            running += len(ready)
+            ready = []
+
+            path, succeeded = finished.get()
+            running -= 1
+
+            if succeeded:
+                log.debug('build: %s succeeded', path)
+                status[path] = SUCCEEDED
+                for dependent in sorted(graph.dependents[path]):
+                    waiting_for[dependent].discard(path)
+                    if not waiting_for[dependent] and dependent not in status:
+                        ready.append(dependent)
+            else:
+                log.debug('build: %s failed', path)
+                status[path] = FAILED
+                for dependent in graph.transitive_dependents(path):
+                    status.setdefault(dependent, SKIPPED)
+    finally:
+        pool.close()
+        pool.join()
+
+    return status
@@ -0,0 +1,100 @@
+'''I remember the outputs of earlier runs, so that runs with unchanged \
+inputs, script and dependencies can be skipped.
+'''
+
+import json
+import logging
+
+from replay import datastores
+from replay import fingerprint
+from replay import patterns
+from replay import plugins as replay_plugins
+
+
+log = logging.getLogger(__name__)
+
+# location of the build state records in the datastore
+BUILD_STATE_DIRECTORY = '.replay/build-state'
+
+
+def output_paths(plugins):
+    '''I return the datastore paths of all Outputs in `plugins`'''
+    return sorted(
+        path
+        for plugin in plugins
+        if isinstance(plugin, replay_plugins.Outputs)
+        for path in plugin.datastore_paths())
+
+
+def _version(datastore, path):
+    '''I return a JSON value changing with the content of the file at \
+    `path` in `datastore`, or None if it is missing.
+    '''
+    stat = (datastores.as_remote(datastore) / path).stat()
+    if stat is None:
+        return None
+    return json.loads(json.dumps(stat))
+
+
+def output_versions(datastore, paths):
+    '''I return {path: version} of the files at the normalized datastore \
+    `paths` and of the files matching the patterns among them.
+
+    A version is the size, modification time and inode of a local
+    file, the size and ETag of a remote one, the size and digest of
+    another External's (see replay.datastores), None for a missing file.
+    '''
+    files = set()
+    for path in paths:
+        if patterns.is_pattern(path):
+            files.update(patterns.expand(datastore, path))
+        else:
+            files.add(path)
+    return dict((path, _version(datastore, path)) for path in files)
+
+
+class BuildState(object):
+
+    '''I map run keys to the outputs produced by the run.
+
+    A run key identifies the script specification, the content of its
+    inputs, its script directory and its python dependencies.
+    The outputs are recorded with their versions, a run is up to date
+    only while its outputs are the ones it produced - not overwritten
+    by a run with other inputs, or modified.
+    '''
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+        self.directory = datastore / BUILD_STATE_DIRECTORY
+
+    def key(self, spec, run_fingerprint):
+        return fingerprint.hash_strings([spec, run_fingerprint])
+
+    def lookup(self, key):
+        '''I return {path: version} of the outputs recorded for `key` \
+        or None'''
+        record = self.directory / key
+        if not record.exists():
+            return None
+        outputs = json.loads(record.content.decode('utf8'))['outputs']
+        if not isinstance(outputs, dict):
+            # recorded without versions
+            return None
+        return outputs
+
+    def is_up_to_date(self, key):
+        outputs = self.lookup(key)
+        if outputs is None:
+            return False
+        return (
+            None not in outputs.values()
+            and output_versions(self.datastore, outputs) == outputs)
+
+    def record(self, key, outputs):
+        '''I record the current versions of the datastore `outputs` \
+        of the run `key`'''
+        versions = output_versions(self.datastore, outputs)
+        log.debug('BuildState: %s -> %s', key, versions)
+        record = dict(outputs=versions)
+        (self.directory / key).content = json.dumps(record).encode('utf8')
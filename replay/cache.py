@@ -0,0 +1,246 @@
+'''I keep the outputs of runs by content, so that the same computation \
+does not have to be done twice - even for different datastore paths.
+
+The cache is a local directory:
+
+- objects/<digest> are the output contents, named by their hash
+- runs/<run fingerprint> map the run's local output names to digests
+
+The modification time of a run record is its last use,
+the least recently used runs are evicted when the cache is over its size.
+'''
+
+import errno
+import functools
+import json
+import logging
+import os
+import time
+import uuid
+
+from replay import compression
+from replay import datastores
+from replay import files
+from replay import fingerprint
+from replay import staging
+
+
+log = logging.getLogger(__name__)
+
+# objects never share an inode with datastore files: a datastore file
+# written in place would change the cache, and making objects read-only
+# would make the datastore file read-only. Copy-on-write clones share
+# storage only.
+RESTORE_STRATEGIES = (staging.REFLINK, staging.COPY)
+STORE_STRATEGIES = (staging.REFLINK, staging.COPY)
+# files not used after storing - and not linked from elsewhere - become
+# the read-only objects themselves
+LINK_STRATEGIES = (staging.HARDLINK, staging.REFLINK, staging.COPY)
+
+# default size limit of the cache in bytes
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+# temporary files older than this are left over from crashed processes
+STALE_TEMPORARY_AGE = 24 * 60 * 60
+# objects not used by any run are kept this long, as a concurrent store
+# might be about to write the run record referring to them
+UNREFERENCED_OBJECT_AGE = 60 * 60
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class OutputCache(object):
+
+    '''I am a content addressed store of run outputs in a local directory.
+
+    If `max_size` is given, I evict old runs after storing new ones.
+    '''
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+    @property
+    def objects_directory(self):
+        return os.path.join(self.directory, 'objects')
+
+    @property
+    def runs_directory(self):
+        return os.path.join(self.directory, 'runs')
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_directory, digest)
+
+    def _run_path(self, key):
+        return os.path.join(self.runs_directory, key)
+
+    def _temporary_path(self, path):
+        return '{}.tmp-{}'.format(path, uuid.uuid4().hex)
+
+    def _write_atomically(self, path, content):
+        files.makedirs(os.path.dirname(path))
+        temporary_path = self._temporary_path(path)
+        with open(temporary_path, 'wb') as f:
+            f.write(content)
+        os.rename(temporary_path, path)
+
+    def lookup(self, key):
+        '''I return the recorded outputs (local name -> digest) of a run'''
+        try:
+            with open(self._run_path(key), 'rb') as f:
+                return json.loads(f.read().decode('utf8'))['outputs']
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+
+    def store(self, key, local_files, digests=None, disposable=False):
+        '''I store the (local name, local path) pairs as outputs of `key`.
+
+        `digests` maps local names to the digests of their content,
+        files without a digest there are hashed.
+        If the files are `disposable` - not used after storing - I link
+        them into the cache instead of copying, making them read-only.
+        Outputs larger than my `max_size` are not stored at all.
+
+        I return True if the outputs were stored.
+        '''
+        local_files = list(local_files)
+        if self.max_size is not None:
+            size = sum(os.path.getsize(path) for _, path in local_files)
+            if size > self.max_size:
+                log.debug(
+                    'OutputCache: %s not stored, %s bytes over the limit',
+                    key, size)
+                return False
+        digests = digests or {}
+        outputs = self.lookup(key) or {}
+        for name, path in local_files:
+            digest = digests.get(name)
+            if digest is None:
+                digest = fingerprint.hash_file(path)
+            self._store_object(digest, path, disposable)
+            outputs[name] = digest
+        record = json.dumps(dict(outputs=outputs), sort_keys=True)
+        self._write_atomically(self._run_path(key), record.encode('utf8'))
+        log.debug('OutputCache: stored %s', key)
+
+        if self.max_size is not None:
+            self.gc(self.max_size)
+        return True
+
+    def _store_object(self, digest, path, disposable):
+        object_path = self._object_path(digest)
+        if os.path.exists(object_path):
+            return
+        strategies = STORE_STRATEGIES
+        if disposable and os.stat(path).st_nlink == 1:
+            strategies = LINK_STRATEGIES
+        temporary_path = self._temporary_path(object_path)
+        strategy = staging.stage(path, temporary_path, strategies)
+        log.debug('OutputCache: %s %s', strategy, path)
+        os.chmod(temporary_path, 0o444)
+        os.rename(temporary_path, object_path)
+
+    def restore(self, key, datastore, outputs, codec=None):
+        '''I put the cached content of `outputs` - (local name, datastore \
+        path) pairs - in place in `datastore`, compressed with `codec` if
+        given.
+
+        A local datastore gets all the files at once (see
+        datastores.Backend.publish): an interrupted restore leaves no
+        partial files.
+
+        I return True if all outputs were available and restored.
+        '''
+        recorded = self.lookup(key)
+        if recorded is None:
+            return False
+        if any(name not in recorded for name, _ in outputs):
+            return False
+        remote = datastores.as_remote(datastore)
+        objects = [
+            (self._object_path(recorded[name]), (remote / path).key)
+            for name, path in outputs]
+        if not all(os.path.exists(path) for path, _ in objects):
+            return False
+
+        log.debug('OutputCache: restore %s', key)
+        write = (
+            functools.partial(compression.compress_to, codec=codec)
+            if codec is not None else None)
+        remote.backend.publish(
+            objects, write=write, strategies=RESTORE_STRATEGIES)
+
+        # mark as recently used
+        os.utime(self._run_path(key), None)
+        return True
+
+    def _listdir(self, directory):
+        if not os.path.isdir(directory):
+            return []
+        return os.listdir(directory)
+
+    def _without_temporary_files(self, directory, names):
+        '''I filter out temporary files, removing the stale ones'''
+        now = time.time()
+        for name in names:
+            path = os.path.join(directory, name)
+            if '.tmp-' in name:
+                if now - os.path.getmtime(path) > STALE_TEMPORARY_AGE:
+                    _remove(path)
+            else:
+                yield name
+
+    def gc(self, max_size):
+        '''I evict least recently used runs until the cache fits \
+        `max_size` bytes, and remove objects no longer used by any run.
+        '''
+        runs = []
+        for key in self._without_temporary_files(
+                self.runs_directory, self._listdir(self.runs_directory)):
+            path = self._run_path(key)
+            try:
+                last_used = os.path.getmtime(path)
+                outputs = self.lookup(key) or {}
+            except OSError:
+                continue
+            runs.append((last_used, key, set(outputs.values())))
+        runs.sort()
+
+        references = {}
+        for _, _, digests in runs:
+            for digest in digests:
+                references[digest] = references.get(digest, 0) + 1
+
+        sizes = {}
+        now = time.time()
+        for digest in self._without_temporary_files(
+                self.objects_directory,
+                self._listdir(self.objects_directory)):
+            object_path = self._object_path(digest)
+            if digest in references:
+                sizes[digest] = os.path.getsize(object_path)
+            elif now - os.path.getmtime(object_path) > UNREFERENCED_OBJECT_AGE:
+                log.debug('OutputCache: remove unused object %s', digest)
+                _remove(object_path)
+        total = sum(sizes.values())
+
+        for _, key, digests in runs:
+            if total <= max_size:
+                break
+            log.debug('OutputCache: evict %s', key)
+            _remove(self._run_path(key))
+            for digest in digests:
+                references[digest] -= 1
+                if not references[digest] and digest in sizes:
+                    _remove(self._object_path(digest))
+                    total -= sizes.pop(digest)
+
+        return total
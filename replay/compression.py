@@ -0,0 +1,175 @@
+'''I compress outputs on their way to the datastore and decompress inputs \
+on their way from it, as streams - without temporary copies.
+
+The codec is recorded in the compressed file itself, so that only the
+files compressed by replay are decompressed - other compressed inputs
+are staged as they are:
+
+- gzip: the gzip header has an extra field with the MARKER subfield,
+  the file is a standard .gz file
+- zstd: a skippable frame with MARKER precedes the compressed frame,
+  the file is a standard .zst file. Compression uses all the cores.
+  zstd needs the optional zstandard package.
+'''
+
+import os
+import struct
+import zlib
+
+from replay import datastores
+from replay import files
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+CODECS = (GZIP, ZSTD)
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# replay's mark in the gzip header and the zstd skippable frame
+MARKER = b'RP'
+FORMAT = 1
+
+_FORMAT_DATA = struct.pack('<B', FORMAT)
+
+# gzip header: magic, deflate, FEXTRA flag, no mtime, unknown OS,
+# then the extra field with the MARKER subfield
+_GZIP_HEADER = (
+    b'\x1f\x8b\x08\x04' + b'\x00\x00\x00\x00' + b'\x00\xff'
+    + struct.pack('<H', 4 + len(_FORMAT_DATA))
+    + MARKER + struct.pack('<H', len(_FORMAT_DATA)) + _FORMAT_DATA)
+
+_ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+_ZSTD_HEADER = (
+    struct.pack('<II', _ZSTD_SKIPPABLE_MAGIC, len(MARKER + _FORMAT_DATA))
+    + MARKER + _FORMAT_DATA)
+
+# bytes at the start of a file telling its codec
+HEADER_SIZE = max(len(_GZIP_HEADER), len(_ZSTD_HEADER))
+
+
+def available_codecs():
+    '''I return the codecs usable here'''
+    if zstandard is None:
+        return (GZIP,)
+    return CODECS
+
+
+def detect(head):
+    '''I return the codec replay compressed a file with, given \
+    its first HEADER_SIZE bytes, or None.
+    '''
+    if head.startswith(_GZIP_HEADER[:3]) and len(head) >= 16:
+        flags = bytearray(head[3:4])[0]
+        if flags & 0x04 and head[12:14] == MARKER:
+            return GZIP
+    if head.startswith(_ZSTD_HEADER):
+        return ZSTD
+    return None
+
+
+def _chunks(stream):
+    while True:
+        chunk = stream.read(files.CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _read_exactly(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ValueError('zstd needs the zstandard package')
+    return zstandard
+
+
+def compress(source, destination, codec):
+    '''I write the content of stream `source` to stream `destination` \
+    compressed with `codec`.
+    '''
+    if codec == GZIP:
+        destination.write(_GZIP_HEADER)
+        compressor = zlib.compressobj(
+            GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        crc = 0
+        size = 0
+        for chunk in _chunks(source):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            destination.write(compressor.compress(chunk))
+        destination.write(compressor.flush())
+        destination.write(
+            struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+    elif codec == ZSTD:
+        compressor = _zstandard().ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+        destination.write(_ZSTD_HEADER)
+        compressor.copy_stream(
+            source, destination, read_size=files.CHUNK_SIZE,
+            write_size=files.CHUNK_SIZE)
+    else:
+        raise ValueError('unknown codec: {}'.format(codec))
+
+
+def decompress(source, destination, codec):
+    '''I write the content of stream `source` compressed by replay \
+    with `codec` to stream `destination`.
+    '''
+    if codec == GZIP:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for chunk in _chunks(source):
+            destination.write(decompressor.decompress(chunk))
+        destination.write(decompressor.flush())
+    elif codec == ZSTD:
+        decompressor = _zstandard().ZstdDecompressor()
+        _read_exactly(source, len(_ZSTD_HEADER))
+        decompressor.copy_stream(
+            source, destination, read_size=files.CHUNK_SIZE,
+            write_size=files.CHUNK_SIZE)
+    else:
+        raise ValueError('unknown codec: {}'.format(codec))
+
+
+def codec_of(external):
+    '''I return the codec replay compressed the datastore `external` with, \
+    or None.
+    '''
+    remote = datastores.as_remote(external)
+    return detect(remote.backend.read(remote.key, 0, HEADER_SIZE))
+
+
+def compress_to(local_path, stream, codec):
+    '''I write the file at `local_path` compressed to `stream`'''
+    with open(local_path, 'rb') as source:
+        compress(source, stream, codec)
+
+
+def upload(local_path, external, codec):
+    '''I write the file at `local_path` compressed to `external`'''
+    with external.writable_stream() as destination:
+        compress_to(local_path, destination, codec)
+
+
+def download(external, local_path, codec):
+    '''I write the content of `external` decompressed to `local_path`'''
+    files.makedirs(os.path.dirname(local_path))
+    # the old file might be a link to the datastore
+    if os.path.lexists(local_path):
+        os.remove(local_path)
+    with external.readable_stream() as source:
+        with open(local_path, 'wb') as destination:
+            decompress(source, destination, codec)
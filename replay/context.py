@@ -1,9 +1,49 @@
+import contextlib
 import inspect
+import sys
+import time
+from multiprocessing.pool import ThreadPool
 
 import yaml
 import zope.dottedname.resolve as dottedname
 
+from replay import exceptions
+from replay import fingerprint
 from replay import plugins
+from replay import report as replay_report
+from replay import staging
+
+
+# key in a plugin spec next to the plugin name: seconds the setup may take
+TIMEOUT_KEY = 'timeout'
+
+# plugins provisioned at the same time at most
+MAX_PROVISION_THREADS = 8
+
+# the libyaml based loader is much faster, when available
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# plugin name -> plugin class
+_plugin_classes = {}
+
+
+if sys.version_info[0] < 3:
+    exec('''def _reraise(exc_type, exc_value, traceback):
+    raise exc_type, exc_value, traceback
+''')
+else:
+    def _reraise(exc_type, exc_value, traceback):
+        raise exc_value.with_traceback(traceback)
+
+
+@contextlib.contextmanager
+def _script_errors():
+    try:
+        yield
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(e, 'error in script')
 
 
 class Context(object):
@@ -12,41 +52,129 @@ class Context(object):
     virtualenv_parent_dir = str
     index_server_url = str
     working_directory = None  # External | TEMPORARY_DIRECTORY
+    output_cache = None  # replay.cache.OutputCache
+    # fingerprint of the current run, used as key in output_cache
+    run_fingerprint = None
+    input_staging = str  # one of replay.staging.STRATEGIES
+    check_inputs = bool
+    # number of files transferred to/from the datastore in parallel
+    transfer_threads = int
+    # bytes of virtualenvs to keep in virtualenv_parent_dir, None: no limit
+    virtualenv_budget = None
+    # directory of wheels to build virtualenvs from, None: no wheel cache
+    wheelhouse = None
+    # build virtualenvs on top of ones with a subset of their dependencies
+    layered_virtualenvs = bool
+    # replay.report.RunReport of the current run, None: not reported
+    report = None
+    # provision plugins in threads, as soon as what they require is set up
+    concurrent_setup = bool
+    # replay.plan_cache.PlanCache of the scripts loaded, None: no cache
+    plan_cache = None
+    # algorithm of the digests of inputs and outputs,
+    # e.g. replay.fingerprint.FAST_ALGORITHM
+    hash_algorithm = str
+    # replay.hash_cache.HashCache of local files, None: no cache
+    hash_cache = None
+    # codec of the outputs in the datastore, None: not compressed,
+    # see replay.compression
+    compression = None
+    # local directory for the logs of the run, outliving the working
+    # directory, None: a new temporary directory
+    log_directory = None
 
     def __init__(
             self,
             datastore,
             virtualenv_parent_dir,
             working_directory,
-            index_server_url=None):
+            index_server_url=None,
+            output_cache=None,
+            input_staging=staging.COPY,
+            check_inputs=False,
+            transfer_threads=4,
+            virtualenv_budget=None,
+            wheelhouse=None,
+            layered_virtualenvs=True,
+            concurrent_setup=True,
+            plan_cache=None,
+            hash_algorithm=fingerprint.ALGORITHM,
+            hash_cache=None,
+            compression=None):
         self.datastore = datastore
         self.virtualenv_parent_dir = virtualenv_parent_dir
         self.working_directory = working_directory
         self.index_server_url = index_server_url
+        self.output_cache = output_cache
+        self.input_staging = input_staging
+        self.check_inputs = check_inputs
+        self.transfer_threads = transfer_threads
+        self.virtualenv_budget = virtualenv_budget
+        self.wheelhouse = wheelhouse
+        self.layered_virtualenvs = layered_virtualenvs
+        self.concurrent_setup = concurrent_setup
+        self.plan_cache = plan_cache
+        self.hash_algorithm = hash_algorithm
+        self.hash_cache = hash_cache
+        self.compression = compression
 
     def load_plugins(self, script_file):
-        try:
-            for raw_spec in yaml.load_all(script_file, Loader=yaml.SafeLoader):
+        with _script_errors():
+            for raw_spec in yaml.load_all(script_file, Loader=YAML_LOADER):
                 yield self.load_plugin(raw_spec)
-        except ValueError:
-            raise
-        except Exception as e:
-            raise ValueError(e, 'error in script')
+
+    def load_script(self, path):
+        '''I return the plugins of the script at `path`.
+
+        With a plan_cache, the specs are parsed only when the script
+        has changed since it was last loaded.
+        '''
+        if self.plan_cache is None:
+            with open(path) as script_file:
+                return list(self.load_plugins(script_file))
+
+        parsed = []
+
+        def parse(content):
+            with _script_errors():
+                raw_specs = list(yaml.load_all(content, Loader=YAML_LOADER))
+                parsed.append([
+                    self.load_plugin(raw_spec) for raw_spec in raw_specs])
+            return raw_specs
+
+        raw_specs = self.plan_cache.load(path, parse)
+        if parsed:
+            return parsed[0]
+        with _script_errors():
+            return [self.load_plugin(raw_spec) for raw_spec in raw_specs]
 
     def load_plugin(self, raw_spec):
         if not isinstance(raw_spec, dict):
             msg = 'script is not a mapping from plugin name to attributes'
             raise ValueError(msg)
+        raw_spec = dict(raw_spec)
+        timeout = raw_spec.pop(TIMEOUT_KEY, None)
         if len(raw_spec) != 1:
             msg = (
                 'script contains a plugin spec with multiple keys: '
                 + repr(raw_spec.keys()))
             raise ValueError(msg)
+        if timeout is not None and not (
+                isinstance(timeout, (int, float))
+                and not isinstance(timeout, bool)
+                and timeout > 0):
+            raise ValueError('timeout is not a positive number of seconds')
         plugin_name, = raw_spec.keys()
         plugin_class = self.resolve_plugin_class(plugin_name)
-        return plugin_class(self, raw_spec[plugin_name])
+        plugin = plugin_class(self, raw_spec[plugin_name])
+        if timeout is not None:
+            plugin.timeout = timeout
+        return plugin
 
     def resolve_plugin_class(self, plugin_name):
+        if plugin_name in _plugin_classes:
+            return _plugin_classes[plugin_name]
+
         try:
             plugin_class = dottedname.resolve(plugin_name)
         except ImportError as e:
@@ -60,11 +188,122 @@ class Context(object):
                 and issubclass(plugin_class, plugins.Plugin)):
             raise ValueError('{} is not a Plugin'.format(plugin_name))
 
+        _plugin_classes[plugin_name] = plugin_class
         return plugin_class
 
     def run(self, plugins):
-        '''I run scripts in isolation'''
+        '''I run scripts in isolation.
+
+        All plugins are prepared first, then entered in order, then
+        the entered ones are exited in reverse order - also on errors,
+        like nested with statements would do.
+
+        With concurrent_setup, the provision of plugins declaring their
+        requirements is started in threads as soon as the plugins before
+        them providing these are entered. Entering - changing the working
+        directory and the environment - still happens in order.
+        '''
+
+        for plugin in plugins:
+            plugin.prepare()
+
+        provisions = {}
+        pool = None
+        if self.concurrent_setup:
+            waiting = self._provision_schedule(plugins)
+            if waiting:
+                pool = ThreadPool(
+                    min(
+                        MAX_PROVISION_THREADS,
+                        sum(len(v) for v in waiting.values())))
+
+        def start_provisions(after):
+            for index in waiting.pop(after, []):
+                self._start_deadline(plugins[index])
+                provisions[index] = pool.apply_async(
+                    self._provision, (plugins[index],))
+
+        entered = []
+        exc_info = (None, None, None)
+        try:
+            if pool is not None:
+                start_provisions(-1)
+            for index, plugin in enumerate(plugins):
+                if index in provisions:
+                    provisions[index].get()
+                else:
+                    self._start_deadline(plugin)
+                self._timed(plugin).__enter__()
+                entered.append(index)
+                if pool is not None:
+                    start_provisions(index)
+                self._check_deadline(plugin)
+        except:
+            exc_info = sys.exc_info()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        # provisioned plugins have to be cleaned up, even if not entered
+        to_exit = sorted(
+            set(entered)
+            | set(
+                index
+                for index, provision in provisions.items()
+                if provision.successful()))
+        while to_exit:
+            plugin = plugins[to_exit.pop()]
+            # the timeout is of the setup
+            plugin.deadline = None
+            try:
+                suppressed = self._timed(plugin).__exit__(*exc_info)
+            except:
+                exc_info = sys.exc_info()
+            else:
+                if suppressed:
+                    exc_info = (None, None, None)
+
+        if exc_info[0] is not None:
+            _reraise(*exc_info)
+
+    def _provision_schedule(self, plugins):
+        '''I return {index: [indices of plugins to provision]}, \
+        where the plugins can be provisioned after the plugin at index
+        is entered, -1 meaning at the start.
+        '''
+        waiting = {}
+        last_provider = {}
+        for index, plugin in enumerate(plugins):
+            if plugin.requires is not None:
+                after = max(
+                    [last_provider.get(resource, -1)
+                     for resource in plugin.requires] + [-1])
+                waiting.setdefault(after, []).append(index)
+            for resource in plugin.provides:
+                last_provider[resource] = index
+        return waiting
+
+    def _provision(self, plugin):
+        start = time.time()
+        try:
+            plugin.provision_once()
+        finally:
+            if self.report is not None:
+                self.report.add_phase(
+                    plugin, replay_report.PROVISION, time.time() - start)
+
+    def _start_deadline(self, plugin):
+        if plugin.timeout is not None:
+            plugin.deadline = time.time() + plugin.timeout
+
+    def _check_deadline(self, plugin):
+        if plugin.deadline is not None and time.time() > plugin.deadline:
+            raise exceptions.Timeout(
+                '{} did not finish its setup in {} seconds'.format(
+                    plugin.__class__.__name__, plugin.timeout))
 
-        if plugins:
-            with plugins[0]:
-                self.run(plugins[1:])
+    def _timed(self, plugin):
+        if self.report is None:
+            return plugin
+        return self.report.timed(plugin)
@@ -0,0 +1,828 @@
+'''I give access to datastores, local or remote, through one interface.
+
+A Backend stores files under keys - posix paths relative to its root:
+
+- FileBackend: a local directory, where files are what they always were
+- HTTPBackend: an object store speaking the simple HTTP protocol below,
+  over a pool of kept-alive connections, transferring large files
+  in parts, concurrently
+- ExternalBackend: any other External, e.g. externals.Memory
+
+Remote is a path in a Backend, usable as context.datastore wherever
+an externals.File is (remote / 'a/b', exists(), content, ...).
+Local datastores remain externals.File objects, as_remote gives any
+datastore as a Remote, so that its users have one code path.
+
+The HTTP protocol, keys are relative to the base URL:
+
+- HEAD key: 200 with Content-Length and ETag, 404 if missing
+- GET key, optionally with a Range header: the content (206 for ranges)
+- PUT key: stores the body as the content
+- GET ?prefix=p[&delimiter=/][&marker=m]: a page of the keys starting with p,
+  after m, as JSON {"keys": [{"key", "size", "etag"}], "prefixes": [...],
+  "next_marker"}. With a delimiter, keys with it after p are rolled up
+  into "prefixes" (p up to and including the delimiter).
+  "next_marker" is the marker of the next page, null on the last one.
+- POST key?uploads: starts a multi-part upload, returns JSON {"upload_id"}
+- PUT key?upload_id=u&part=n: stores part n (from 1) of the upload
+- POST key?upload_id=u&parts=n: makes key the concatenation of parts 1..n
+'''
+
+import abc
+import collections
+import contextlib
+import errno
+import hashlib
+import io
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+import socket
+import stat as stat_module
+import threading
+import uuid
+
+try:
+    import httplib
+except ImportError:  # python 3
+    import http.client as httplib
+
+try:
+    import queue
+except ImportError:  # pragma: nocover
+    import Queue as queue
+
+try:
+    from urllib import quote
+    from urlparse import urlsplit
+except ImportError:  # python 3
+    from urllib.parse import quote, urlsplit
+
+import externals
+
+from replay import exceptions
+from replay import files
+from replay import staging
+
+
+log = logging.getLogger(__name__)
+
+# files larger than this are transferred in parts of this size
+PART_SIZE = 8 * 1024 * 1024
+
+# connections kept open to a server
+CONNECTIONS = 8
+
+# seconds to wait for a server
+TIMEOUT = 60
+
+# requests that can be sent again when the connection fails
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT'])
+
+# directory of a local datastore where files are put before they are
+# renamed into place
+STAGING_DIRECTORY = '.replay/staging'
+
+# how files are staged for publishing
+PUBLISH_STRATEGIES = (staging.HARDLINK, staging.COPY)
+
+# size: bytes, version: changes when the content changes
+Stat = collections.namedtuple('Stat', ['size', 'version'])
+
+
+def _parent(key):
+    return posixpath.dirname(key)
+
+
+def _ranges(size, part_size):
+    '''I return the (offset, length) parts of `size` bytes'''
+    return [
+        (offset, min(part_size, size - offset))
+        for offset in range(0, size, part_size)]
+
+
+class Backend(object):
+
+    '''I am the storage behind a datastore'''
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def stat(self, key):
+        '''I return the Stat of the file at `key` or None'''
+
+    @abc.abstractmethod
+    def list(self, directory=''):
+        '''I yield the keys of the files under `directory`'''
+
+    @abc.abstractmethod
+    def children(self, directory=''):
+        '''I yield the keys of the files and directories in `directory`'''
+
+    def missing(self, keys):
+        '''I return the set of `keys` without a file or directory'''
+        keys = set(keys)
+        existing = set()
+        for directory in set(_parent(key) for key in keys):
+            existing.update(self.children(directory))
+        return keys - existing
+
+    @abc.abstractmethod
+    def read(self, key, offset=0, length=None):
+        '''I return `length` bytes (default: all) of `key` from `offset`'''
+
+    @abc.abstractmethod
+    def open_read(self, key):
+        '''I return a readable stream of `key`'''
+
+    @abc.abstractmethod
+    def open_write(self, key):
+        '''I return a writable stream for `key`, to be closed when done'''
+
+    def local_path(self, key):
+        '''I return the local path of the file at `key`, None if it is \
+        not a local file.
+        '''
+        return None
+
+    def download(self, key, local_path, threads=1):
+        '''I copy `key` to `local_path`'''
+        files.makedirs(os.path.dirname(local_path))
+        with contextlib.closing(self.open_read(key)) as source:
+            with open(local_path, 'wb') as destination:
+                shutil.copyfileobj(source, destination, PART_SIZE)
+
+    def upload(self, local_path, key, threads=1):
+        '''I copy `local_path` to `key`'''
+        with open(local_path, 'rb') as source:
+            with contextlib.closing(self.open_write(key)) as destination:
+                shutil.copyfileobj(source, destination, PART_SIZE)
+
+    def publish(
+            self, pairs, threads=1, write=None,
+            strategies=PUBLISH_STRATEGIES):
+        '''I store the (local path, key) pairs, `threads` at a time.
+
+        `write(local path, stream)` writes the content to store if given
+        (e.g. compressed), the local files are stored as they are
+        otherwise. Local backends put all the files in place at once,
+        staged with `strategies` (see replay.staging).
+        '''
+        def put(pair):
+            local_path, key = pair
+            if write is None:
+                self.upload(local_path, key, threads)
+            else:
+                with Remote(self, key).writable_stream() as stream:
+                    write(local_path, stream)
+
+        staging.map_in_parallel(put, pairs, threads)
+
+
+class FileBackend(Backend):
+
+    '''I am a datastore in a local directory.
+
+    Downloads are staged with `strategy` (see replay.staging).
+    '''
+
+    def __init__(self, root, strategy=staging.COPY):
+        self.root = root
+        self.strategy = strategy
+
+    def __str__(self):
+        return self.root
+
+    def _path(self, key):
+        return os.path.join(self.root, key) if key else self.root
+
+    def stat(self, key):
+        try:
+            stat = os.stat(self._path(key))
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            return None
+        return Stat(stat.st_size, (stat.st_mtime, stat.st_ino))
+
+    def list(self, directory=''):
+        top = self._path(directory)
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            relpath = os.path.relpath(dirpath, self.root)
+            for filename in sorted(filenames):
+                yield posixpath.normpath(
+                    posixpath.join(relpath.replace(os.sep, '/'), filename))
+
+    def children(self, directory=''):
+        try:
+            names = os.listdir(self._path(directory))
+        except OSError:
+            return
+        for name in sorted(names):
+            yield posixpath.join(directory, name)
+
+    def missing(self, keys):
+        # one listing of each directory, instead of a stat of each file
+        names_in = {}
+        for key in set(keys):
+            directory, name = posixpath.split(key)
+            names_in.setdefault(directory, []).append(name)
+        missing = set()
+        for directory, names in names_in.items():
+            try:
+                existing = set(os.listdir(self._path(directory)))
+            except OSError:
+                existing = set()
+            missing.update(
+                posixpath.join(directory, name)
+                for name in names
+                if name not in existing)
+        return missing
+
+    def read(self, key, offset=0, length=None):
+        with open(self._path(key), 'rb') as f:
+            f.seek(offset)
+            return f.read() if length is None else f.read(length)
+
+    def open_read(self, key):
+        return open(self._path(key), 'rb')
+
+    def open_write(self, key):
+        files.makedirs(os.path.dirname(self._path(key)))
+        return open(self._path(key), 'wb')
+
+    def local_path(self, key):
+        return self._path(key)
+
+    def download(self, key, local_path, threads=1):
+        staging.stage(self._path(key), local_path, self.strategy)
+
+    def upload(self, local_path, key, threads=1):
+        files.makedirs(os.path.dirname(self._path(key)))
+        shutil.copyfile(local_path, self._path(key))
+
+    def publish(
+            self, pairs, threads=1, write=None,
+            strategies=PUBLISH_STRATEGIES):
+        # files are replaced, not written in place:
+        # readers never see partial files
+        def put(local_path, staged_path):
+            if write is not None:
+                with open(staged_path, 'wb') as stream:
+                    write(local_path, stream)
+                return
+            strategy = staging.stage(local_path, staged_path, strategies)
+            log.debug('FileBackend: %s %s', strategy, local_path)
+            if strategy != staging.HARDLINK:
+                # the copy has the mode of the source, maybe read-only
+                os.chmod(
+                    staged_path,
+                    os.stat(staged_path).st_mode | stat_module.S_IWUSR)
+
+        staging.publish(
+            [(local_path, self._path(key)) for local_path, key in pairs],
+            self._path(posixpath.join(STAGING_DIRECTORY, uuid.uuid4().hex)),
+            threads,
+            put)
+
+
+class _ContentWriter(io.BytesIO):
+
+    '''I am a writable stream setting the content of an External \
+    when closed'''
+
+    def __init__(self, external):
+        super(_ContentWriter, self).__init__()
+        self.external = external
+
+    def discard(self):
+        super(_ContentWriter, self).close()
+
+    def close(self):
+        if not self.closed:
+            self.external.content = self.getvalue()
+        super(_ContentWriter, self).close()
+
+
+class ExternalBackend(Backend):
+
+    '''I am a datastore in any other External, buffering contents \
+    in memory. The version of a file is the digest of its content.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def __str__(self):
+        return str(self.root)
+
+    def _external(self, key):
+        return self.root / key if key else self.root
+
+    def stat(self, key):
+        external = self._external(key)
+        if not external.is_file():
+            return None
+        size = 0
+        digest = hashlib.sha1()
+        with external.readable_stream() as stream:
+            for chunk in iter(lambda: stream.read(files.CHUNK_SIZE), b''):
+                size += len(chunk)
+                digest.update(chunk)
+        return Stat(size, digest.hexdigest())
+
+    def list(self, directory=''):
+        for key in self.children(directory):
+            if self._external(key).is_file():
+                yield key
+            else:
+                for subkey in self.list(key):
+                    yield subkey
+
+    def children(self, directory=''):
+        external = self._external(directory)
+        if not external.exists() or external.is_file():
+            return
+        for child in sorted(external.children(), key=lambda e: e.name):
+            yield posixpath.join(directory, child.name)
+
+    def read(self, key, offset=0, length=None):
+        data = b''
+        with self._external(key).readable_stream() as stream:
+            while length is None or len(data) < offset + length:
+                size = -1 if length is None else offset + length - len(data)
+                chunk = stream.read(size)
+                if not chunk:
+                    break
+                data += chunk
+        return data[offset:] if length is None else data[offset:][:length]
+
+    def open_read(self, key):
+        return io.BytesIO(self._external(key).content)
+
+    def open_write(self, key):
+        return _ContentWriter(self._external(key))
+
+
+class ConnectionPool(object):
+
+    '''I keep at most `size` connections to a server, reusing idle ones'''
+
+    def __init__(self, scheme, host, port, size=CONNECTIONS, timeout=TIMEOUT):
+        if scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        log.debug('ConnectionPool: connecting to %s:%s', self.host, self.port)
+        return self.connection_class(
+            self.host, self.port, timeout=self.timeout)
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''I lend a connection, broken ones are not reused'''
+        self.slots.acquire()
+        try:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            except:
+                connection.close()
+                raise
+            self.idle.put(connection)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class _RangeReader(io.RawIOBase):
+
+    '''I read a key of an HTTPBackend part by part'''
+
+    def __init__(self, backend, key):
+        self.backend = backend
+        self.key = key
+        self.offset = 0
+        self.buffer = b''
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self.buffer]
+            self.buffer = b''
+            while not self.eof:
+                chunks.append(self._fetch())
+            return b''.join(chunks)
+        while len(self.buffer) < size and not self.eof:
+            self.buffer += self._fetch()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def _fetch(self):
+        data = self.backend.read(self.key, self.offset, self.backend.part_size)
+        self.offset += len(data)
+        if len(data) < self.backend.part_size:
+            self.eof = True
+        return data
+
+
+class _PartWriter(io.RawIOBase):
+
+    '''I write a key of an HTTPBackend: small contents at once, \
+    large ones as a multi-part upload of full parts, as they fill.
+    '''
+
+    def __init__(self, backend, key):
+        self.backend = backend
+        self.key = key
+        self.buffer = []
+        self.buffered = 0
+        self.upload_id = None
+        self.parts = 0
+        self.discarded = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        part_size = self.backend.part_size
+        if self.buffered >= part_size:
+            content = b''.join(self.buffer)
+            while len(content) >= part_size:
+                self._put_part(content[:part_size])
+                content = content[part_size:]
+            self.buffer = [content]
+            self.buffered = len(content)
+        return len(data)
+
+    def _put_part(self, content):
+        if self.upload_id is None:
+            self.upload_id = self.backend._start_upload(self.key)
+        self.parts += 1
+        self.backend._put_part(self.key, self.upload_id, self.parts, content)
+
+    def discard(self):
+        '''I close without storing anything'''
+        self.discarded = True
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.discarded:
+            self.buffer = []
+            super(_PartWriter, self).close()
+            return
+        try:
+            content = b''.join(self.buffer)
+            if self.upload_id is None:
+                self.backend._put(self.key, content)
+            else:
+                if content:
+                    self._put_part(content)
+                self.backend._complete_upload(
+                    self.key, self.upload_id, self.parts)
+        finally:
+            self.buffer = []
+            super(_PartWriter, self).close()
+
+
+class HTTPBackend(Backend):
+
+    '''I am a datastore in an object store at `url`'''
+
+    def __init__(
+            self, url, connections=CONNECTIONS, part_size=PART_SIZE,
+            timeout=TIMEOUT):
+        self.url = url.rstrip('/')
+        parts = urlsplit(self.url)
+        self.base_path = parts.path.rstrip('/')
+        self.part_size = part_size
+        self.pool = ConnectionPool(
+            parts.scheme, parts.hostname, parts.port, connections, timeout)
+
+    def __str__(self):
+        return self.url
+
+    def _target(self, key, query=None):
+        target = self.base_path + '/' + quote(key.encode('utf8'))
+        if query:
+            target += '?' + query
+        return target
+
+    def _request(
+            self, method, key, query=None, body=None, headers=None,
+            expect=(200,)):
+        '''I return (status, headers, body) of the response'''
+        target = self._target(key, query)
+        headers = dict(headers or {})
+        if body is not None:
+            headers['Content-Length'] = str(len(body))
+        # an idle connection might have been closed by the server:
+        # idempotent requests are retried once on a new connection,
+        # the others might have been carried out and are not
+        attempts = 2 if method in IDEMPOTENT_METHODS else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.pool.connection() as connection:
+                    connection.request(method, target, body, headers)
+                    response = connection.getresponse()
+                    content = response.read()
+                    if response.getheader('connection') == 'close':
+                        connection.close()
+                break
+            except (httplib.HTTPException, socket.error) as e:
+                log.debug('HTTPBackend: %s %s failed: %s', method, target, e)
+                if attempt == attempts:
+                    raise exceptions.DatastoreError(
+                        '{} {}{}: {}'.format(method, self.url, target, e))
+        if response.status not in expect:
+            raise exceptions.DatastoreError(
+                '{} {}{}: {} {}'.format(
+                    method, self.url, target, response.status,
+                    response.reason))
+        return (
+            response.status,
+            dict((k.lower(), v) for k, v in response.getheaders()),
+            content)
+
+    def stat(self, key):
+        status, headers, _ = self._request('HEAD', key, expect=(200, 404))
+        if status == 404:
+            return None
+        return Stat(int(headers['content-length']), headers.get('etag'))
+
+    def _pages(self, directory, delimiter=None):
+        '''I yield the pages of the listing of `directory`'''
+        prefix = directory.rstrip('/') + '/' if directory else ''
+        query = 'prefix=' + quote(prefix.encode('utf8'))
+        if delimiter:
+            query += '&delimiter=' + quote(delimiter)
+        marker = None
+        while True:
+            _, _, content = self._request(
+                'GET', '',
+                query if marker is None
+                else query + '&marker=' + quote(marker.encode('utf8')))
+            page = json.loads(content.decode('utf8'))
+            yield page
+            marker = page.get('next_marker')
+            if not marker:
+                break
+
+    def list(self, directory=''):
+        for page in self._pages(directory):
+            for entry in page['keys']:
+                yield entry['key']
+
+    def children(self, directory=''):
+        for page in self._pages(directory, '/'):
+            for entry in page['keys']:
+                yield entry['key']
+            for prefix in page['prefixes']:
+                yield prefix.rstrip('/')
+
+    def read(self, key, offset=0, length=None):
+        headers = {}
+        if offset or length is not None:
+            end = '' if length is None else str(offset + length - 1)
+            headers['Range'] = 'bytes={}-{}'.format(offset, end)
+        status, _, content = self._request(
+            'GET', key, headers=headers, expect=(200, 206, 416))
+        if status == 416:
+            # offset at the end
+            return b''
+        if status == 200 and headers:
+            # the server ignored the range
+            content = content[offset:]
+            if length is not None:
+                content = content[:length]
+        return content
+
+    def open_read(self, key):
+        if self.stat(key) is None:
+            raise IOError(errno.ENOENT, 'no such key', key)
+        return io.BufferedReader(_RangeReader(self, key), self.part_size)
+
+    def open_write(self, key):
+        return _PartWriter(self, key)
+
+    def _put(self, key, content):
+        self._request('PUT', key, body=content, expect=(200, 201, 204))
+
+    def _start_upload(self, key):
+        _, _, content = self._request('POST', key, 'uploads')
+        return json.loads(content.decode('utf8'))['upload_id']
+
+    def _put_part(self, key, upload_id, part, content):
+        self._request(
+            'PUT', key, 'upload_id={}&part={}'.format(upload_id, part),
+            body=content, expect=(200, 201, 204))
+
+    def _complete_upload(self, key, upload_id, parts):
+        self._request(
+            'POST', key, 'upload_id={}&parts={}'.format(upload_id, parts),
+            expect=(200, 201, 204))
+
+    def download(self, key, local_path, threads=1):
+        '''I copy `key` to `local_path`, large files in parts concurrently'''
+        stat = self.stat(key)
+        if stat is None:
+            raise IOError(errno.ENOENT, 'no such key', key)
+        files.makedirs(os.path.dirname(local_path))
+        if stat.size <= self.part_size:
+            with open(local_path, 'wb') as f:
+                f.write(self.read(key))
+            return
+
+        with open(local_path, 'wb') as f:
+            f.truncate(stat.size)
+
+        def download_part(part):
+            offset, length = part
+            content = self.read(key, offset, length)
+            if len(content) != length:
+                raise exceptions.DatastoreError(
+                    '{}: short read at {}'.format(key, offset))
+            with open(local_path, 'r+b') as f:
+                f.seek(offset)
+                f.write(content)
+        staging.map_in_parallel(
+            download_part, _ranges(stat.size, self.part_size), threads)
+
+    def upload(self, local_path, key, threads=1):
+        '''I copy `local_path` to `key`, large files in parts concurrently'''
+        size = os.path.getsize(local_path)
+        if size <= self.part_size:
+            with open(local_path, 'rb') as f:
+                self._put(key, f.read())
+            return
+
+        upload_id = self._start_upload(key)
+        parts = _ranges(size, self.part_size)
+
+        def upload_part(numbered_part):
+            number, (offset, length) = numbered_part
+            with open(local_path, 'rb') as f:
+                f.seek(offset)
+                content = f.read(length)
+            self._put_part(key, upload_id, number, content)
+        staging.map_in_parallel(
+            upload_part, enumerate(parts, 1), threads)
+        self._complete_upload(key, upload_id, len(parts))
+
+
+class Remote(object):
+
+    '''I am a file or directory in a Backend, \
+    with the interface replay uses of externals.File.
+    '''
+
+    def __init__(self, backend, key=''):
+        self.backend = backend
+        self.key = key
+
+    def __div__(self, name):
+        key = posixpath.normpath(posixpath.join(self.key, name.lstrip('/')))
+        return Remote(self.backend, '' if key == '.' else key)
+    __truediv__ = __div__
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Remote)
+            and (self.backend, self.key) == (other.backend, other.key))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.backend), self.key))
+
+    def __str__(self):
+        return '{}/{}'.format(self.backend, self.key)
+
+    def __repr__(self):
+        return 'Remote({!r})'.format(str(self))
+
+    @property
+    def name(self):
+        return posixpath.basename(self.key)
+
+    def parent(self):
+        return Remote(self.backend, _parent(self.key))
+
+    def stat(self):
+        return self.backend.stat(self.key)
+
+    def is_file(self):
+        return self.stat() is not None
+
+    def is_dir(self):
+        for _ in self.backend.list(self.key):
+            return True
+        return False
+
+    def exists(self):
+        return self.is_file() or self.is_dir()
+
+    def missing(self, paths):
+        '''I return the set of `paths` relative to me not existing'''
+        keys = dict(
+            (posixpath.join(self.key, path) if self.key else path, path)
+            for path in paths)
+        return set(keys[key] for key in self.backend.missing(keys))
+
+    @contextlib.contextmanager
+    def readable_stream(self):
+        with contextlib.closing(self.backend.open_read(self.key)) as stream:
+            yield stream
+
+    @contextlib.contextmanager
+    def writable_stream(self):
+        stream = self.backend.open_write(self.key)
+        try:
+            yield stream
+        except:
+            # incomplete content is not stored, when possible
+            getattr(stream, 'discard', stream.close)()
+            raise
+        stream.close()
+
+    @property
+    def content(self):
+        with self.readable_stream() as stream:
+            return stream.read()
+
+    @content.setter
+    def content(self, content):
+        with self.writable_stream() as stream:
+            stream.write(content)
+
+    def download(self, local_path, threads=1):
+        self.backend.download(self.key, local_path, threads)
+
+    def upload(self, local_path, threads=1):
+        self.backend.upload(local_path, self.key, threads)
+
+    def copy_to(self, other):
+        if isinstance(other, externals.File):
+            self.download(other.path)
+        else:
+            with self.readable_stream() as source:
+                with other.writable_stream() as destination:
+                    shutil.copyfileobj(source, destination, PART_SIZE)
+
+
+def is_url(location):
+    return re.match(r'^https?://', location) is not None
+
+
+def as_remote(datastore, strategy=staging.COPY):
+    '''I return the `datastore` External as a Remote: a local directory \
+    in a FileBackend staging downloads with `strategy`, another External
+    in an ExternalBackend.
+    '''
+    if isinstance(datastore, Remote):
+        return datastore
+    if isinstance(datastore, externals.File):
+        return Remote(FileBackend(datastore.path, strategy))
+    return Remote(ExternalBackend(datastore))
+
+
+def open_datastore(location, connections=CONNECTIONS):
+    '''I return the datastore at `location`: a Remote for http(s) URLs, \
+    an externals.File for local paths.
+    '''
+    if is_url(location):
+        return Remote(HTTPBackend(location, connections))
+    return externals.File(location)
@@ -3,6 +3,11 @@ class MissingInput(Exception):
     '''A required input file is missing'''
 
 
+class ModifiedInput(Exception):
+
+    '''An input file in the DataStore was modified during the run'''
+
+
 class MissingOutput(Exception):
 
     '''A specified output file is missing'''
@@ -13,6 +18,21 @@ class MissingPythonDependency(Exception):
     '''A python dependency can not be installed'''
 
 
+class DatabaseError(Exception):
+
+    '''A database for the script can not be provided'''
+
+
+class Timeout(Exception):
+
+    '''A plugin did not finish its setup within its timeout'''
+
+
 class ScriptError(Exception):
 
     '''The script terminated with an error'''
+
+
+class DatastoreError(Exception):
+
+    '''The datastore failed to serve a request'''
@@ -1,16 +1,58 @@
+import collections
+import errno
+import math
+import multiprocessing
+import os
+import resource
+import select
+import shutil
+import signal
 import subprocess
+import time
 
 
 PIPE = subprocess.PIPE
 
+# bytes read from a pipe at once
+PIPE_READ_SIZE = 64 * 1024
+# bytes of stdout/stderr kept in memory for the Result
+TAIL_SIZE = 64 * 1024
+# seconds between checks of a process, that closed its outputs,
+# but has not exited yet
+MIN_POLL_INTERVAL = 0.001
+MAX_POLL_INTERVAL = 0.1
+# seconds to read what a killed process left in its outputs: a descendant
+# outside of its process group might keep them open
+KILLED_DRAIN_TIMEOUT = 5
+
+# seconds over which the load of the CPUs is measured, to choose the least
+# loaded ones for a number of CPUs
+CPU_LOAD_INTERVAL = 0.05
+
+# Limits.io_priority of a process doing I/O only when the disk is idle
+IO_IDLE = 'idle'
+# best-effort I/O priority levels, 0 is the highest
+IO_LEVELS = range(8)
+
 
 class Result(object):
 
-    def __init__(self, cmdspec, status, stdout, stderr):
+    def __init__(
+            self, cmdspec, status, stdout, stderr,
+            stdout_log=None, stderr_log=None, resource_usage=None,
+            timed_out=False, limits=None):
         self.cmdspec = cmdspec
         self.status = status
         self.stdout = stdout
         self.stderr = stderr
+        self.stdout_log = stdout_log
+        self.stderr_log = stderr_log
+        # ResourceUsage of the process and its waited for descendants
+        self.resource_usage = resource_usage
+        # the process was killed as it did not finish in time
+        self.timed_out = timed_out
+        # Limits the process ran with
+        self.limits = limits
 
     def __str__(self):
         def indent(text):
@@ -24,25 +66,418 @@ class Result(object):
                 yield indent(str(self.cmdspec))
             yield u'STATUS:'
             yield indent(str(self.status))
+            if self.timed_out:
+                yield indent(u'killed: timed out')
             if self.stdout:
                 yield u'STDOUT:'
-                yield indent(self.stdout.decode('utf8'))
+                yield indent(self.stdout.decode('utf8', 'replace'))
+            if self.stdout_log:
+                yield u'STDOUT LOG:'
+                yield indent(self.stdout_log)
             if self.stderr:
                 yield u'STDERR:'
-                yield indent(self.stderr.decode('utf8'))
+                yield indent(self.stderr.decode('utf8', 'replace'))
+            if self.stderr_log:
+                yield u'STDERR LOG:'
+                yield indent(self.stderr_log)
         return u'\n'.join(fragments())
 
 
-def run(args_list, env=None, cwd=None):
-    process = subprocess.Popen(
-        args_list, env=env, cwd=cwd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    process.stdin.close()
-    process.wait()
+class ResourceUsage(object):
+
+    '''I am the time, memory and I/O used by a process'''
+
+    def __init__(
+            self, wall_time, user_time, system_time, max_rss,
+            block_reads=None, block_writes=None):
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        # peak resident set size in kilobytes
+        self.max_rss = max_rss
+        # file system blocks read and written, not counting the page cache
+        self.block_reads = block_reads
+        self.block_writes = block_writes
+
+    def as_dict(self):
+        usage = {
+            'wall time': self.wall_time,
+            'user time': self.user_time,
+            'system time': self.system_time,
+            'max rss': self.max_rss,
+        }
+        if self.block_reads is not None:
+            usage['block reads'] = self.block_reads
+            usage['block writes'] = self.block_writes
+        return usage
+
+
+def _available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def _cpu_times():
+    '''I return {CPU id: (busy, total) time} from /proc/stat, \
+    {} if not available.
+    '''
+    times = {}
+    try:
+        with open('/proc/stat') as f:
+            for line in f:
+                fields = line.split()
+                if not (fields[0].startswith('cpu') and fields[0][3:]):
+                    continue
+                values = [int(value) for value in fields[1:]]
+                # idle and iowait
+                idle = sum(values[3:5])
+                times[int(fields[0][3:])] = (sum(values) - idle, sum(values))
+    except (IOError, OSError, ValueError, IndexError):
+        return {}
+    return times
+
+
+def _least_loaded_cpus(count):
+    '''I return the ids of the `count` least loaded available CPUs.
+
+    The load is measured over CPU_LOAD_INTERVAL, in steps of 10%:
+    CPUs of the same load are taken in an order rotated by the process
+    id, so that runs started together spread over the machine.
+    '''
+    available = _available_cpus()
+    before = _cpu_times()
+    if before:
+        time.sleep(CPU_LOAD_INTERVAL)
+    after = _cpu_times()
+    offset = os.getpid() % len(available)
+
+    def load(indexed_cpu):
+        index, cpu = indexed_cpu
+        busy, total = [
+            now - then
+            for now, then in zip(
+                after.get(cpu, (0, 0)), before.get(cpu, (0, 0)))]
+        return (
+            round(float(busy) / total, 1) if total > 0 else 0,
+            (index - offset) % len(available))
+    chosen = sorted(enumerate(available), key=load)[:count]
+    return sorted(cpu for _, cpu in chosen)
+
+
+def find_executable(name):
+    '''I return the path of the command `name` on PATH, None if not found'''
+    if hasattr(shutil, 'which'):
+        return shutil.which(name)
+    # python 2
+    for directory in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def _executable(name):
+    path = find_executable(name)
+    if path is None:
+        raise ValueError('{} command not found'.format(name))
+    return path
+
+
+class Limits(object):
+
+    '''I am the resources a process and its descendants may use.
+
+    - cpus: the number of CPUs, or the list of CPU ids to run on.
+      With a number, the least loaded available CPUs are chosen once,
+      when first needed (see _least_loaded_cpus).
+    - memory: bytes of address space of each process (RLIMIT_AS)
+    - open_files: open file descriptors of each process (RLIMIT_NOFILE)
+    - nice: increment of the scheduling niceness
+    - io_priority: IO_IDLE or a best-effort level from IO_LEVELS
+
+    None means no limit. The limits are set in the forked process before
+    it executes the command, the CPU affinity on python 2 and the I/O
+    priority with the taskset and ionice commands.
+    '''
+
+    def __init__(
+            self, cpus=None, memory=None, open_files=None, nice=None,
+            io_priority=None):
+        self.cpus = cpus
+        self.memory = memory
+        self.open_files = open_files
+        self.nice = nice
+        self.io_priority = io_priority
+        self._cpu_ids = None
+
+    def cpu_ids(self):
+        '''I return the ids of the CPUs to run on or None'''
+        if self.cpus is None:
+            return None
+        if isinstance(self.cpus, int):
+            if self._cpu_ids is None:
+                self._cpu_ids = _least_loaded_cpus(self.cpus)
+            return self._cpu_ids
+        return sorted(self.cpus)
+
+    def command_prefix(self):
+        '''I return the command line prefix setting the limits \
+        not settable from python.
+        '''
+        prefix = []
+        cpu_ids = self.cpu_ids()
+        if cpu_ids is not None and not hasattr(os, 'sched_setaffinity'):
+            prefix += [
+                _executable('taskset'),
+                '--cpu-list', ','.join(str(cpu) for cpu in cpu_ids)]
+        if self.io_priority == IO_IDLE:
+            prefix += [_executable('ionice'), '--class', '3']
+        elif self.io_priority is not None:
+            prefix += [
+                _executable('ionice'),
+                '--class', '2', '--classdata', str(self.io_priority)]
+        return prefix
+
+    def setter(self):
+        '''I return a function setting the limits of the current process.
+
+        It is called in the forked process, so the work not safe to do
+        there - e.g. allocating CPU ids - is done here.
+        '''
+        cpu_ids = self.cpu_ids()
+        rlimits = []
+        if self.memory is not None:
+            rlimits.append((resource.RLIMIT_AS, self.memory))
+        if self.open_files is not None:
+            rlimits.append((resource.RLIMIT_NOFILE, self.open_files))
+
+        def set_limits():
+            for rlimit, value in rlimits:
+                resource.setrlimit(rlimit, (value, value))
+            if self.nice:
+                os.nice(self.nice)
+            if cpu_ids is not None and hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(0, cpu_ids)
+        return set_limits
+
+    def as_dict(self):
+        limits = {
+            'cpus': self.cpu_ids(),
+            'memory': self.memory,
+            'open files': self.open_files,
+            'nice': self.nice,
+            'io priority': self.io_priority,
+        }
+        return dict(
+            (name, value)
+            for name, value in limits.items()
+            if value is not None)
+
+
+class _Capture(object):
+
+    '''I keep the last `tail_size` bytes of a stream in memory \
+    and optionally tee the whole stream to a log file.
+    '''
+
+    def __init__(self, tail_size, log_path=None):
+        self.tail_size = tail_size
+        self.chunks = collections.deque()
+        self.length = 0
+        self.log_path = log_path
+        self.log = open(log_path, 'ab') if log_path else None
+
+    def write(self, data):
+        if self.log is not None:
+            self.log.write(data)
+        self.chunks.append(data)
+        self.length += len(data)
+        while (len(self.chunks) > 1
+               and self.length - len(self.chunks[0]) >= self.tail_size):
+            self.length -= len(self.chunks.popleft())
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+
+    @property
+    def tail(self):
+        data = b''.join(self.chunks)
+        if self.tail_size:
+            return data[-self.tail_size:]
+        return b''
+
+
+def _drain(captures, deadline=None):
+    '''Read all the pipes in `captures` (fd -> _Capture) until EOF.
+
+    The pipes are read concurrently, so a process filling one of them
+    while we are waiting on the other can not dead-lock.
+    They are polled - select can not wait on descriptors above FD_SETSIZE.
+    I return False, if the `deadline` (a time.time() value) has passed
+    before reaching EOF, True otherwise.
+    '''
+    poller = select.poll()
+    for fd in captures:
+        poller.register(fd, select.POLLIN)
+    while captures:
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                return False
+            # milliseconds, rounded up not to spin
+            timeout = int(math.ceil(timeout * 1000))
+        try:
+            events = poller.poll(timeout)
+        except (select.error, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd, _ in events:
+            data = os.read(fd, PIPE_READ_SIZE)
+            if data:
+                captures[fd].write(data)
+            else:
+                poller.unregister(fd)
+                del captures[fd]
+    return True
+
+
+def _kill(process, process_group):
+    try:
+        if process_group:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _wait(process, deadline=None, process_group=False):
+    '''I wait for `process` and return its resource usage and whether \
+    it was killed, as it had not exited by the `deadline`.
+
+    The process might close its outputs long before exiting, so the
+    deadline is enforced here as well, not only while reading them.
+    Unlike getrusage(RUSAGE_CHILDREN), wait4 reports the usage of this
+    one process, even when other threads run processes concurrently.
+    '''
+    killed = False
+    interval = MIN_POLL_INTERVAL
+    while True:
+        poll = deadline is not None and not killed
+        try:
+            pid, status, rusage = os.wait4(
+                process.pid, os.WNOHANG if poll else 0)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno != errno.ECHILD:
+                raise
+            # already reaped
+            process.wait()
+            return None, killed
+        if pid:
+            break
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            _kill(process, process_group)
+            killed = True
+        else:
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return rusage, killed
+
+
+def run(
+        args_list, env=None, cwd=None,
+        stdout_log=None, stderr_log=None, tail_size=TAIL_SIZE,
+        timeout=None, limits=None):
+    '''Run a command to completion.
+
+    The outputs are streamed: only their last `tail_size` bytes are kept
+    in the result, the full outputs are appended to `stdout_log` and
+    `stderr_log` if these file names are given.
+
+    With a `timeout` in seconds, the command runs in a new process group,
+    which is killed when the command does not finish in time.
+    The command is also killed when run is interrupted by an exception.
+
+    The command runs within `limits`, a Limits instance, if given.
+    '''
+    stdout = _Capture(tail_size, stdout_log)
+    stderr = _Capture(tail_size, stderr_log)
+    rusage = None
+    timed_out = False
+    process_group = timeout is not None
+    start = time.time()
+    deadline = None if timeout is None else start + timeout
+    command = list(args_list)
+    preexec_functions = []
+    if process_group:
+        preexec_functions.append(os.setsid)
+    if limits is not None:
+        command = limits.command_prefix() + command
+        preexec_functions.append(limits.setter())
+
+    def preexec():
+        for function in preexec_functions:
+            function()
+
+    try:
+        process = subprocess.Popen(
+            command, env=env, cwd=cwd,
+            stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True,
+            preexec_fn=preexec if preexec_functions else None)
+        process.stdin.close()
+        captures = {
+            process.stdout.fileno(): stdout,
+            process.stderr.fileno(): stderr}
+        try:
+            if not _drain(captures, deadline):
+                timed_out = True
+                _kill(process, process_group)
+                _drain(captures, time.time() + KILLED_DRAIN_TIMEOUT)
+        except:
+            _kill(process, process_group)
+            raise
+        finally:
+            process.stdout.close()
+            process.stderr.close()
+            rusage, killed = _wait(process, deadline, process_group)
+            timed_out = timed_out or killed
+    finally:
+        stdout.close()
+        stderr.close()
+    wall_time = time.time() - start
+
+    resource_usage = None
+    if rusage is not None:
+        resource_usage = ResourceUsage(
+            wall_time=wall_time,
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            max_rss=rusage.ru_maxrss,
+            block_reads=rusage.ru_inblock,
+            block_writes=rusage.ru_oublock)
+
     result = Result(
         cmdspec=tuple(args_list),
         status=process.returncode,
-        stdout=process.stdout.read(),
-        stderr=process.stderr.read(),
+        stdout=stdout.tail,
+        stderr=stderr.tail,
+        stdout_log=stdout_log,
+        stderr_log=stderr_log,
+        resource_usage=resource_usage,
+        timed_out=timed_out,
+        limits=limits,
         )
 
     return result
@@ -0,0 +1,31 @@
+'''I hold what the modules working with local files share.
+'''
+
+import errno
+import os
+
+
+# bytes read or written at once when streaming a file
+CHUNK_SIZE = 1024 * 1024
+
+# files modified this recently might be modified again without changing
+# their modification time: their size and modification time are not
+# trusted to tell that their content is unchanged
+RACY_SECONDS = 2
+
+# seconds to wait for concurrent writers of an SQLite database
+TIMEOUT = 60
+
+
+def makedirs(directory):
+    '''I create `directory` with its parents, unless it exists.
+
+    Creating it concurrently is fine, '' is the current directory.
+    '''
+    if not directory or os.path.isdir(directory):
+        return
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
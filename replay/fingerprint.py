@@ -0,0 +1,149 @@
+'''I compute content hashes of the things a script run depends on.
+'''
+
+import hashlib
+import os
+import threading
+
+import externals
+
+from replay import files
+from replay import staging
+from replay import tree
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+ALGORITHM = 'sha256'
+# algorithm for telling whether data files changed, not for security:
+# xxh64 with the optional xxhash package, sha256 (fast on CPUs with
+# SHA extensions) otherwise
+FAST_ALGORITHM = 'xxh64' if xxhash is not None else ALGORITHM
+
+# read buffers, one per thread
+_buffers = threading.local()
+
+
+def _new_hash(algorithm=ALGORITHM):
+    if algorithm == 'xxh64':
+        if xxhash is None:
+            raise ValueError('xxh64 needs the xxhash package')
+        return xxhash.xxh64()
+    return hashlib.new(algorithm)
+
+
+def _buffer():
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _buffers.buffer = bytearray(files.CHUNK_SIZE)
+    return buffer
+
+
+def hash_stream(stream, algorithm=ALGORITHM):
+    '''I hash `stream` in files.CHUNK_SIZE chunks.
+
+    Streams with readinto are read into a buffer reused by the thread,
+    without allocating a new bytes object for each chunk.
+    '''
+    hash = _new_hash(algorithm)
+    readinto = getattr(stream, 'readinto', None)
+    if readinto is None:
+        while True:
+            chunk = stream.read(files.CHUNK_SIZE)
+            if not chunk:
+                break
+            hash.update(chunk)
+        return hash.hexdigest()
+    buffer = _buffer()
+    view = memoryview(buffer)
+    while True:
+        size = readinto(buffer)
+        if not size:
+            break
+        hash.update(view[:size])
+    return hash.hexdigest()
+
+
+def hash_external(external, algorithm=ALGORITHM):
+    with external.readable_stream() as stream:
+        return hash_stream(stream, algorithm)
+
+
+def hash_file(path, algorithm=ALGORITHM):
+    with open(path, 'rb') as stream:
+        return hash_stream(stream, algorithm)
+
+
+def hash_files(paths, algorithm=ALGORITHM, threads=1):
+    '''I return the digests of the files at `paths`, \
+    hashing `threads` files at a time.
+    '''
+    return staging.map_in_parallel(
+        lambda path: hash_file(path, algorithm), paths, threads)
+
+
+def hash_externals(externals_, algorithm=ALGORITHM, threads=1, cache=None):
+    '''I return the digests of `externals_`, hashing `threads` at a time.
+
+    Local files are looked up in `cache` (replay.hash_cache.HashCache)
+    first, if given.
+    '''
+    externals_ = list(externals_)
+    digests = [None] * len(externals_)
+    if cache is not None:
+        local = [
+            i for i, external in enumerate(externals_)
+            if isinstance(external, externals.File)]
+        by_path = cache.digests(
+            [externals_[i].path for i in local], algorithm, threads)
+        for i in local:
+            digests[i] = by_path[externals_[i].path]
+    rest = [i for i, digest in enumerate(digests) if digest is None]
+    for i, digest in zip(rest, staging.map_in_parallel(
+            lambda i: hash_external(externals_[i], algorithm),
+            rest, threads)):
+        digests[i] = digest
+    return digests
+
+
+def hash_strings(strings):
+    hash = _new_hash()
+    for string in strings:
+        hash.update(string.encode('utf8'))
+        hash.update(b'\0')
+    return hash.hexdigest()
+
+
+def hash_tree(directory, ignored_files=(), rules=None):
+    '''I return a hash of the names and contents of files \
+    under `directory`.
+
+    `ignored_files` are paths relative to `directory` to leave out,
+    in addition to those ignored by `rules` (replay.tree.IgnoreRules,
+    by default loaded from the directory).
+    '''
+    ignored_files = set(os.path.normpath(path) for path in ignored_files)
+
+    def items():
+        for relpath, path, kind in tree.walk(directory, rules):
+            if relpath in ignored_files:
+                continue
+            if kind == tree.LINK:
+                yield u'link:{}:{}'.format(relpath, os.readlink(path))
+            elif kind == tree.FILE:
+                yield u'file:{}:{}'.format(relpath, hash_file(path))
+            else:
+                yield u'dir:{}'.format(relpath)
+    return hash_strings(items())
+
+
+def fingerprint(plugins):
+    '''I return a hash of everything the given plugins depend on'''
+    def items():
+        for plugin in plugins:
+            for item in plugin.fingerprint():
+                yield item
+    return hash_strings(items())
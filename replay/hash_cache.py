@@ -0,0 +1,114 @@
+'''I keep the digests of local files in an SQLite database, \
+so that unchanged (possibly huge) files are not read again for hashing.
+
+A digest is reused while the file has the same path, size,
+modification time and inode.
+'''
+
+import logging
+import os
+import sqlite3
+import time
+
+from replay import files
+from replay import fingerprint
+
+
+log = logging.getLogger(__name__)
+
+# location of the hash cache database in a local datastore
+HASH_CACHE_FILE = '.replay/hashes.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (path, algorithm)
+);
+'''
+
+
+def stat_signature(path):
+    '''I return the (size, mtime in nanoseconds, inode) of `path`'''
+    stat = os.stat(path)
+    mtime = getattr(stat, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(stat.st_mtime * 1e9)
+    return stat.st_size, mtime, stat.st_ino
+
+
+class HashCache(object):
+
+    '''I am the SQLite database of file digests.
+
+    A read_only cache only looks up digests, it does not even create
+    the database.
+    '''
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+
+    def _connect(self):
+        files.makedirs(os.path.dirname(self.path))
+        connection = sqlite3.connect(self.path, timeout=files.TIMEOUT)
+        connection.executescript(SCHEMA)
+        return connection
+
+    def digests(self, paths, algorithm=fingerprint.ALGORITHM, threads=1):
+        '''I return {path: digest} for the files at `paths`.
+
+        Only files without a cached digest are read, `threads` at a time.
+        '''
+        signatures = dict((path, stat_signature(path)) for path in paths)
+        digests = self._lookup(signatures, algorithm)
+        unknown = sorted(path for path in signatures if path not in digests)
+        computed = dict(
+            zip(unknown, fingerprint.hash_files(unknown, algorithm, threads)))
+        log.debug(
+            'HashCache: %s files cached, %s hashed',
+            len(digests), len(computed))
+        digests.update(computed)
+        self._store(
+            [(path, signatures[path], computed[path]) for path in unknown],
+            algorithm)
+        return digests
+
+    def _lookup(self, signatures, algorithm):
+        if not signatures or not os.path.exists(self.path):
+            return {}
+        digests = {}
+        connection = self._connect()
+        try:
+            for path, signature in signatures.items():
+                row = connection.execute(
+                    'SELECT size, mtime, inode, digest FROM digests'
+                    ' WHERE path = ? AND algorithm = ?',
+                    (path, algorithm)).fetchone()
+                if row is not None and tuple(row[:3]) == signature:
+                    digests[path] = row[3]
+        finally:
+            connection.close()
+        return digests
+
+    def _store(self, entries, algorithm):
+        racy = (time.time() - files.RACY_SECONDS) * 1e9
+        entries = [
+            (path, algorithm, size, mtime, inode, digest)
+            for path, (size, mtime, inode), digest in entries
+            if mtime < racy]
+        if self.read_only or not entries:
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO digests'
+                    ' (path, algorithm, size, mtime, inode, digest)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)', entries)
+        finally:
+            connection.close()
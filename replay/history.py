@@ -0,0 +1,173 @@
+'''I keep the history of runs in an SQLite database, \
+for spotting runs that got slower or process more data than before.
+'''
+
+import logging
+import os
+import sqlite3
+
+from replay import files
+from replay import report as replay_report
+
+
+log = logging.getLogger(__name__)
+
+# location of the history database in a local datastore
+HISTORY_FILE = '.replay/history.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    script TEXT NOT NULL,
+    script_path TEXT,
+    run_key TEXT,
+    started TEXT NOT NULL,
+    status TEXT,
+    wall_time REAL,
+    cpu_time REAL,
+    max_rss INTEGER,
+    bytes_staged INTEGER,
+    bytes_uploaded INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_script ON runs (script, started);
+CREATE INDEX IF NOT EXISTS runs_script_path ON runs (script_path, started);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    plugin TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phases_run_id ON phases (run_id);
+'''
+
+
+def percentile(values, p):
+    '''I return the `p` percentile of `values` by the nearest-rank method'''
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(1, int(-(-len(values) * p // 100)))
+    return values[rank - 1]
+
+
+class ScriptStats(object):
+
+    '''I am the statistics of the recent runs of a script.
+
+    The last run is compared to the runs before it.
+    The script is identified by its `script_path` - None for runs
+    recorded without one -, `script` is its name for display.
+    '''
+
+    def __init__(self, script, runs, script_path=None):
+        # runs: (wall_time, bytes) tuples, oldest first
+        self.script = script
+        self.script_path = script_path
+        self.runs = len(runs)
+        wall_times = [wall_time for wall_time, _ in runs]
+        self.p50 = percentile(wall_times, 50)
+        self.p95 = percentile(wall_times, 95)
+        self.last = wall_times[-1]
+        self.last_bytes = runs[-1][1]
+        earlier = runs[:-1]
+        self.earlier_p50 = percentile([w for w, _ in earlier], 50)
+        self.earlier_bytes_p50 = percentile([b for _, b in earlier], 50)
+
+    def is_slower(self, factor):
+        '''I tell if the last run took `factor` times the typical earlier'''
+        return (
+            self.earlier_p50 is not None
+            and self.last > factor * self.earlier_p50)
+
+    def has_more_data(self, factor):
+        '''I tell if the last run moved `factor` times the typical data'''
+        return bool(
+            self.earlier_bytes_p50
+            and self.last_bytes > factor * self.earlier_bytes_p50)
+
+
+class History(object):
+
+    '''I am the SQLite database of RunReports'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=files.TIMEOUT)
+        connection.executescript(SCHEMA)
+        return connection
+
+    def record(self, report, run_key=None):
+        '''I append a replay.report.RunReport to the history'''
+        cpu_time = None
+        max_rss = None
+        for process in report.processes:
+            if 'user time' in process:
+                cpu_time = (
+                    (cpu_time or 0)
+                    + process['user time'] + process['system time'])
+                max_rss = max(max_rss or 0, process['max rss'])
+        record = report.as_dict()
+        files.makedirs(os.path.dirname(self.path))
+        connection = self._connect()
+        try:
+            with connection:
+                cursor = connection.execute(
+                    'INSERT INTO runs (script, script_path, run_key, started,'
+                    ' status, wall_time, cpu_time, max_rss, bytes_staged,'
+                    ' bytes_uploaded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (record['script'], record['script path'], run_key,
+                     record['started'], record['status'], record['wall time'],
+                     cpu_time, max_rss, record['bytes staged'],
+                     record['bytes uploaded']))
+                connection.executemany(
+                    'INSERT INTO phases (run_id, plugin, phase, seconds)'
+                    ' VALUES (?, ?, ?, ?)',
+                    [
+                        (cursor.lastrowid, phase['plugin'], phase['phase'],
+                         phase['seconds'])
+                        for phase in record['phases']])
+        finally:
+            connection.close()
+        log.debug('History: recorded %s in %s', record['script'], self.path)
+
+    def script_stats(self, runs=20, status=replay_report.SUCCEEDED):
+        '''I return ScriptStats of the last `runs` runs with `status` \
+        for each script, by name and path.
+        '''
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT script, script_path, wall_time,'
+                ' coalesce(bytes_staged, 0) + coalesce(bytes_uploaded, 0)'
+                ' FROM runs WHERE status = ?'
+                ' ORDER BY script, script_path, started, id',
+                (status,)).fetchall()
+        finally:
+            connection.close()
+        by_script = {}
+        for script, script_path, wall_time, volume in rows:
+            by_script.setdefault(
+                (script, script_path), []).append((wall_time, volume))
+        return [
+            ScriptStats(script, by_script[script, script_path][-runs:],
+                        script_path)
+            for script, script_path in sorted(
+                by_script, key=lambda key: (key[0], key[1] or ''))]
+
+    def slowest_phases(self, limit=10):
+        '''I return (script, plugin, phase, average seconds, count) \
+        of the phases taking the most time on average, \
+        scripts of the same name told apart by their path.
+        '''
+        connection = self._connect()
+        try:
+            return connection.execute(
+                'SELECT script, plugin, phase, avg(seconds), count(*)'
+                ' FROM phases JOIN runs ON runs.id = phases.run_id'
+                ' GROUP BY script, script_path, plugin, phase'
+                ' ORDER BY avg(seconds) DESC LIMIT ?',
+                (limit,)).fetchall()
+        finally:
+            connection.close()
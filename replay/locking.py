@@ -0,0 +1,53 @@
+'''I provide advisory file locks for coordinating replay processes.
+'''
+
+import errno
+import fcntl
+import os
+
+from replay import files
+
+
+class FileLock(object):
+
+    '''I am an advisory lock on a file, usable as a context manager.
+
+    Exclusive locks are held by one process at a time,
+    shared locks by any number of processes, if there is no exclusive lock.
+    The lock file is created if needed and is never removed.
+    '''
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        '''I return True if the lock was acquired'''
+        files.makedirs(os.path.dirname(self.path))
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, operation)
+        except (IOError, OSError) as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK):
+                return False
+            raise
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
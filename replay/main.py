@@ -1,9 +1,30 @@
+from __future__ import print_function
 import argparse
+import datetime
 import externals
+import multiprocessing
 import os.path
+import shutil
 import sys
+import tempfile
+import replay.build
+import replay.build_state
+import replay.cache
+import replay.compression
 import replay.context
+import replay.datastores
+import replay.external_process
+import replay.fingerprint
+import replay.hash_cache
+import replay.history
+import replay.plan
+import replay.plan_cache
 import replay.plugins
+import replay.report
+import replay.staging
+import replay.trash
+import replay.units
+import replay.venvs
 
 
 TEMPORARY_DIRECTORY = replay.plugins.TemporaryDirectory
@@ -17,15 +38,272 @@ def get_virtualenv_parent_dir():
     return os.path.join(user_home, '.virtualenvs')
 
 
-def parse_args(args):
-    parser = argparse.ArgumentParser()
-
-    # optional parameters, with defaults
+def add_context_arguments(parser):
     parser.add_argument(
         '--datastore',
         '--ds',
         default=externals.working_directory().path,
-        help='Persistent place for data (default: %(default)s)')
+        help='Persistent place for data: a directory or the http(s) URL'
+        ' of an object store (default: %(default)s)')
+
+    parser.add_argument(
+        '--virtualenv-parent-directory',
+        '--venvs',
+        default=get_virtualenv_parent_dir(),
+        help='Use this directory to cache python virtual environments'
+        ' (default: %(default)s)')
+
+    parser.add_argument(
+        '--venv-budget',
+        type=replay.units.parse_size,
+        help='Remove least recently used virtual environments'
+        ' above this total size, e.g. 20G (default: no limit)')
+
+    parser.add_argument(
+        '--no-venv-layers',
+        action='store_true',
+        help='Install all python packages into each virtual environment,'
+        ' instead of reusing one with a subset of the packages')
+
+    parser.add_argument(
+        '--wheelhouse',
+        help='Keep built python packages in this directory for building'
+        ' virtual environments (default: {} in the virtual environments'
+        ' directory)'.format(replay.venvs.WHEELHOUSE))
+
+    parser.add_argument(
+        '--no-wheelhouse',
+        action='store_true',
+        help='Install python packages from the package index only')
+
+    parser.add_argument(
+        '--cache',
+        help='Keep outputs of runs in this directory for reuse'
+        ' (default: .replay/cache in a local datastore, none for a remote'
+        ' one)')
+
+    parser.add_argument(
+        '--cache-size',
+        type=replay.units.parse_size,
+        default=replay.cache.DEFAULT_MAX_SIZE,
+        help='Evict least recently used outputs from the cache'
+        ' above this size, e.g. 500M, 20G (default: {})'.format(
+            replay.units.format_size(replay.cache.DEFAULT_MAX_SIZE)))
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Neither reuse nor keep outputs of runs')
+
+    parser.add_argument(
+        '--plan-cache',
+        help='Keep parsed scripts in this directory, for loading many'
+        ' scripts fast (default: {} in a local datastore, none for a'
+        ' remote one)'.format(
+            replay.plan_cache.PLAN_CACHE_DIRECTORY))
+
+    parser.add_argument(
+        '--no-plan-cache',
+        action='store_true',
+        help='Parse scripts every time they are loaded')
+
+    parser.add_argument(
+        '--fast-hash',
+        action='store_true',
+        help='Hash inputs and outputs with {} instead of {}'
+        ' (changes the fingerprints of all runs)'.format(
+            replay.fingerprint.FAST_ALGORITHM,
+            replay.fingerprint.ALGORITHM))
+
+    parser.add_argument(
+        '--no-hash-cache',
+        action='store_true',
+        help='Hash all inputs at every run, instead of remembering the'
+        ' digests of unchanged files in {} in a local datastore'.format(
+            replay.hash_cache.HASH_CACHE_FILE))
+
+    parser.add_argument(
+        '--stage-inputs',
+        choices=replay.staging.STRATEGIES,
+        default=replay.staging.COPY,
+        help='How to make inputs available to the script: links fall back'
+        ' to copying when not possible. With hard and symbolic links, the'
+        ' script must not modify its inputs: that changes the datastore'
+        ' files (default: %(default)s)')
+
+    parser.add_argument(
+        '--stage-script',
+        choices=replay.staging.STRATEGIES,
+        default=replay.staging.COPY,
+        help='How to put the files of the script directory into the working'
+        ' directory. With links, the script must not modify its own files'
+        ' (default: %(default)s)')
+
+    parser.add_argument(
+        '--compress',
+        choices=replay.compression.available_codecs(),
+        help='Store outputs compressed in the datastore, inputs are'
+        ' decompressed when staged (default: no compression)')
+
+    parser.add_argument(
+        '--check-inputs',
+        action='store_true',
+        help='Fail the run if the script modified or removed its datastore'
+        ' inputs. This is checked after the run, it does not prevent'
+        ' changes through linked inputs')
+
+    parser.add_argument(
+        '--serial-setup',
+        action='store_true',
+        help='Set up plugins one after the other, even those that could be'
+        ' set up at the same time (e.g. Inputs and PythonDependencies)')
+
+    parser.add_argument(
+        '--transfer-threads',
+        type=int,
+        default=4,
+        help='Transfer this many files to/from the datastore in parallel'
+        ' (default: %(default)s)')
+
+
+def context_arguments(args):
+    '''I return command line arguments for the context options in `args`'''
+    arguments = [
+        '--datastore=' + args.datastore,
+        '--venvs=' + args.virtualenv_parent_directory]
+    if args.venv_budget is not None:
+        arguments.append('--venv-budget={}'.format(args.venv_budget))
+    if args.no_venv_layers:
+        arguments.append('--no-venv-layers')
+    if args.wheelhouse:
+        arguments.append('--wheelhouse=' + args.wheelhouse)
+    if args.no_wheelhouse:
+        arguments.append('--no-wheelhouse')
+    if args.cache:
+        arguments.append('--cache=' + args.cache)
+    if args.cache_size is not None:
+        arguments.append('--cache-size={}'.format(args.cache_size))
+    if args.no_cache:
+        arguments.append('--no-cache')
+    if args.plan_cache:
+        arguments.append('--plan-cache=' + args.plan_cache)
+    if args.no_plan_cache:
+        arguments.append('--no-plan-cache')
+    if args.fast_hash:
+        arguments.append('--fast-hash')
+    if args.no_hash_cache:
+        arguments.append('--no-hash-cache')
+    arguments.append('--stage-inputs=' + args.stage_inputs)
+    arguments.append('--stage-script=' + args.stage_script)
+    if args.compress:
+        arguments.append('--compress=' + args.compress)
+    if args.check_inputs:
+        arguments.append('--check-inputs')
+    if args.serial_setup:
+        arguments.append('--serial-setup')
+    arguments.append('--transfer-threads={}'.format(args.transfer_threads))
+    return arguments
+
+
+def get_wheelhouse(args):
+    if args.no_wheelhouse:
+        return None
+    if args.wheelhouse:
+        return externals.File(args.wheelhouse).path
+    return os.path.join(
+        externals.File(args.virtualenv_parent_directory).path,
+        replay.venvs.WHEELHOUSE)
+
+
+def get_datastore(args):
+    return replay.datastores.open_datastore(
+        args.datastore, connections=args.transfer_threads)
+
+
+def get_cache_directory(args):
+    '''I return the output cache directory, None for a remote datastore \
+    without --cache'''
+    if args.cache:
+        return externals.File(args.cache).path
+    if replay.datastores.is_url(args.datastore):
+        return None
+    return os.path.join(
+        externals.File(args.datastore).path, '.replay', 'cache')
+
+
+def get_output_cache(args):
+    if args.no_cache or get_cache_directory(args) is None:
+        return None
+    return replay.cache.OutputCache(
+        get_cache_directory(args), args.cache_size)
+
+
+def get_plan_cache(args):
+    if args.no_plan_cache:
+        return None
+    if args.plan_cache:
+        directory = externals.File(args.plan_cache).path
+    elif replay.datastores.is_url(args.datastore):
+        return None
+    else:
+        directory = os.path.join(
+            externals.File(args.datastore).path,
+            replay.plan_cache.PLAN_CACHE_DIRECTORY)
+    return replay.plan_cache.PlanCache(directory)
+
+
+def get_hash_algorithm(args):
+    if args.fast_hash:
+        return replay.fingerprint.FAST_ALGORITHM
+    return replay.fingerprint.ALGORITHM
+
+
+def get_hash_cache(args):
+    '''I return the HashCache of a local datastore or None'''
+    if args.no_hash_cache or replay.datastores.is_url(args.datastore):
+        return None
+    return replay.hash_cache.HashCache(
+        os.path.join(
+            externals.File(args.datastore).path,
+            replay.hash_cache.HASH_CACHE_FILE))
+
+
+def get_log_directory(datastore, report):
+    '''I return the directory for the logs of the run: under \
+    LOGS_DIRECTORY in a local datastore, None (a temporary directory) \
+    for a remote one.
+    '''
+    if not isinstance(datastore, externals.File):
+        return None
+    return (
+        datastore / replay.plugins.LOGS_DIRECTORY / report.script_id
+        / report.run_id).path
+
+
+def make_context(args, working_directory):
+    return replay.context.Context(
+        get_datastore(args),
+        externals.File(args.virtualenv_parent_directory),
+        working_directory,
+        output_cache=get_output_cache(args),
+        input_staging=args.stage_inputs,
+        check_inputs=args.check_inputs,
+        transfer_threads=args.transfer_threads,
+        virtualenv_budget=args.venv_budget,
+        wheelhouse=get_wheelhouse(args),
+        layered_virtualenvs=not args.no_venv_layers,
+        concurrent_setup=not args.serial_setup,
+        plan_cache=get_plan_cache(args),
+        hash_algorithm=get_hash_algorithm(args),
+        hash_cache=get_hash_cache(args),
+        compression=args.compress)
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+
+    # optional parameters, with defaults
+    add_context_arguments(parser)
 
     parser.add_argument(
         '--script-working-directory',
@@ -35,11 +313,9 @@ def parse_args(args):
         ' (default: NEW TEMPORARY DIRECTORY)')
 
     parser.add_argument(
-        '--virtualenv-parent-directory',
-        '--venvs',
-        default=get_virtualenv_parent_dir(),
-        help='Use this directory to cache python virtual environments'
-        ' (default: %(default)s)')
+        '--force',
+        action='store_true',
+        help='Run the script even if its outputs are up to date')
 
     # mandatory parameter
     parser.add_argument(
@@ -60,26 +336,533 @@ def get_script_working_directory(args):
     return externals.File(args.script_working_directory)
 
 
+def parse_build_args(args):
+    parser = argparse.ArgumentParser(
+        prog='replay build',
+        description='Run scripts in dependency order')
+
+    add_context_arguments(parser)
+
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Run at most this many scripts in parallel'
+        ' (default: %(default)s)')
+
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Run the scripts even if their outputs are up to date')
+
+    parser.add_argument(
+        '--pattern',
+        default=replay.build.SCRIPT_PATTERN,
+        help='Scripts in directories are files matching this pattern'
+        ' (default: %(default)s)')
+
+    parser.add_argument(
+        'script_paths',
+        nargs='+',
+        help='Scripts and directories containing scripts to run')
+
+    args = parser.parse_args(args)
+
+    args.script_paths = [
+        externals.File(path).path for path in args.script_paths]
+
+    return args
+
+
+def build_main(args):
+    args = parse_build_args(args)
+
+    context = make_context(args, TEMPORARY_DIRECTORY)
+
+    script_paths = sorted(set(
+        replay.build.find_script_paths(args.script_paths, args.pattern)))
+    graph = replay.build.DependencyGraph(
+        replay.build.load_script_spec(context, script_path)
+        for script_path in script_paths)
+
+    def run_script(script_path):
+        command = (
+            [sys.executable, '-m', 'replay.main']
+            + context_arguments(args)
+            + (['--force'] if args.force else [])
+            + [script_path])
+        result = replay.external_process.run(command)
+        if result.status != 0:
+            print(result, file=sys.stderr)
+        return result.status == 0
+
+    status = replay.build.build(graph, run_script, args.jobs)
+
+    for script_path in script_paths:
+        print('{}: {}'.format(status[script_path], script_path))
+
+    if any(s != replay.build.SUCCEEDED for s in status.values()):
+        return 1
+    return 0
+
+
+def run(context, spec, plugins, force=False):
+    '''I run the plugins, unless an earlier run with the same spec, \
+    inputs, script and dependencies produced outputs that still exist.
+
+    With a context.report, the report is written to the datastore
+    and recorded in the run history of a local datastore.
+    '''
+    report = context.report
+    status = replay.report.FAILED
+    key = None
+    try:
+        context.run_fingerprint = replay.fingerprint.fingerprint(plugins)
+        if report is not None:
+            report.run_fingerprint = context.run_fingerprint
+        build_state = replay.build_state.BuildState(context.datastore)
+        key = build_state.key(spec, context.run_fingerprint)
+        if not force and build_state.is_up_to_date(key):
+            print('Outputs are up to date, not running the script')
+            status = replay.report.UP_TO_DATE
+            return
+
+        if not force and restore_outputs(context, plugins):
+            print('Outputs are restored from cache, not running the script')
+            status = replay.report.RESTORED
+        else:
+            context.run(plugins)
+            status = replay.report.SUCCEEDED
+
+        build_state.record(key, replay.build_state.output_paths(plugins))
+    finally:
+        if report is not None:
+            report.finish(status)
+            report.write(context.datastore)
+            history = get_history(context.datastore)
+            if history is not None:
+                history.record(report, key)
+
+
+def get_history(datastore):
+    '''I return the run History of a local datastore or None'''
+    if not isinstance(datastore, externals.File):
+        return None
+    return replay.history.History(
+        (datastore / replay.history.HISTORY_FILE).path)
+
+
+def restore_outputs(context, plugins):
+    if context.output_cache is None:
+        return False
+    recorded = context.output_cache.lookup(context.run_fingerprint)
+    if recorded is None:
+        return False
+    outputs = [
+        output
+        for plugin in plugins
+        if isinstance(plugin, replay.plugins.Outputs)
+        for output in plugin.output_names(recorded)]
+    if not outputs:
+        return False
+    return context.output_cache.restore(
+        context.run_fingerprint, context.datastore, outputs,
+        context.compression)
+
+
+def parse_cache_args(args):
+    parser = argparse.ArgumentParser(
+        prog='replay cache',
+        description='Manage the cache of run outputs')
+
+    commands = parser.add_subparsers(dest='command')
+
+    gc = commands.add_parser(
+        'gc',
+        help='Evict least recently used outputs and unused files')
+    add_context_arguments(gc)
+    gc.add_argument(
+        '--max-size',
+        type=replay.units.parse_size,
+        help='Evict outputs until the cache is below this size'
+        ' (default: --cache-size)')
+
+    return parser.parse_args(args)
+
+
+def cache_main(args):
+    args = parse_cache_args(args)
+
+    directory = get_cache_directory(args)
+    if directory is None:
+        print('no cache with a remote datastore, use --cache', file=sys.stderr)
+        return 1
+    cache = replay.cache.OutputCache(directory)
+    max_size = args.max_size
+    if max_size is None:
+        max_size = args.cache_size
+    size = cache.gc(max_size)
+    print('cache size: {} bytes'.format(size))
+    return 0
+
+
+def parse_stats_args(args):
+    parser = argparse.ArgumentParser(
+        prog='replay stats',
+        description='Show run times of scripts from the run history'
+        ' and flag the scripts whose last run was slower or moved'
+        ' more data than usual')
+    parser.add_argument(
+        '--datastore',
+        '--ds',
+        default=externals.working_directory().path,
+        help='Datastore with the run history (default: %(default)s)')
+    parser.add_argument(
+        '--runs',
+        type=int,
+        default=20,
+        help='Use this many recent successful runs of each script'
+        ' (default: %(default)s)')
+    parser.add_argument(
+        '--slower',
+        type=float,
+        default=1.5,
+        help='Flag the last run, if it took this many times the median of'
+        ' the earlier runs (default: %(default)s)')
+    parser.add_argument(
+        '--more-data',
+        type=float,
+        default=1.5,
+        help='Flag the last run, if it staged and uploaded this many times'
+        ' the median bytes of the earlier runs (default: %(default)s)')
+    parser.add_argument(
+        '--phases',
+        type=int,
+        default=10,
+        help='List this many of the slowest plugin phases'
+        ' (default: %(default)s)')
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Exit with status 1 if any script is flagged')
+    return parser.parse_args(args)
+
+
+def stats_main(args):
+    args = parse_stats_args(args)
+
+    history = get_history(externals.File(args.datastore))
+    if not os.path.exists(history.path):
+        print('no run history in {}'.format(args.datastore), file=sys.stderr)
+        return 1
+
+    flagged = False
+    print(
+        '{:<30} {:>5} {:>9} {:>9} {:>9} {:>9}'.format(
+            'script', 'runs', 'p50', 'p95', 'last', 'last data'))
+    for stats in history.script_stats(args.runs):
+        flags = []
+        if stats.is_slower(args.slower):
+            flags.append('SLOWER')
+        if stats.has_more_data(args.more_data):
+            flags.append('MORE DATA')
+        flagged = flagged or bool(flags)
+        print(
+            '{:<30} {:>5} {:>8.1f}s {:>8.1f}s {:>8.1f}s {:>9}  {}'.format(
+                stats.script, stats.runs, stats.p50, stats.p95, stats.last,
+                replay.units.format_size(stats.last_bytes),
+                ' '.join(flags)).rstrip())
+
+    phases = history.slowest_phases(args.phases)
+    if phases:
+        print()
+        print('slowest phases (average):')
+        for script, plugin, phase, seconds, count in phases:
+            print(
+                '  {:>8.1f}s  {} {} {} ({} runs)'.format(
+                    seconds, script, plugin, phase, count))
+
+    return 1 if args.check and flagged else 0
+
+
+def add_script_path_arguments(parser):
+    parser.add_argument(
+        '--pattern',
+        default=replay.build.SCRIPT_PATTERN,
+        help='Scripts in directories are files matching this pattern'
+        ' (default: %(default)s)')
+    parser.add_argument(
+        'script_paths',
+        nargs='+',
+        help='Scripts and directories containing scripts')
+
+
+def parse_plan_args(args):
+    parser = argparse.ArgumentParser(
+        prog='replay plan',
+        description='Show what a build would do, without running or'
+        ' changing anything: which scripts would run, be skipped as up to'
+        ' date or be restored from the cache, and errors in the scripts')
+
+    add_context_arguments(parser)
+    add_script_path_arguments(parser)
+
+    return parser.parse_args(args)
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '?'
+    return '{:.1f}s'.format(seconds)
+
+
+def plan_main(args):
+    args = parse_plan_args(args)
+
+    context = make_context(args, TEMPORARY_DIRECTORY)
+    if context.plan_cache is not None:
+        context.plan_cache.read_only = True
+    if context.hash_cache is not None:
+        context.hash_cache.read_only = True
+
+    history = get_history(context.datastore)
+    if history is not None and not os.path.exists(history.path):
+        history = None
+
+    script_paths = sorted(set(
+        externals.File(path).path
+        for path in replay.build.find_script_paths(
+            args.script_paths, args.pattern)))
+    try:
+        script_plans = replay.plan.plan(context, script_paths, history)
+    except ValueError as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        return 1
+
+    to_run = [p for p in script_plans if p.action == replay.plan.RUN]
+    for script_plan in script_plans:
+        details = []
+        if script_plan.reason:
+            details.append(script_plan.reason)
+        for name in script_plan.new_virtualenvs:
+            details.append('builds virtualenv ' + name)
+        estimate = ''
+        if script_plan.action == replay.plan.RUN:
+            estimate = format_seconds(script_plan.estimate)
+        print(
+            '{:<10} {:>8}  {}  {}'.format(
+                script_plan.action, estimate, script_plan.path,
+                '; '.join(details)).rstrip())
+
+    estimates = [p.estimate for p in to_run if p.estimate is not None]
+    print()
+    print(
+        '{} to run (estimated {}{}), {} up to date, {} to restore,'
+        ' {} skipped, {} with errors'.format(
+            len(to_run),
+            format_seconds(sum(estimates)),
+            ' for {} with history'.format(len(estimates))
+            if len(estimates) < len(to_run) else '',
+            sum(1 for p in script_plans
+                if p.action == replay.plan.UP_TO_DATE),
+            sum(1 for p in script_plans if p.action == replay.plan.RESTORE),
+            sum(1 for p in script_plans if p.action == replay.plan.SKIP),
+            sum(1 for p in script_plans if p.action == replay.plan.ERROR)))
+
+    if any(p.action == replay.plan.ERROR for p in script_plans):
+        return 1
+    return 0
+
+
+def parse_venv_args(args):
+    parser = argparse.ArgumentParser(
+        prog='replay venv',
+        description='Manage the cached python virtual environments')
+
+    commands = parser.add_subparsers(dest='command')
+
+    list_ = commands.add_parser(
+        'list',
+        help='Show virtual environments with their size and last use')
+    add_context_arguments(list_)
+
+    prune = commands.add_parser(
+        'prune',
+        help='Remove incomplete and least recently used'
+        ' virtual environments not in use')
+    add_context_arguments(prune)
+    prune.add_argument(
+        '--max-size',
+        type=replay.units.parse_size,
+        help='Remove virtual environments until their total size is'
+        ' below this (default: --venv-budget or remove all)')
+
+    warm = commands.add_parser(
+        'warm',
+        help='Build the virtual environments of scripts before running them')
+    add_context_arguments(warm)
+    warm.add_argument(
+        '--jobs',
+        '-j',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Build at most this many virtual environments in parallel'
+        ' (default: %(default)s)')
+    add_script_path_arguments(warm)
+
+    wheels = commands.add_parser(
+        'wheels',
+        help='Build the python packages of scripts into the wheelhouse,'
+        ' so that their virtual environments can be built offline')
+    add_context_arguments(wheels)
+    add_script_path_arguments(wheels)
+
+    return parser.parse_args(args)
+
+
+def venv_list(args, pool):
+    for virtualenv in pool.virtualenvs():
+        if virtualenv.is_in_use:
+            status = 'in use'
+        elif virtualenv.is_complete:
+            status = 'complete'
+        else:
+            status = 'incomplete'
+        last_used = datetime.datetime.fromtimestamp(virtualenv.last_used)
+        print(
+            '{name}  {size:>8}  {last_used}  {status}'.format(
+                name=virtualenv.name,
+                size=replay.units.format_size(virtualenv.size),
+                last_used=last_used.strftime('%Y-%m-%d %H:%M'),
+                status=status))
+        if virtualenv.base:
+            print('    layered on {}'.format(virtualenv.base))
+
+
+def venv_prune(args, pool):
+    max_size = args.max_size
+    if max_size is None:
+        max_size = args.venv_budget
+    if max_size is None:
+        max_size = 0
+    for virtualenv in pool.prune(max_size):
+        print('removed {}'.format(virtualenv.name))
+
+
+def load_python_dependencies(args, context):
+    '''I return the distinct PythonDependencies plugins of the scripts \
+    in `args`'''
+    python_dependencies = {}
+    for script_path in replay.build.find_script_paths(
+            args.script_paths, args.pattern):
+        for plugin in context.load_script(script_path):
+            if isinstance(plugin, replay.plugins.PythonDependencies):
+                python_dependencies[plugin.virtualenv_name] = plugin
+    return [python_dependencies[name] for name in sorted(python_dependencies)]
+
+
+def venv_warm(args, pool):
+    context = make_context(args, TEMPORARY_DIRECTORY)
+
+    def build(plugin):
+        plugin.build_virtualenv()
+        print('built {}'.format(plugin.virtualenv_name))
+
+    replay.staging.map_in_parallel(
+        build, load_python_dependencies(args, context), args.jobs)
+
+
+def venv_wheels(args, pool):
+    context = make_context(args, TEMPORARY_DIRECTORY)
+    if context.wheelhouse is None:
+        print('no wheelhouse', file=sys.stderr)
+        return 1
+    wheelhouse = replay.venvs.Wheelhouse(context.wheelhouse)
+
+    # pip wheel needs a pip with wheel support, which virtualenv provides
+    builder = tempfile.mkdtemp(prefix='replay-wheels-')
+    try:
+        result = replay.external_process.run(['virtualenv', builder])
+        if result.status != 0:
+            print(result, file=sys.stderr)
+            return 1
+        pip = [os.path.join(builder, 'bin', 'pip')]
+        status = 0
+        for plugin in load_python_dependencies(args, context):
+            if not plugin.python_dependencies:
+                continue
+            result = wheelhouse.add(
+                pip, plugin.python_dependencies, context.index_server_url)
+            if result.status != 0:
+                print(result, file=sys.stderr)
+                status = 1
+    finally:
+        shutil.rmtree(builder, ignore_errors=True)
+    for wheel in wheelhouse.wheels():
+        print(wheel)
+    return status
+
+
+def venv_main(args):
+    args = parse_venv_args(args)
+
+    pool = replay.venvs.VirtualenvPool(
+        externals.File(args.virtualenv_parent_directory).path)
+    command = dict(
+        list=venv_list, prune=venv_prune, warm=venv_warm, wheels=venv_wheels)
+    return command[args.command](args, pool) or 0
+
+
+# sub-commands: name -> function taking the rest of the command line
+COMMANDS = {
+    'build': build_main,
+    'cache': cache_main,
+    'plan': plan_main,
+    'stats': stats_main,
+    'venv': venv_main,
+}
+
+
+def reap_leftovers(args):
+    '''I start removing the working directories left by earlier runs'''
+    if args.script_working_directory is TEMPORARY_DIRECTORY:
+        replay.trash.reap()
+    else:
+        replay.trash.reap_trash(
+            os.path.dirname(os.path.abspath(args.script_working_directory)))
+
+
 def main():
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        command = COMMANDS[sys.argv[1]]
+        sys.exit(command(sys.argv[2:]))
+
     args = parse_args(sys.argv[1:])
 
-    context = replay.context.Context(
-        externals.File(args.datastore),
-        externals.File(args.virtualenv_parent_directory),
-        get_script_working_directory(args))
+    context = make_context(args, get_script_working_directory(args))
+    reap_leftovers(args)
 
     script_path = externals.File(args.script_path)
     script_dir = script_path.parent().path
+    context.report = replay.report.RunReport(
+        os.path.splitext(script_path.name)[0], script_path.path)
+    context.log_directory = get_log_directory(
+        context.datastore, context.report)
 
     with open(args.script_path) as script_file:
-        plugins = (
-            [replay.plugins.TemporaryDirectory(context)
-                if args.script_working_directory is TEMPORARY_DIRECTORY
-                else replay.plugins.WorkingDirectory(context)]
-            + [replay.plugins.CopyScript(script_dir)]
-            + list(context.load_plugins(script_file)))
-
-    context.run(plugins)
+        spec = script_file.read()
+
+    plugins = (
+        [replay.plugins.TemporaryDirectory(context)
+            if args.script_working_directory is TEMPORARY_DIRECTORY
+            else replay.plugins.WorkingDirectory(context)]
+        + [replay.plugins.CopyScript(
+            script_dir, os.path.basename(args.script_path),
+            args.stage_script, args.transfer_threads)]
+        + list(context.load_plugins(spec)))
+
+    run(context, spec, plugins, args.force)
 
 
 if __name__ == '__main__':
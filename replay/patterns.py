@@ -0,0 +1,213 @@
+'''I expand the patterns in Inputs and Outputs specs.
+
+A path on the side the files are copied from - the datastore path of an
+input, the local path of an output - is a pattern, if
+
+- it ends with /: all the files under the directory, or
+- it contains glob characters (*, ? or [): matched against each
+  component of the path with fnmatch, ** matches any number of
+  directories.
+
+The path on the other side is a directory, the matching files are put
+under it at their paths relative to the base of the pattern - the
+directories before the first component with glob characters.
+
+Patterns are expanded lazily: a directory is listed once and only if
+the pattern can match something in it.
+'''
+
+import fnmatch
+import os
+import posixpath
+import re
+
+import externals
+
+from replay import datastores
+from replay import tree
+
+
+# matches any number of directories
+RECURSIVE = '**'
+
+_GLOB_CHARACTERS = re.compile('[*?[]')
+
+
+def has_glob(path):
+    return _GLOB_CHARACTERS.search(path) is not None
+
+
+def is_pattern(path):
+    return path.endswith('/') or has_glob(path)
+
+
+def split(pattern):
+    '''I return the base directory of `pattern` and the components \
+    to match below it.
+    '''
+    components = [
+        component
+        for component in pattern.split('/')
+        if component not in ('', '.')]
+    for i, component in enumerate(components):
+        if has_glob(component):
+            components, base = components[i:], components[:i]
+            if components[-1] == RECURSIVE:
+                components.append('*')
+            return '/'.join(base), components
+    # a directory: all files under it
+    return '/'.join(components), [RECURSIVE, '*']
+
+
+def _relative(path, base):
+    '''I return `path` relative to `base` or None if it is not under it'''
+    if not base:
+        return path
+    if path.startswith(base + '/'):
+        return path[len(base) + 1:]
+    return None
+
+
+def _next_states(components, states, name, is_directory):
+    '''I return whether `name` matches `components` at `states` \
+    - indices into components - as a file, and the states to match \
+    its entries against as a directory.
+    '''
+    states = set(states)
+    # ** matching no directory
+    for i in list(states):
+        while i < len(components) and components[i] == RECURSIVE:
+            i += 1
+            states.add(i)
+    is_match = False
+    next_states = set()
+    for i in states:
+        if i == len(components):
+            continue
+        component = components[i]
+        if component == RECURSIVE:
+            if is_directory:
+                next_states.add(i)
+        elif fnmatch.fnmatchcase(name, component):
+            if i == len(components) - 1:
+                is_match = is_match or not is_directory
+            elif is_directory:
+                next_states.add(i + 1)
+    return is_match, next_states
+
+
+def matches(pattern, path):
+    '''I tell if the file at the normalized `path` matches `pattern`'''
+    base, components = split(pattern)
+    relpath = _relative(path, base)
+    if relpath is None:
+        return False
+    states = set([0])
+    names = relpath.split('/')
+    for depth, name in enumerate(names):
+        is_match, states = _next_states(
+            components, states, name, depth < len(names) - 1)
+        if depth == len(names) - 1:
+            return is_match
+    return False
+
+
+def overlap(path1, path2):
+    '''I tell if the files of two normalized spec paths might be the same'''
+    if not is_pattern(path1) and not is_pattern(path2):
+        return path1 == path2
+    if not is_pattern(path2):
+        return matches(path1, path2)
+    if not is_pattern(path1):
+        return matches(path2, path1)
+    base1 = split(path1)[0]
+    base2 = split(path2)[0]
+    return (
+        _relative(base1, base2) is not None
+        or _relative(base2, base1) is not None
+        or base1 == base2)
+
+
+def _local_entries(root):
+    def entries(relpath):
+        directory = os.path.join(root, relpath)
+        try:
+            if tree.scandir is not None:
+                return sorted(
+                    (entry.name, entry.is_dir())
+                    for entry in tree.scandir(directory))
+            return sorted(
+                (name, os.path.isdir(os.path.join(directory, name)))
+                for name in os.listdir(directory))
+        except OSError:
+            return []
+    return entries
+
+
+def _external_entries(root):
+    def entries(relpath):
+        directory = root / relpath if relpath else root
+        if not directory.is_dir():
+            return []
+        return sorted(
+            (child.name, child.is_dir()) for child in directory.children())
+    return entries
+
+
+def _walk(entries, components, relpath, states):
+    for name, is_directory in entries(relpath):
+        path = posixpath.join(relpath, name) if relpath else name
+        is_match, next_states = _next_states(
+            components, states, name, is_directory)
+        if is_match:
+            yield path
+        if next_states:
+            for match in _walk(entries, components, path, next_states):
+                yield match
+
+
+def expand(root, pattern):
+    '''I yield the paths of the files matching `pattern` under `root`, \
+    relative to `root`.
+
+    `root` is a local directory path or a datastore External.
+    The files of a datastores.Remote are listed in one request.
+    '''
+    base, components = split(pattern)
+    if isinstance(root, datastores.Remote):
+        prefix = posixpath.join(root.key, base) if root.key else base
+        for key in root.backend.list(prefix):
+            path = _relative(key, root.key) if root.key else key
+            if path is not None and matches(pattern, path):
+                yield path
+        return
+    if isinstance(root, externals.File):
+        entries = _local_entries(root.path)
+    elif hasattr(root, 'children'):
+        entries = _external_entries(root)
+    else:
+        entries = _local_entries(root)
+    for path in _walk(entries, components, base, set([0])):
+        yield path
+
+
+def destination(pattern, directory, path):
+    '''I return where the file at `path` matching `pattern` goes \
+    under `directory`.
+    '''
+    base, _ = split(pattern)
+    return posixpath.join(directory.rstrip('/'), _relative(path, base))
+
+
+def destination_pattern(pattern, directory):
+    '''I return the pattern of the files `pattern` puts under `directory`'''
+    _, components = split(pattern)
+    return '/'.join([directory.rstrip('/')] + components)
+
+
+def expand_mapping(root, pattern, directory):
+    '''I yield (path, destination) for the files matching `pattern` \
+    under `root`, see destination().
+    '''
+    for path in expand(root, pattern):
+        yield path, destination(pattern, directory, path)
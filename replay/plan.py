@@ -0,0 +1,155 @@
+'''I tell what a build of scripts would do, without doing it.
+
+Scripts are loaded and validated, their inputs checked in bulk and
+their fingerprints computed, to decide for each script, whether it
+would run, be skipped as up to date or be restored from the output cache.
+
+Nothing is written: the datastore, the caches and the virtualenvs
+are only read.
+'''
+
+import logging
+import os
+
+from replay import build
+from replay import build_state
+from replay import fingerprint
+from replay import patterns
+from replay import plugins
+
+
+log = logging.getLogger(__name__)
+
+# ScriptPlan.action values
+RUN = 'run'
+UP_TO_DATE = 'up to date'
+RESTORE = 'restore'
+SKIP = 'skip'
+ERROR = 'error'
+
+
+class ScriptPlan(object):
+
+    '''I am what a build would do with a script, and why'''
+
+    def __init__(self, path, action, reason=None):
+        self.path = path
+        self.action = action
+        self.reason = reason
+        # typical seconds of a successful run, from the run history
+        self.estimate = None
+        # names of the virtualenvs the run would have to build
+        self.new_virtualenvs = []
+
+
+def load_script(context, path):
+    '''I return the plugins a run of the script at `path` would set up, \
+    except for its working directory.
+    '''
+    script_dir = os.path.dirname(os.path.abspath(path))
+    return (
+        [plugins.CopyScript(script_dir, os.path.basename(path))]
+        + context.load_script(path))
+
+
+def plan(context, script_paths, history=None):
+    '''I return ScriptPlans for the scripts at `script_paths`: \
+    those with errors in their specs first, then the rest in the order
+    they would run.
+
+    `history` is a replay.history.History for estimates, or None.
+    Inconsistent scripts (e.g. circular dependencies) raise ValueError.
+    '''
+    plans = {}
+    loaded = {}
+    for path in script_paths:
+        try:
+            loaded[path] = load_script(context, path)
+        except (ValueError, ImportError) as e:
+            log.debug('plan: %s: %s', path, e)
+            plans[path] = ScriptPlan(path, ERROR, str(e))
+
+    specs = dict(
+        (path, build.script_spec(path, loaded[path])) for path in loaded)
+    graph = build.DependencyGraph(specs[path] for path in sorted(specs))
+    produced = set(
+        output for spec in specs.values() for output in spec.outputs)
+    missing = plugins.missing_datastore_paths(
+        context.datastore,
+        set(input for spec in specs.values() for input in spec.inputs))
+    # inputs no script produces
+    missing = set(
+        input for input in missing
+        if not any(patterns.overlap(input, output) for output in produced))
+
+    estimates = {}
+    if history is not None:
+        # scripts are told apart by their path, not their name
+        estimates = dict(
+            (stats.script_path, stats.p50)
+            for stats in history.script_stats()
+            if stats.script_path is not None)
+
+    state = build_state.BuildState(context.datastore)
+    order = graph.topological_order()
+    for path in order:
+        plans[path] = _plan_script(
+            context, state, path, loaded[path], specs[path], plans,
+            graph.dependencies[path], missing)
+        plans[path].estimate = estimates.get(os.path.abspath(path))
+
+    return (
+        [plans[path] for path in script_paths if path not in loaded]
+        + [plans[path] for path in order])
+
+
+def _plan_script(
+        context, state, path, script_plugins, spec, plans, dependencies,
+        missing):
+    missing_inputs = sorted(set(spec.inputs) & missing)
+    if missing_inputs:
+        return ScriptPlan(
+            path, ERROR, 'missing inputs: ' + ', '.join(missing_inputs))
+
+    failing = sorted(
+        dependency for dependency in dependencies
+        if plans[dependency].action in (ERROR, SKIP))
+    if failing:
+        return ScriptPlan(path, SKIP, 'depends on ' + ', '.join(failing))
+
+    rebuilt = sorted(
+        dependency for dependency in dependencies
+        if plans[dependency].action in (RUN, RESTORE))
+    if rebuilt:
+        script_plan = ScriptPlan(
+            path, RUN, 'inputs rebuilt by ' + ', '.join(rebuilt))
+    else:
+        script_plan = _plan_run(context, state, path, script_plugins)
+    if script_plan.action == RUN:
+        script_plan.new_virtualenvs = sorted(
+            plugin.virtualenv_name
+            for plugin in script_plugins
+            if isinstance(plugin, plugins.PythonDependencies)
+            and not plugin.virtualenv.is_complete)
+    return script_plan
+
+
+def _plan_run(context, state, path, script_plugins):
+    with open(path) as script_file:
+        spec_text = script_file.read()
+    run_fingerprint = fingerprint.fingerprint(script_plugins)
+    if state.is_up_to_date(state.key(spec_text, run_fingerprint)):
+        return ScriptPlan(path, UP_TO_DATE)
+
+    cache = context.output_cache
+    cached = None if cache is None else cache.lookup(run_fingerprint)
+    if cached is not None:
+        outputs = [
+            local_file
+            for plugin in script_plugins
+            if isinstance(plugin, plugins.Outputs)
+            for local_file, _ in plugin.output_names(cached)]
+        if outputs and all(name in cached for name in outputs):
+            return ScriptPlan(path, RESTORE)
+
+    return ScriptPlan(path, RUN)
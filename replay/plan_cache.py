@@ -0,0 +1,152 @@
+'''I keep the validated plugin specs of scripts as JSON, \
+so that scanning many scripts does not parse YAML again and again.
+
+An entry is reused without reading the script, if the size and the
+modification time of the script are unchanged, and after reading it,
+if the hash of its content is unchanged.
+
+The entries are in the datastore, shared with other users, so they
+are plain data: specs JSON can not represent exactly are not cached.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from replay import files
+
+
+log = logging.getLogger(__name__)
+
+# location of the plan cache in a local datastore
+PLAN_CACHE_DIRECTORY = '.replay/plans'
+
+# version of the entry format
+FORMAT = 2
+
+TEXT = type(u'')
+
+
+class PlanCache(object):
+
+    '''I am a directory of parsed scripts, one file for each script.
+
+    When `read_only`, I do not add or update entries.
+    '''
+
+    def __init__(self, directory, read_only=False):
+        self.directory = directory
+        self.read_only = read_only
+
+    def _entry_path(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode('utf8')).hexdigest()
+        return os.path.join(
+            self.directory, '{}.json'.format(key))
+
+    def _read_entry(self, entry_path):
+        try:
+            with open(entry_path, 'rb') as f:
+                entry = _from_json(json.loads(f.read().decode('utf8')))
+        except (IOError, OSError):
+            return None
+        except ValueError as e:
+            log.debug('PlanCache: ignoring broken %s (%s)', entry_path, e)
+            return None
+        if not isinstance(entry, dict) or entry.get('format') != FORMAT:
+            return None
+        return entry
+
+    def _write_entry(self, entry_path, entry):
+        files.makedirs(self.directory)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(entry, sort_keys=True).encode('utf8'))
+            os.rename(temp_path, entry_path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def load(self, path, parse):
+        '''I return the specs of the script at `path`.
+
+        `parse` is called with the content of the script, when it is not
+        cached or has changed, and must return the validated specs.
+        '''
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime]
+        entry_path = self._entry_path(path)
+        entry = self._read_entry(entry_path)
+        if entry is not None and entry['signature'] == signature:
+            return entry['specs']
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if entry is not None and entry['digest'] == digest:
+            specs = entry['specs']
+        else:
+            log.debug('PlanCache: parsing %s', path)
+            specs = parse(content)
+
+        if self.read_only:
+            return specs
+        if not _is_json(specs):
+            log.debug('PlanCache: can not cache %s as JSON', path)
+            return specs
+        if time.time() - stat.st_mtime < files.RACY_SECONDS:
+            signature = None
+        try:
+            self._write_entry(
+                entry_path,
+                dict(
+                    format=FORMAT,
+                    path=os.path.abspath(path),
+                    signature=signature,
+                    digest=digest,
+                    specs=specs))
+        except (IOError, OSError) as e:
+            log.debug('PlanCache: can not cache %s (%s)', path, e)
+        return specs
+
+
+def _from_json(value):
+    '''I return `value` decoded from JSON with the types YAML gives: \
+    on python 2 ASCII strings are str.
+    '''
+    if isinstance(value, dict):
+        return dict(
+            (_from_json(key), _from_json(item))
+            for key, item in value.items())
+    if isinstance(value, list):
+        return [_from_json(item) for item in value]
+    if isinstance(value, TEXT) and str is bytes:
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+    return value
+
+
+def _is_json(specs):
+    '''I tell whether `specs` come back unchanged from JSON'''
+    try:
+        decoded = _from_json(json.loads(json.dumps(specs)))
+    except (TypeError, ValueError):
+        return False
+    return _same(_from_json(specs), decoded)
+
+
+def _same(a, b):
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return (
+            set(a) == set(b)
+            and all(_same(a[key], b[key]) for key in a))
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
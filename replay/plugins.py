@@ -1,18 +1,45 @@
 import abc
+import functools
 from . import external_process
 import shutil
 import os
+import tempfile
+import posixpath
+from replay import compression
+from replay import datastores
 from replay import exceptions
+from replay import files
 import getpass
 import datetime
-import tempfile
+import time
 import externals
 import hashlib
+import json
 import logging
+import uuid
+from replay import fingerprint
+from replay import locking
+from replay import patterns
+from replay import staging
+from replay import trash
+from replay import tree
+from replay import units
+from replay import venvs
 
 
 log = logging.getLogger(__name__)
 
+# directory in the datastore for outputs being uploaded
+DATASTORE_STAGING_DIRECTORY = datastores.STAGING_DIRECTORY
+
+# location of the logs of runs in a local datastore
+LOGS_DIRECTORY = '.replay/logs'
+
+# resource provided by the plugins changing to the working directory
+WORKING_DIRECTORY = 'working directory'
+# resource provided by CopyScript: the script files in the working directory
+SCRIPT_COPIED = 'script copied'
+
 
 class Plugin(object):
 
@@ -24,9 +51,46 @@ class Plugin(object):
 
     __metaclass__ = abc.ABCMeta
 
+    # resources (e.g. WORKING_DIRECTORY, environment variable names)
+    # my provision needs from the plugins before me,
+    # None: everything the plugins before me set up, see Context.run
+    requires = None
+    # resources I set up
+    provides = frozenset()
+
+    # seconds the setup (provision and __enter__) may take, None: no limit.
+    # Commands run with run_command are killed when it is over, other
+    # waits (e.g. for locks) are checked only after they are done.
+    timeout = None
+
     def __init__(self, context, script):
         self.context = context
         self.script = script
+        # time.time() by when the setup must finish, set by Context.run
+        self.deadline = None
+        self.provisioned = False
+
+    def prepare(self):
+        '''I am called for all plugins before any of them is entered.
+
+        I should fail early on problems, that would make the run fail
+        later, without changing anything.
+        '''
+
+    def provision(self):
+        '''I do the slow part of the setup, that does not change \
+        the working directory or environment variables.
+
+        Context.run might call me in a thread, at the same time as other
+        plugins are set up, once the plugins before me providing what
+        I require are entered. __exit__ is called also when only
+        provision was done.
+        '''
+
+    def provision_once(self):
+        if not self.provisioned:
+            self.provision()
+            self.provisioned = True
 
     @abc.abstractmethod
     def __enter__(self):  # pragma: nocover
@@ -35,14 +99,47 @@ class Plugin(object):
     def __exit__(self, exc_type, exc_value, traceback):
         log.debug('%s: __exit__', self.__class__.__name__)
 
+    def remaining_time(self):
+        '''I return the seconds left of my timeout or None'''
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - time.time())
+
+    def run_command(self, args_list, **kwargs):
+        '''I run a command of my setup within what is left of my timeout.
+
+        I raise Timeout if the command had to be killed.
+        '''
+        result = external_process.run(
+            args_list, timeout=self.remaining_time(), **kwargs)
+        if result.timed_out:
+            raise exceptions.Timeout(result)
+        return result
+
+    def fingerprint(self):
+        '''I return strings describing what the result of the run \
+        depends on from my side.
+
+        Run locations (e.g. directories, datastore paths) are not included,
+        only the content and the computation.
+        '''
+        return [
+            self.__class__.__name__,
+            json.dumps(self.script, sort_keys=True, default=repr)]
+
 
 class _WorkingDirectoryPlugin(Plugin):
 
     '''I am a base class helping to implement real Plugins \
     that ensure that the scripts run in a clean directory, \
     and also clean up after them.
+
+    The directory is moved to the trash on exit and removed in the
+    background (see replay.trash).
     '''
 
+    provides = frozenset([WORKING_DIRECTORY])
+
     def __init__(self, context):
         super(_WorkingDirectoryPlugin, self).__init__(context, script=None)
         self.original_working_directory = os.getcwd()
@@ -54,15 +151,18 @@ class _WorkingDirectoryPlugin(Plugin):
             self._change_to_directory(self.original_working_directory)
         finally:
             log.debug(
-                '%s: rmtree %s',
+                '%s: discard %s',
                 self.__class__.__name__,
                 self.working_directory)
-            shutil.rmtree(self.working_directory)
+            trash.discard(self.working_directory)
 
     def _change_to_directory(self, directory):
         log.debug('%s: chdir %s', self.__class__.__name__, directory)
         os.chdir(directory)
 
+    def fingerprint(self):
+        return []
+
 
 class WorkingDirectory(_WorkingDirectoryPlugin):
 
@@ -89,7 +189,7 @@ class TemporaryDirectory(_WorkingDirectoryPlugin):
 
     def __enter__(self):
         log.debug('TemporaryDirectory: __enter__')
-        self.working_directory = tempfile.mkdtemp()
+        self.working_directory = trash.make_temporary_directory()
         self._change_to_directory(self.working_directory)
 
 
@@ -99,90 +199,416 @@ class CopyScript(Plugin):
 
     I am pretty special, in a way, that I must immediately follow either of
     WorkingDirectory or TemporaryDirectory in the plugin list.
+
+    Files ignored by the .replayignore of the script directory
+    (see replay.tree) are neither copied nor fingerprinted.
+    Files are put in place with the staging `strategy`, `threads` at once,
+    symbolic links are copied as links, except for those pointing outside
+    the script directory: their targets are copied (see tree.walk).
+
+    The script specification file `spec_file` - relative to `script_dir` -
+    is not part of my fingerprint, its content is fingerprinted by
+    the plugins it describes.
     '''
 
-    def __init__(self, script_dir):
+    requires = frozenset([WORKING_DIRECTORY])
+    provides = frozenset([SCRIPT_COPIED])
+
+    def __init__(
+            self, script_dir, spec_file=None, strategy=staging.COPY,
+            threads=1):
         super(CopyScript, self).__init__(context=None, script=None)
         self.script_dir = script_dir
+        self.spec_file = spec_file
+        self.strategy = strategy
+        self.threads = threads
+        self.ignore_rules = tree.IgnoreRules.load(script_dir)
 
     def __enter__(self):
+        self.provision_once()
+
+    def provision(self):
         source = self.script_dir
         destination = os.getcwd()
         log.debug('CopyScript: %s -> %s', source, destination)
         self._copy_tree(source, destination)
 
+    def fingerprint(self):
+        ignored_files = [self.spec_file] if self.spec_file else []
+        return [
+            'CopyScript',
+            fingerprint.hash_tree(
+                self.script_dir, ignored_files, self.ignore_rules)]
+
     def _copy_tree(self, source, destination):
-        for child in os.listdir(source):
-            s = os.path.join(source, child)
-            d = os.path.join(destination, child)
-            if os.path.isdir(s):
-                log.debug('CopyScript: mkdir %s', d)
-                os.mkdir(d)
-                self._copy_tree(s, d)
+        to_copy = []
+        for relpath, path, kind in tree.walk(source, self.ignore_rules):
+            target = os.path.join(destination, relpath)
+            if kind == tree.DIRECTORY:
+                os.mkdir(target)
+            elif kind == tree.LINK:
+                os.symlink(os.readlink(path), target)
             else:
-                log.debug('CopyScript: cp %s %s', s, d)
-                shutil.copy2(s, d)
+                to_copy.append((path, target))
+
+        def copy(pair):
+            staging.stage(pair[0], pair[1], self.strategy)
+        staging.map_in_parallel(copy, to_copy, self.threads)
+
+
+def normalize_datastore_path(path):
+    '''I return a canonical form of a datastore path, \
+    so that paths referring to the same file compare equal.
+
+    The trailing / of directory patterns (see replay.patterns) is kept.
+    '''
+    normalized = posixpath.normpath(path).lstrip('/')
+    if path.endswith('/'):
+        normalized += '/'
+    return normalized
+
+
+def missing_datastore_paths(datastore, paths):
+    '''I return the set of normalized `paths` not existing in `datastore`.
+
+    Local and remote datastores check directories in bulk
+    (see replay.datastores), instead of the paths one by one.
+    Patterns (see replay.patterns) are missing without a matching file.
+    '''
+    paths = set(paths)
+    globs = set(path for path in paths if patterns.is_pattern(path))
+    missing = set(
+        pattern for pattern in globs
+        if next(patterns.expand(datastore, pattern), None) is None)
+    paths -= globs
+    missing.update(datastores.as_remote(datastore).missing(paths))
+    return missing
 
 
 class _DataStorePlugin(Plugin):
 
-    def _file_pairs(self, copy_spec):
-        datastore = self.context.datastore
-        working_directory = externals.working_directory()
+    '''I copy files between the working directory and the datastore.
 
-        for spec in copy_spec:
-            for local_file, ds_file in spec.iteritems():
-                yield (working_directory / local_file), (datastore / ds_file)
+    The side of my spec the files are copied from can have patterns,
+    see replay.patterns.
+    '''
+
+    def __init__(self, context, script):
+        super(_DataStorePlugin, self).__init__(context, script)
+        # (local file name, datastore file name) pairs of the spec
+        self.file_names = [
+            (local_file, ds_file)
+            for spec in script or []
+            for local_file, ds_file in sorted(spec.items())]
+
+    def datastore_paths(self):
+        '''I return the normalized datastore paths in my spec'''
+        for _, ds_file in self.file_names:
+            yield normalize_datastore_path(ds_file)
+
+    def _datastore(self):
+        '''I return the context's datastore as a datastores.Remote, \
+        staging local files with the context's input_staging.
+        '''
+        return datastores.as_remote(
+            self.context.datastore, self.context.input_staging)
+
+    def _file_pairs(self, names):
+        '''I return (local External, datastore Remote) pairs for the \
+        (local, datastore) file `names`, the local files in the current
+        working directory.
+        '''
+        datastore = self._datastore()
+        working_directory = externals.working_directory()
+        return [
+            (working_directory / local_file, datastore / ds_file)
+            for local_file, ds_file in names]
 
 
 class Inputs(_DataStorePlugin):
 
     '''I ensure that inputs are available from DataStore and outputs are saved.
+
+    Inputs are staged according to the context's input_staging strategy,
+    with the context's check_inputs set, I also verify after the run,
+    that the DataStore files were neither modified nor removed.
+    Hard and symbolic links share the DataStore file, so the check finds
+    changes only after they are made - they are not prevented.
+
+    The existence of the inputs is checked once, in bulk (see
+    missing_datastore_paths), and all the missing ones are reported.
+    The files matched by a pattern are staged one by one, the local
+    directories are always created, so writes into them do not reach
+    the DataStore.
+    Inputs are staged after the script is copied, replacing script files
+    of the same name.
     '''
 
+    requires = frozenset([WORKING_DIRECTORY, SCRIPT_COPIED])
+
+    def __init__(self, context, script):
+        super(Inputs, self).__init__(context, script)
+        self.input_states = None
+        # (local, datastore) names of the input files, patterns expanded
+        self.names = None
+        # normalized datastore paths of the missing inputs
+        self.missing = None
+        # digests of the existing inputs by datastore file name
+        self.digests = None
+
+    def prepare(self):
+        self._check_inputs()
+
     def __enter__(self):
+        self.provision_once()
+
+    def provision(self):
         self._check_inputs()
-        self._download_inputs()
+        pairs = self._file_pairs(self.input_names())
+        if self.context.check_inputs:
+            self.input_states = self._get_input_states(pairs)
+        self._download_inputs(pairs)
+        report = self.context.report
+        if report is not None:
+            report.add_input_digests(
+                self.context.hash_algorithm, self.input_digests())
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
-
-    def _input_file_pairs(self):
-        return self._file_pairs(self.script)
+        if self.input_states is None:
+            return
+        modified = [
+            datastore
+            for datastore, state in self.input_states
+            if datastore.stat() != state]
+        if modified:
+            if exc_type is None:
+                raise exceptions.ModifiedInput(*modified)
+            log.warning('Inputs: modified during the run: %s', modified)
+
+    def fingerprint(self):
+        items = ['Inputs']
+        digests = self.input_digests()
+        for local_file, ds_file in self.input_names():
+            items.extend([local_file, digests.get(ds_file, '')])
+        return items
+
+    def input_names(self):
+        '''I return the (local, datastore) names of my input files, \
+        with the patterns expanded in the datastore once.
+        '''
+        if self.names is None:
+            datastore = self.context.datastore
+            self.names = []
+            for local_file, ds_file in self.file_names:
+                if not patterns.is_pattern(ds_file):
+                    self.names.append((local_file, ds_file))
+                    continue
+                self.names.extend(
+                    (local_path, ds_path)
+                    for ds_path, local_path in patterns.expand_mapping(
+                        datastore, normalize_datastore_path(ds_file),
+                        local_file))
+        return self.names
+
+    def input_digests(self):
+        '''I return {datastore file name: digest} of my existing inputs.
+
+        The inputs are hashed once, in parallel, with the digests of local
+        files looked up in the context's hash_cache.
+        '''
+        if self.digests is None:
+            context = self.context
+            ds_files = sorted(set(
+                ds_file for _, ds_file in self.input_names()))
+            missing = self._missing_inputs()
+            ds_files = [
+                ds_file for ds_file in ds_files
+                if normalize_datastore_path(ds_file) not in missing]
+            self.digests = dict(zip(ds_files, fingerprint.hash_externals(
+                [context.datastore / ds_file for ds_file in ds_files],
+                context.hash_algorithm,
+                context.transfer_threads,
+                context.hash_cache)))
+        return self.digests
+
+    def _missing_inputs(self):
+        if self.missing is None:
+            ds_paths = list(self.datastore_paths())
+            self.missing = missing_datastore_paths(
+                self.context.datastore,
+                [path for path in ds_paths if not patterns.is_pattern(path)])
+            expanded = [ds_file for _, ds_file in self.input_names()]
+            self.missing.update(
+                path for path in ds_paths
+                if patterns.is_pattern(path)
+                and not any(patterns.matches(path, ds) for ds in expanded))
+        return self.missing
 
     def _check_inputs(self):
-        for local, datastore in self._input_file_pairs():
-            if not datastore.exists():
-                raise exceptions.MissingInput(datastore)
-
-    def _download_inputs(self):
-        for local, datastore in self._input_file_pairs():
-            datastore.copy_to(local)
+        missing = self._missing_inputs()
+        if missing:
+            raise exceptions.MissingInput(*sorted(missing))
+
+    def _get_input_states(self, pairs):
+        return [(datastore, datastore.stat()) for local, datastore in pairs]
+
+    def _download_inputs(self, pairs):
+        threads = self.context.transfer_threads
+        report = self.context.report
+        # inputs compressed by replay are decompressed on the way,
+        # looked for only in datastores with compressed outputs
+        if self.context.compression is None:
+            codecs = [None] * len(pairs)
+        else:
+            codecs = staging.map_in_parallel(
+                lambda pair: compression.codec_of(pair[1]), pairs, threads)
+        staging.map_in_parallel(
+            lambda item: compression.download(
+                item[0][1], item[0][0].path, item[1]),
+            [
+                (pair, codec)
+                for pair, codec in zip(pairs, codecs)
+                if codec is not None],
+            threads)
+        raw_pairs = [
+            pair for pair, codec in zip(pairs, codecs) if codec is None]
+        staging.map_in_parallel(
+            lambda pair: pair[1].download(pair[0].path, threads),
+            raw_pairs, threads)
+        if report is not None:
+            for local, _ in pairs:
+                report.add_bytes_staged(os.path.getsize(local.path))
 
 
 class Outputs(_DataStorePlugin):
 
     '''I ensure outputs are saved to DataStore.
+
+    All the missing outputs are reported, found with one listing
+    of each directory. With the context's compression set, outputs are
+    compressed while uploaded, Inputs with the compression set
+    decompresses them transparently.
     '''
 
     def __enter__(self):
         pass
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self._check_outputs()
-        self._upload_outputs()
-
-    def _output_file_pairs(self):
-        return self._file_pairs(self.script)
-
-    def _check_outputs(self):
-        for local, datastore in self._output_file_pairs():
-            if not local.exists():
-                raise exceptions.MissingOutput(local)
-
-    def _upload_outputs(self):
-        for local, datastore in self._output_file_pairs():
-            local.copy_to(datastore)
+        names = self.output_names()
+        self._check_outputs(names)
+        pairs = self._file_pairs(names)
+        cache = self._output_cache() if exc_type is None else None
+        digests = None
+        if self.context.report is not None or cache is not None:
+            # hashed once for both
+            digests = fingerprint.hash_files(
+                [local.path for local, _ in pairs],
+                self.context.hash_algorithm,
+                self.context.transfer_threads)
+        self._report_output_digests(names, digests)
+        self._upload_outputs(pairs)
+        if cache is not None:
+            self._cache_outputs(cache, names, pairs, digests)
+
+    def datastore_paths(self):
+        '''I return the normalized datastore paths in my spec, \
+        patterns for the files of local patterns.
+        '''
+        for local_file, ds_file in self.file_names:
+            if patterns.is_pattern(local_file):
+                ds_file = patterns.destination_pattern(local_file, ds_file)
+            yield normalize_datastore_path(ds_file)
+
+    def output_names(self, local_names=None):
+        '''I return the (local, datastore) names of my output files.
+
+        Patterns are expanded in the working directory, or against
+        `local_names` if given (e.g. the outputs recorded in the output
+        cache).
+        '''
+        names = []
+        for local_file, ds_file in self.file_names:
+            if not patterns.is_pattern(local_file):
+                names.append((local_file, ds_file))
+                continue
+            if local_names is None:
+                matching = patterns.expand(
+                    externals.working_directory().path, local_file)
+            else:
+                matching = sorted(
+                    name for name in local_names
+                    if patterns.matches(local_file, name))
+            names.extend(
+                (path, patterns.destination(local_file, ds_file, path))
+                for path in matching)
+        return names
+
+    def fingerprint(self):
+        local_files = sorted(
+            local_file
+            for spec in self.script or []
+            for local_file in spec.keys())
+        return ['Outputs'] + local_files
+
+    def _check_outputs(self, names):
+        backend = datastores.FileBackend(externals.working_directory().path)
+        missing = backend.missing(
+            posixpath.normpath(local_file)
+            for local_file, _ in self.file_names
+            if not patterns.is_pattern(local_file))
+        missing.update(
+            local_file
+            for local_file, _ in self.file_names
+            if patterns.is_pattern(local_file)
+            and not any(
+                patterns.matches(local_file, name) for name, _ in names))
+        if missing:
+            raise exceptions.MissingOutput(*sorted(missing))
+
+    def _report_output_digests(self, names, digests):
+        report = self.context.report
+        if report is None:
+            return
+        report.add_output_digests(
+            self.context.hash_algorithm,
+            dict(zip([ds_file for _, ds_file in names], digests)))
+
+    def _upload_outputs(self, pairs):
+        threads = self.context.transfer_threads
+        report = self.context.report
+        if report is not None:
+            report.add_bytes_uploaded(
+                sum(os.path.getsize(local.path) for local, _ in pairs))
+        codec = self.context.compression
+        write = (
+            functools.partial(compression.compress_to, codec=codec)
+            if codec is not None else None)
+        self._datastore().backend.publish(
+            [(local.path, ds.key) for local, ds in pairs], threads, write)
+
+    def _output_cache(self):
+        '''I return the output cache to store the outputs in or None'''
+        if self.context.run_fingerprint is None:
+            return None
+        return self.context.output_cache
+
+    def _cache_outputs(self, cache, names, pairs, digests):
+        ds_paths = [ds.backend.local_path(ds.key) for _, ds in pairs]
+        if None not in ds_paths and self.context.compression is None:
+            # uploaded already, usually on the filesystem of the cache,
+            # unlike the working directory: cloned if possible
+            paths = ds_paths
+            disposable = False
+        else:
+            # the working directory is discarded after the run
+            paths = [local.path for local, _ in pairs]
+            disposable = True
+        local_files = [local_file for local_file, _ in names]
+        cache.store(
+            self.context.run_fingerprint,
+            list(zip(local_files, paths)),
+            dict(zip(local_files, digests)),
+            disposable)
 
 
 class _EnvironKeyState(object):
@@ -204,24 +630,55 @@ class _EnvironKeyState(object):
 
 class PythonDependencies(Plugin):
 
+    '''I provide a virtualenv with the required python packages.
+
+    Virtualenvs are shared between runs with the same dependencies,
+    and packages are installed from wheels in the context's wheelhouse.
+    A new virtualenv is layered on an existing one, if that has a subset
+    of the dependencies, see replay.venvs for how they are managed.
+
+    The virtualenv is built concurrently with the setup of the working
+    directory, unless a dependency refers to local files (e.g. ./libs/pkg),
+    which are then installed from the copy of the script.
+    '''
+
+    COMPLETE_MARKER = venvs.COMPLETE_MARKER
+
+    requires = frozenset()
+    provides = frozenset(['PATH'])
+
     def __init__(self, context, script):
         super(PythonDependencies, self).__init__(context, script)
         self.python_dependencies = self.script or []
-        self.virtualenv_name = '_replay_' + self._package_hash()
+        if any(_is_local_requirement(d) for d in self.python_dependencies):
+            self.requires = frozenset([WORKING_DIRECTORY, SCRIPT_COPIED])
+        self.virtualenv_name = venvs.NAME_PREFIX + self._package_hash()
         self.virtualenv_dir = (
             self.context.virtualenv_parent_dir / self.virtualenv_name)
+        self.virtualenv = venvs.Virtualenv(
+            self.context.virtualenv_parent_dir.path, self.virtualenv_name)
+        self.in_use_lock = None
         self.PATH = None
 
+    def provision(self):
+        self._use_virtualenv()
+        self._enforce_virtualenv_budget()
+
     def __enter__(self):
+        self.provision_once()
         self.PATH = _EnvironKeyState(os.environ, 'PATH')
         venv_bin = (self.virtualenv_dir / 'bin').path
         path = venv_bin + os.pathsep + os.environ.get('PATH', '')
         os.environ['PATH'] = path
-        if not self.virtualenv_dir.exists():
-            self._make_virtualenv()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.PATH.restore()
+        if self.PATH is not None:
+            self.PATH.restore()
+        if self.in_use_lock is not None:
+            self.in_use_lock.release()
+
+    def fingerprint(self):
+        return ['PythonDependencies', self._package_hash()]
 
     def _package_hash(self):
         dependencies = u'\n'.join(sorted(self.python_dependencies))
@@ -231,35 +688,180 @@ class PythonDependencies(Plugin):
     def index_server_url(self):
         return self.context.index_server_url
 
-    def _install_package(self, package_spec, index_server_url):
-        pip = (self.virtualenv_dir / 'bin' / 'pip').path
+    def _use_virtualenv(self):
+        # the shared lock prevents removal of the virtualenv while in use
+        while True:
+            self.build_virtualenv()
+            self.in_use_lock = locking.FileLock(
+                self.virtualenv.lock_path, shared=True)
+            self.in_use_lock.acquire()
+            if self.virtualenv.is_complete:
+                break
+            # removed before we could lock it
+            self.in_use_lock.release()
+        self.virtualenv.touch()
+
+    def build_virtualenv(self):
+        '''I make sure the virtualenv exists and is complete'''
+        if not self.virtualenv.is_complete:
+            self._make_virtualenv()
+
+    def _enforce_virtualenv_budget(self):
+        budget = self.context.virtualenv_budget
+        if budget is not None:
+            parent_dir = self.context.virtualenv_parent_dir.path
+            venvs.VirtualenvPool(parent_dir).prune(budget)
+
+    def _install_packages(self, package_specs, index_server_url):
+        pip = [(self.virtualenv_dir / 'bin' / 'pip').path]
+        if self.context.wheelhouse is not None:
+            wheelhouse = venvs.Wheelhouse(self.context.wheelhouse)
+            if self._wheelhouse_install(wheelhouse, pip, package_specs):
+                return
+            added = wheelhouse.add(
+                pip, package_specs, index_server_url, self.remaining_time())
+            if added.timed_out:
+                raise exceptions.Timeout(added)
+            if (added.status == 0
+                    and self._wheelhouse_install(
+                        wheelhouse, pip, package_specs)):
+                return
+            log.debug(
+                'PythonDependencies: install without wheelhouse, %s', added)
         cmdspec = (
-            [pip, 'install']
+            pip + ['install']
             + (['--index-url=' + index_server_url] if index_server_url else [])
-            + [package_spec])
-        env = {'PIP_CONFIG_FILE': os.devnull}
-        result = external_process.run(cmdspec, env=env)
+            + list(package_specs))
+        result = self.run_command(cmdspec, env=venvs.PIP_ENV)
         if result.status != 0:
             raise exceptions.MissingPythonDependency(result)
 
+    def _wheelhouse_install(self, wheelhouse, pip, package_specs):
+        result = wheelhouse.install(pip, package_specs, self.remaining_time())
+        if result.timed_out:
+            raise exceptions.Timeout(result)
+        return result.status == 0
+
     def _make_virtualenv(self):
         # potential enhancements:
         #  - clean environment from behavior changing settings
         #    (e.g. PYTHON_VIRTUALENV)
         #  - specify python interpreter to use (python 2 / 3 / pypy / ...)
-        external_process.run(['virtualenv', self.virtualenv_dir.path])
-        python_dependencies = self.python_dependencies
-        for package_spec in python_dependencies:
-            self._install_package(package_spec, self.index_server_url)
+        with locking.FileLock(self.virtualenv.lock_path):
+            # it might have been built while we were waiting for the lock
+            if self.virtualenv.is_complete:
+                return
+
+            virtualenv_dir = self.virtualenv.path
+            if os.path.exists(virtualenv_dir):
+                log.debug(
+                    'PythonDependencies: remove incomplete %s',
+                    virtualenv_dir)
+                shutil.rmtree(virtualenv_dir)
+
+            result = self.run_command(['virtualenv', virtualenv_dir])
+            if result.status != 0:
+                raise exceptions.MissingPythonDependency(result)
+
+            base, base_lock = self._lock_base_virtualenv()
+            try:
+                python_dependencies = self.python_dependencies
+                if base is not None:
+                    self.virtualenv.layer_on(base)
+                    python_dependencies = [
+                        dependency
+                        for dependency in python_dependencies
+                        if dependency not in base.python_dependencies]
+                if python_dependencies:
+                    # one pip run, so that all requirements are resolved
+                    # together
+                    self._install_packages(
+                        python_dependencies, self.index_server_url)
+
+                self.virtualenv.write_marker(self.python_dependencies, base)
+            finally:
+                if base_lock is not None:
+                    base_lock.release()
+
+    def _lock_base_virtualenv(self):
+        # the shared lock keeps the base from removal until our completion
+        # marker refers to it
+        if not self.context.layered_virtualenvs:
+            return None, None
+        pool = venvs.VirtualenvPool(self.context.virtualenv_parent_dir.path)
+        base = pool.find_base(self.python_dependencies)
+        if base is None:
+            return None, None
+        lock = locking.FileLock(base.lock_path, shared=True)
+        lock.acquire()
+        if not base.is_complete:
+            lock.release()
+            return None, None
+        return base, lock
+
+
+def _is_local_requirement(requirement):
+    '''I tell whether the pip `requirement` might refer to local files'''
+    return (
+        requirement.startswith(('.', '-', 'file:'))
+        or '/' in requirement)
+
+
+def _psql(sql):
+    '''I return the command line running `sql`'''
+    return [
+        'psql', '--no-psqlrc', '--tuples-only', '--no-align',
+        '--dbname=postgres', '--command=' + sql]
+
+
+def _quote_identifier(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _quote_literal(value):
+    return "'{}'".format(value.replace("'", "''"))
 
 
 class Postgres(Plugin):
 
+    '''I provide a fresh database for the run in $PGDATABASE.
+
+    The database is created from the `template` database if given,
+    so that seed schemas and data are copied instead of rebuilt.
+
+    With `pool size`, I keep that many databases created from the template
+    ready: a run claims one by renaming it, and at the end of the run
+    the pool is refilled, so creating the database is off the critical
+    path of later runs. A failed refill is logged, it does not fail
+    the run.
+
+    Pool databases are keyed by the `template version` - e.g. the last
+    migration applied to the template -, so that a changed template is
+    not served from databases created from its earlier content: these
+    are dropped when the pool is refilled. The template itself is not
+    read (dumping it for every run would cost more than the pool saves,
+    and a connection to it makes createdb --template fail), so the
+    version must be changed with the template.
+
+        Postgres:
+            template: seeded
+            template version: 20240101_add_users
+            pool size: 4
+    '''
+
+    POOL_PREFIX = 'replay_pool_'
+
+    requires = frozenset()
+    provides = frozenset(['PGDATABASE'])
+
     def __init__(self, context, script):
         super(Postgres, self).__init__(context, script)
         self.timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
         self.keep_database = script.get('keep database', False)
         self.script_name = script.get('script name', 'SCRIPT_NAME')
+        self.template = script.get('template')
+        self.pool_size = script.get('pool size', 0)
+        self.template_version = script.get('template version')
         self.PGDATABASE = None
 
     @property
@@ -269,23 +871,253 @@ class Postgres(Plugin):
             script_name=self.script_name,
             timestamp=self.timestamp)
 
+    @property
+    def template_name(self):
+        return self.template or 'template1'
+
+    @property
+    def template_prefix(self):
+        '''I am the name prefix of pool databases for the template \
+        of any version'''
+        template = self.template_name.encode('utf8')
+        return '{}{}_'.format(
+            self.POOL_PREFIX, hashlib.md5(template).hexdigest()[:12])
+
+    @property
+    def pool_prefix(self):
+        '''I am the name prefix of pool databases for the template \
+        of the current version'''
+        version = u'{}'.format(
+            '' if self.template_version is None else self.template_version)
+        return '{}{}_'.format(
+            self.template_prefix,
+            hashlib.md5(version.encode('utf8')).hexdigest()[:12])
+
+    def provision(self):
+        if not (self.pool_size and self._claim_pool_database()):
+            self._create_database(self.database)
+
     def __enter__(self):
+        self.provision_once()
         self.PGDATABASE = _EnvironKeyState(os.environ, 'PGDATABASE')
         os.environ['PGDATABASE'] = self.database
-        external_process.run(['createdb', self.database])
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.PGDATABASE.restore()
+        if self.PGDATABASE is not None:
+            self.PGDATABASE.restore()
         if not self.keep_database:
             external_process.run(['dropdb', self.database])
+        if self.pool_size:
+            try:
+                self.fill_pool()
+            except Exception as e:
+                log.warning('Postgres: can not refill the pool: %s', e)
+
+    def _create_database(self, database):
+        cmdspec = ['createdb']
+        if self.template:
+            cmdspec.append('--template=' + self.template)
+        result = self.run_command(cmdspec + [database])
+        if result.status != 0:
+            raise exceptions.DatabaseError(result)
+
+    def _databases(self, prefix):
+        result = self.run_command(_psql(
+            'SELECT datname FROM pg_database'
+            ' WHERE substr(datname, 1, {}) = {}'.format(
+                len(prefix), _quote_literal(prefix))))
+        if result.status != 0:
+            raise exceptions.DatabaseError(result)
+        return sorted(result.stdout.decode('utf8').split())
+
+    def pool_databases(self):
+        return self._databases(self.pool_prefix)
+
+    def stale_pool_databases(self):
+        '''I return the pool databases created from an earlier content \
+        of the template'''
+        pool_prefix = self.pool_prefix
+        return [
+            database
+            for database in self._databases(self.template_prefix)
+            if not database.startswith(pool_prefix)]
+
+    def _claim_pool_database(self):
+        # renaming is atomic: of concurrent runs only one gets a database
+        for pool_database in self.pool_databases():
+            result = self.run_command(_psql(
+                'ALTER DATABASE {} RENAME TO {}'.format(
+                    _quote_identifier(pool_database),
+                    _quote_identifier(self.database))))
+            if result.status == 0:
+                log.debug(
+                    'Postgres: claimed %s as %s', pool_database, self.database)
+                return True
+        return False
+
+    def fill_pool(self):
+        '''I create pool databases until there are `pool size` of them'''
+        for database in self.stale_pool_databases():
+            log.debug('Postgres: dropping stale %s', database)
+            external_process.run(['dropdb', database])
+        missing = self.pool_size - len(self.pool_databases())
+        for _ in range(missing):
+            self._create_database(self.pool_prefix + uuid.uuid4().hex[:16])
 
 
 class Execute(Plugin):
 
+    '''I run a shell command in the working directory.
+
+    The full stdout and stderr of the command are saved in the context's
+    log_directory - outside of the working directory, so that they are
+    kept after the run -, only their tails are kept in memory.
+    Without a log_directory, they are written to a temporary directory,
+    then uploaded under LOGS_DIRECTORY in the datastore.
+
+    The spec is either the command or a mapping with the command
+    as `script` and the limits of its resources, see
+    external_process.Limits:
+
+        Execute:
+            script: python train.py
+            cpus: 4  # or the list of CPU ids
+            memory: 8G
+            open files: 1024
+            nice: 10
+            io priority: idle  # or 0 (highest) - 7
+
+    The wall clock time is limited by the timeout key of the spec.
+    '''
+
+    STDOUT_LOG = 'execute.stdout.log'
+    STDERR_LOG = 'execute.stderr.log'
+
+    LIMIT_KEYS = ('cpus', 'memory', 'open files', 'nice', 'io priority')
+
+    def __init__(self, context, script):
+        super(Execute, self).__init__(context, script)
+        self.limits = None
+        self.stdout_log = None
+        self.stderr_log = None
+        if isinstance(script, dict):
+            spec = dict(script)
+            self.command = spec.pop('script', None)
+            if not self.command:
+                raise ValueError('Execute: script is missing')
+            unknown = set(spec) - set(self.LIMIT_KEYS)
+            if unknown:
+                raise ValueError(
+                    'Execute: unknown keys: {}'.format(
+                        ', '.join(sorted(unknown))))
+            if spec:
+                self.limits = self._parse_limits(spec)
+        else:
+            self.command = script
+
+    @staticmethod
+    def _parse_limits(spec):
+        def positive_int(key):
+            value = spec.get(key)
+            if value is not None and not (
+                    isinstance(value, int)
+                    and not isinstance(value, bool)
+                    and value > 0):
+                raise ValueError(
+                    'Execute: {} is not a positive integer'.format(key))
+            return value
+
+        cpus = spec.get('cpus')
+        if isinstance(cpus, list):
+            if not cpus or not all(
+                    isinstance(cpu, int) and not isinstance(cpu, bool)
+                    and cpu >= 0
+                    for cpu in cpus):
+                raise ValueError('Execute: cpus is not a list of CPU ids')
+        else:
+            cpus = positive_int('cpus')
+        memory = spec.get('memory')
+        if memory is not None:
+            memory = units.parse_size(memory)
+        nice = spec.get('nice')
+        if nice is not None and (
+                nice not in range(20) or isinstance(nice, bool)):
+            raise ValueError('Execute: nice is not in 0 - 19')
+        io_priority = spec.get('io priority')
+        if io_priority is not None and (
+                io_priority not in external_process.IO_LEVELS
+                and io_priority != external_process.IO_IDLE
+                or isinstance(io_priority, bool)):
+            raise ValueError(
+                'Execute: io priority is not idle or in 0 - 7')
+        return external_process.Limits(
+            cpus=cpus,
+            memory=memory,
+            open_files=positive_int('open files'),
+            nice=nice,
+            io_priority=io_priority)
+
+    def prepare(self):
+        if self.limits is not None:
+            # fails early, if a command setting the limits is missing
+            self.limits.command_prefix()
+
+    def fingerprint(self):
+        # the limits do not change the result
+        return [self.__class__.__name__, json.dumps(self.command)]
+
     def __enter__(self):
-        command = ['/bin/sh', '-c', self.script]
+        command = ['/bin/sh', '-c', self.command]
         log.debug('Execute: %s', command)
-        result = external_process.run(command)
+        log_directory = self.context.log_directory
+        temporary = log_directory is None
+        if temporary:
+            log_directory = tempfile.mkdtemp(prefix='replay-logs-')
+        else:
+            files.makedirs(log_directory)
+        self.stdout_log = os.path.join(log_directory, self.STDOUT_LOG)
+        self.stderr_log = os.path.join(log_directory, self.STDERR_LOG)
+        result = None
+        try:
+            result = external_process.run(
+                command,
+                stdout_log=self.stdout_log,
+                stderr_log=self.stderr_log,
+                timeout=self.remaining_time(),
+                limits=self.limits)
+        finally:
+            # __exit__ is not called when the command fails
+            if temporary:
+                self._upload_logs(log_directory, result)
         log.debug('Execute: exit status %s', result.status)
+        if self.context.report is not None:
+            self.context.report.add_process(result)
+        if result.timed_out:
+            raise exceptions.Timeout(result)
         if result.status != 0:
             raise exceptions.ScriptError(result)
+
+    def _upload_logs(self, log_directory, result):
+        '''I upload the logs in the temporary `log_directory` to the \
+        datastore and remove it, pointing `result` to the uploaded logs.
+        '''
+        report = self.context.report
+        run_directory = (
+            posixpath.join(report.script_id, report.run_id)
+            if report is not None else uuid.uuid4().hex)
+        remote = (
+            datastores.as_remote(self.context.datastore)
+            / LOGS_DIRECTORY / run_directory)
+        uploaded = []
+        try:
+            for name in (self.STDOUT_LOG, self.STDERR_LOG):
+                (remote / name).upload(os.path.join(log_directory, name))
+                uploaded.append(str(remote / name))
+        except Exception as e:
+            log.warning('Execute: can not upload the logs: %s', e)
+            uploaded = [None, None]
+        finally:
+            shutil.rmtree(log_directory, ignore_errors=True)
+        self.stdout_log, self.stderr_log = uploaded
+        if result is not None:
+            result.stdout_log, result.stderr_log = uploaded
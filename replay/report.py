@@ -0,0 +1,170 @@
+'''I record where the time of a run goes, as a machine readable report.
+'''
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+# location of the run reports in the datastore
+REPORTS_DIRECTORY = '.replay/reports'
+
+PROVISION = 'provision'
+SETUP = 'setup'
+TEARDOWN = 'teardown'
+
+# RunReport.status values
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+UP_TO_DATE = 'up to date'
+RESTORED = 'restored from cache'
+
+
+class _TimedPlugin(object):
+
+    '''I am a plugin, that records the time spent in its setup (__enter__) \
+    and teardown (__exit__) in a RunReport.
+    '''
+
+    def __init__(self, report, plugin):
+        self.report = report
+        self.plugin = plugin
+
+    def __enter__(self):
+        start = time.time()
+        try:
+            return self.plugin.__enter__()
+        finally:
+            self.report.add_phase(self.plugin, SETUP, time.time() - start)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        start = time.time()
+        try:
+            return self.plugin.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self.report.add_phase(self.plugin, TEARDOWN, time.time() - start)
+
+
+class RunReport(object):
+
+    '''I am the report of a run: the time spent in each plugin phase, \
+    the resources used by the script and the bytes transferred.
+
+    Plugins are wrapped with timed() by Context.run, Execute adds its
+    process, Inputs and Outputs count their bytes and add the digests
+    of their files to the manifest.
+    '''
+
+    def __init__(self, script_name, script_path=None):
+        # scripts are told apart by their path, the name is for display
+        self.script_name = script_name
+        self.script_path = (
+            None if script_path is None else os.path.abspath(script_path))
+        self.started = time.time()
+        self.finished = None
+        self.status = None
+        self.run_fingerprint = None
+        self.phases = []
+        self.processes = []
+        self.bytes_staged = 0
+        self.bytes_uploaded = 0
+        # algorithm and digests of the input and output files
+        # by datastore path
+        self.manifest = dict(algorithm=None, inputs={}, outputs={})
+        # plugins might be set up concurrently
+        self.lock = threading.Lock()
+
+    @property
+    def script_id(self):
+        '''I am the directory name of the reports and logs of the script, \
+        different for scripts of the same name in different directories.
+        '''
+        if self.script_path is None:
+            return self.script_name
+        return '{}-{}'.format(
+            self.script_name,
+            hashlib.md5(self.script_path.encode('utf8')).hexdigest()[:8])
+
+    @property
+    def run_id(self):
+        '''I am unique to the run among the runs of the script'''
+        return '{}-{}'.format(
+            datetime.datetime.fromtimestamp(self.started).strftime(
+                '%Y%m%dT%H%M%S%f'),
+            os.getpid())
+
+    def timed(self, plugin):
+        return _TimedPlugin(self, plugin)
+
+    def add_phase(self, plugin, phase, seconds):
+        name = plugin.__class__.__name__
+        log.debug('RunReport: %s %s %.3fs', name, phase, seconds)
+        self.phases.append(dict(plugin=name, phase=phase, seconds=seconds))
+
+    def add_process(self, result):
+        process = dict(command=list(result.cmdspec), status=result.status)
+        if result.resource_usage is not None:
+            process.update(result.resource_usage.as_dict())
+        if result.limits is not None:
+            process['limits'] = result.limits.as_dict()
+        self.processes.append(process)
+
+    def add_bytes_staged(self, size):
+        with self.lock:
+            self.bytes_staged += size
+
+    def add_bytes_uploaded(self, size):
+        with self.lock:
+            self.bytes_uploaded += size
+
+    def add_input_digests(self, algorithm, digests):
+        self._add_digests('inputs', algorithm, digests)
+
+    def add_output_digests(self, algorithm, digests):
+        self._add_digests('outputs', algorithm, digests)
+
+    def _add_digests(self, kind, algorithm, digests):
+        with self.lock:
+            self.manifest['algorithm'] = algorithm
+            self.manifest[kind].update(digests)
+
+    def finish(self, status):
+        self.status = status
+        self.finished = time.time()
+
+    def as_dict(self):
+        finished = self.finished or time.time()
+        return {
+            'script': self.script_name,
+            'script path': self.script_path,
+            'status': self.status,
+            'run fingerprint': self.run_fingerprint,
+            'started': _isoformat(self.started),
+            'wall time': finished - self.started,
+            'phases': self.phases,
+            'processes': self.processes,
+            'bytes staged': self.bytes_staged,
+            'bytes uploaded': self.bytes_uploaded,
+            'manifest': self.manifest,
+        }
+
+    def write(self, datastore):
+        '''I save the report under REPORTS_DIRECTORY in `datastore` \
+        and return the External it was written to.
+        '''
+        name = self.run_id + '.json'
+        report = datastore / REPORTS_DIRECTORY / self.script_id / name
+        report.content = json.dumps(
+            self.as_dict(), indent=2, sort_keys=True).encode('utf8')
+        log.debug('RunReport: written to %s', report)
+        return report
+
+
+def _isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).isoformat()
@@ -0,0 +1,182 @@
+'''I put files in place by linking them when possible, copying otherwise.
+
+Strategies:
+
+- hardlink: the destination is a new name of the source (same filesystem)
+- reflink: the destination is a copy-on-write clone of the source
+  (filesystems supporting it, e.g. btrfs, xfs)
+- symlink: the destination is a symbolic link to the source
+- copy: the destination is a byte copy of the source
+'''
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+from multiprocessing.pool import ThreadPool
+
+from replay import files
+
+
+log = logging.getLogger(__name__)
+
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+SYMLINK = 'symlink'
+COPY = 'copy'
+
+STRATEGIES = (HARDLINK, REFLINK, SYMLINK, COPY)
+
+# linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+# errors meaning "this strategy is not possible here, try the next one"
+_UNSUPPORTED = frozenset(
+    getattr(errno, name)
+    for name in (
+        'EXDEV', 'EPERM', 'EMLINK', 'ENOTSUP', 'EOPNOTSUPP', 'EINVAL',
+        'ENOTTY', 'ENOSYS', 'EBADF')
+    if hasattr(errno, name))
+
+
+def _hardlink(source, destination):
+    os.link(source, destination)
+
+
+def _reflink(source, destination):
+    with open(source, 'rb') as src:
+        with open(destination, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            except (IOError, OSError):
+                os.remove(destination)
+                raise
+    shutil.copystat(source, destination)
+
+
+def _symlink(source, destination):
+    os.symlink(os.path.abspath(source), destination)
+
+
+def _copy(source, destination):
+    shutil.copy2(source, destination)
+
+
+_IMPLEMENTATIONS = {
+    HARDLINK: _hardlink,
+    REFLINK: _reflink,
+    SYMLINK: _symlink,
+    COPY: _copy,
+}
+
+
+def fallbacks(strategy):
+    '''I return the strategies to try in order for `strategy`.
+
+    Links fall back to cheaper alternatives and finally to copying.
+    '''
+    if strategy not in _IMPLEMENTATIONS:
+        raise ValueError('unknown staging strategy: {}'.format(strategy))
+    if strategy == HARDLINK:
+        return (HARDLINK, REFLINK, COPY)
+    if strategy == REFLINK:
+        return (REFLINK, COPY)
+    if strategy == SYMLINK:
+        return (SYMLINK, COPY)
+    return (COPY,)
+
+
+def stage(source, destination, strategy=COPY):
+    '''I make the local file `source` available as `destination`.
+
+    `strategy` is either one of STRATEGIES - tried with its fallbacks -
+    or a sequence of strategies to try in order.
+    I return the strategy actually used.
+    '''
+    if isinstance(strategy, (tuple, list)):
+        candidates = tuple(strategy)
+    else:
+        candidates = fallbacks(strategy)
+
+    files.makedirs(os.path.dirname(destination))
+    if os.path.lexists(destination):
+        os.remove(destination)
+
+    for candidate in candidates:
+        try:
+            _IMPLEMENTATIONS[candidate](source, destination)
+        except (IOError, OSError) as e:
+            if e.errno not in _UNSUPPORTED or candidate == candidates[-1]:
+                raise
+            log.debug(
+                'stage: %s not possible for %s -> %s (%s)',
+                candidate, source, destination, e)
+            continue
+        log.debug('stage: %s %s -> %s', candidate, source, destination)
+        return candidate
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def map_in_parallel(function, items, threads):
+    '''I call `function` on all `items` using `threads` threads'''
+    items = list(items)
+    if threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(threads, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def publish(pairs, staging_directory, threads=1, put=None):
+    '''I put local files in place as a batch.
+
+    `pairs` are (source, destination) paths.
+    All sources are first put into `staging_directory` - linked if
+    possible, copied in parallel otherwise, or written by
+    `put(source, staged path)` if given - and synced to disk.
+    Only then are they renamed to their destinations, so readers see
+    either the old or the complete new files.
+
+    `staging_directory` must not exist and must be on the same filesystem
+    as the destinations.
+    '''
+    pairs = list(pairs)
+    os.makedirs(staging_directory)
+    try:
+        staged = [
+            (source, os.path.join(staging_directory, str(i)), destination)
+            for i, (source, destination) in enumerate(pairs)]
+
+        def put_to_staging(item):
+            source, staged_path, _ = item
+            if put is None:
+                strategy = stage(source, staged_path, (HARDLINK, COPY))
+                log.debug('publish: %s %s', strategy, source)
+            else:
+                put(source, staged_path)
+            _fsync(staged_path)
+
+        map_in_parallel(put_to_staging, staged, threads)
+        _fsync(staging_directory)
+
+        directories = set()
+        for _, staged_path, destination in staged:
+            directory = os.path.dirname(destination)
+            files.makedirs(directory)
+            os.rename(staged_path, destination)
+            directories.add(directory)
+        for directory in directories:
+            _fsync(directory)
+    finally:
+        shutil.rmtree(staging_directory, ignore_errors=True)
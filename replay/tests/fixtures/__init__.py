@@ -1,8 +1,10 @@
 from replay.tests.fixtures.plugin_context import PluginContext
+from replay.tests.fixtures.postgres import LocalPostgres
+from replay.tests.fixtures.object_store import ObjectStore
 
 import os.path
 
 
 FIXTURES_DIR = os.path.join(os.path.dirname(__file__))
 
-__all__ = ['PluginContext', 'FIXTURES_DIR']
+__all__ = ['PluginContext', 'LocalPostgres', 'ObjectStore', 'FIXTURES_DIR']
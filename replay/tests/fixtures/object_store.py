@@ -0,0 +1,196 @@
+import json
+import re
+import threading
+import uuid
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlsplit, parse_qs
+except ImportError:  # python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlsplit, parse_qs
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.store.lock:
+            self.server.store.connections += 1
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        store = self.server.store
+        path = unquote(parts.path)
+        assert path.startswith(store.bucket + '/'), path
+        key = path[len(store.bucket) + 1:]
+        query = dict(
+            (name, values[0]) for name, values in parse_qs(
+                parts.query, keep_blank_values=True).items())
+        with store.lock:
+            store.requests.append((self.command, key, query))
+        return store, key, query
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('content-length', 0)))
+
+    def _respond(self, status, content=b'', headers=None, head=False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(content)
+
+    def do_HEAD(self):
+        store, key, _ = self._parse()
+        if key not in store.objects:
+            self._respond(404, head=True)
+            return
+        content = store.objects[key]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', store.etag(key))
+        self.end_headers()
+
+    def do_GET(self):
+        store, key, query = self._parse()
+        if 'prefix' in query:
+            self._respond(200, json.dumps(store.page(
+                query['prefix'], query.get('delimiter'),
+                query.get('marker'))).encode('utf8'))
+            return
+        if key not in store.objects:
+            self._respond(404)
+            return
+        content = store.objects[key]
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('range', ''))
+        if match and store.ranges:
+            start = int(match.group(1))
+            if start >= len(content):
+                self._respond(416)
+                return
+            end = int(match.group(2) or len(content) - 1)
+            self._respond(206, content[start:end + 1])
+        else:
+            self._respond(200, content)
+
+    def do_PUT(self):
+        store, key, query = self._parse()
+        body = self._body()
+        with store.lock:
+            if 'upload_id' in query:
+                store.uploads[query['upload_id']][int(query['part'])] = body
+            else:
+                store.objects[key] = body
+                store.versions[key] = uuid.uuid4().hex
+        self._respond(200)
+
+    def do_POST(self):
+        store, key, query = self._parse()
+        self._body()
+        with store.lock:
+            if 'uploads' in query:
+                upload_id = uuid.uuid4().hex
+                store.uploads[upload_id] = {}
+                self._respond(
+                    200, json.dumps(dict(upload_id=upload_id)).encode('utf8'))
+                return
+            if query.get('upload_id') not in store.uploads:
+                self._respond(404)
+                return
+            parts = store.uploads.pop(query['upload_id'])
+            store.objects[key] = b''.join(
+                parts[n] for n in range(1, int(query['parts']) + 1))
+            store.versions[key] = uuid.uuid4().hex
+        self._respond(200)
+
+
+class ObjectStore(object):
+
+    '''I am an object store server speaking the protocol of \
+    replay.datastores.HTTPBackend, keeping objects in memory.
+
+    Within the with block, url is the base URL of a bucket.
+    '''
+
+    def __init__(self, bucket='/bucket', ranges=True, page_size=1000):
+        self.bucket = bucket
+        # honor Range headers
+        self.ranges = ranges
+        # keys and prefixes in a page of a listing
+        self.page_size = page_size
+        self.objects = {}
+        self.versions = {}
+        self.uploads = {}
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    def etag(self, key):
+        return '"{}"'.format(self.versions.get(key, ''))
+
+    def page(self, prefix, delimiter=None, marker=None):
+        '''I return the page of the listing of `prefix` after `marker`'''
+        keys = []
+        prefixes = []
+        last = None
+        with self.lock:
+            objects = sorted(self.objects.items())
+        for key, content in objects:
+            if not key.startswith(prefix):
+                continue
+            if marker is not None and (
+                    key <= marker
+                    or delimiter and marker.endswith(delimiter)
+                    and key.startswith(marker)):
+                continue
+            if len(keys) + len(prefixes) == self.page_size:
+                return dict(keys=keys, prefixes=prefixes, next_marker=last)
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                # the keys of a prefix are next to each other
+                rolled_up = prefix + rest[:rest.index(delimiter) + 1]
+                if rolled_up != last:
+                    prefixes.append(rolled_up)
+                    last = rolled_up
+            else:
+                keys.append(
+                    dict(key=key, size=len(content), etag=self.etag(key)))
+                last = key
+        return dict(keys=keys, prefixes=prefixes, next_marker=None)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return 'http://{}:{}{}'.format(host, port, self.bucket)
+
+    def __enter__(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.store = self
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, kwargs=dict(poll_interval=0.01))
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from replay import external_process
+
+
+def _bindir():
+    initdb = external_process.find_executable('initdb')
+    if initdb:
+        return os.path.dirname(initdb)
+    if external_process.find_executable('pg_config'):
+        return subprocess.check_output(
+            ['pg_config', '--bindir']).decode('utf8').strip()
+    return None
+
+
+class LocalPostgres(object):
+
+    '''I am a PostgreSQL server in a temporary directory.
+
+    Within the with block, the client tools connect to it through
+    $PGHOST and $PGPORT. Nothing remains of it after the block.
+    '''
+
+    PORT = 54329
+
+    def __init__(self, port=PORT):
+        self.port = port
+        self.bindir = _bindir()
+        self.directory = None
+        self.orig_environ = None
+
+    @classmethod
+    def is_available(cls):
+        # initdb refuses to run as root
+        return (
+            external_process.find_executable('psql') is not None
+            and _bindir() is not None
+            and os.geteuid() != 0)
+
+    def _run(self, program, *args):
+        result = external_process.run(
+            [os.path.join(self.bindir, program)] + list(args))
+        if result.status != 0:
+            raise Exception(str(result))
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp()
+        data = os.path.join(self.directory, 'data')
+        self._run('initdb', '--pgdata=' + data, '--auth=trust')
+        self._run(
+            'pg_ctl', 'start', '--wait',
+            '--pgdata=' + data,
+            '--log=' + os.path.join(self.directory, 'postgres.log'),
+            '--options=-k {} -p {} -c listen_addresses='.format(
+                self.directory, self.port))
+        self.orig_environ = dict(
+            (key, os.environ.get(key)) for key in ('PGHOST', 'PGPORT'))
+        os.environ['PGHOST'] = self.directory
+        os.environ['PGPORT'] = str(self.port)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for key, value in self.orig_environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        try:
+            self._run(
+                'pg_ctl', 'stop', '--mode=immediate',
+                '--pgdata=' + os.path.join(self.directory, 'data'))
+        finally:
+            shutil.rmtree(self.directory)
@@ -0,0 +1,122 @@
+import unittest
+import threading
+import pkg_resources
+
+from replay.tests import fixtures
+from replay import build as m
+
+
+def graph(*specs):
+    return m.DependencyGraph(
+        m.ScriptSpec(path, inputs, outputs)
+        for path, inputs, outputs in specs)
+
+
+class Test_load_script_spec(unittest.TestCase):
+
+    def test_inputs_and_outputs(self):
+        to_roman_script = pkg_resources.resource_filename(
+            'replay',
+            'tests/fixtures/scripts/to_roman.script')
+
+        spec = m.load_script_spec(
+            fixtures.PluginContext().context, to_roman_script)
+
+        self.assertEqual(to_roman_script, spec.path)
+        self.assertEqual(['arab'], spec.inputs)
+        self.assertEqual(['roman'], spec.outputs)
+
+
+class TestDependencyGraph(unittest.TestCase):
+
+    def test_dependencies(self):
+        g = graph(
+            ('a', [], ['x']),
+            ('b', ['x'], ['y']),
+            ('c', ['x', 'y', 'external'], []))
+
+        self.assertEqual(set(), g.dependencies['a'])
+        self.assertEqual(set(['a']), g.dependencies['b'])
+        self.assertEqual(set(['a', 'b']), g.dependencies['c'])
+        self.assertEqual(set(['b', 'c']), g.dependents['a'])
+        self.assertEqual(set(['b', 'c']), g.transitive_dependents('a'))
+
+    def test_pattern_dependencies(self):
+        g = graph(
+            ('daily', [], ['days/']),
+            ('single', [], ['days/2020.csv']),
+            ('sum', ['days/*.csv'], []),
+            ('first', ['days/2019.csv'], []),
+            ('other', ['other/*.csv'], []))
+
+        self.assertEqual(set(['daily', 'single']), g.dependencies['sum'])
+        self.assertEqual(set(['daily']), g.dependencies['first'])
+        self.assertEqual(set(), g.dependencies['other'])
+
+    def test_output_of_two_scripts_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            graph(('a', [], ['x']), ('b', [], ['x']))
+
+    def test_circular_dependency_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            graph(('a', ['y'], ['x']), ('b', ['x'], ['y']))
+
+    def test_topological_order(self):
+        g = graph(
+            ('c', ['y'], []),
+            ('b', ['x'], ['y']),
+            ('d', [], []),
+            ('a', [], ['x']))
+
+        self.assertEqual(['a', 'b', 'c', 'd'], g.topological_order())
+
+
+class Test_build(unittest.TestCase):
+
+    def test_scripts_are_run_in_dependency_order(self):
+        g = graph(
+            ('c', ['y'], []),
+            ('b', ['x'], ['y']),
+            ('a', [], ['x']))
+        call_trace = []
+
+        status = m.build(g, lambda path: call_trace.append(path) or True)
+
+        self.assertEqual(['a', 'b', 'c'], call_trace)
+        self.assertEqual(
+            dict(a=m.SUCCEEDED, b=m.SUCCEEDED, c=m.SUCCEEDED),
+            status)
+
+    def test_dependents_of_failed_script_are_skipped(self):
+        g = graph(
+            ('a', [], ['x']),
+            ('b', ['x'], ['y']),
+            ('c', ['y'], []),
+            ('d', [], []))
+
+        status = m.build(g, lambda path: path != 'a')
+
+        self.assertEqual(
+            dict(a=m.FAILED, b=m.SKIPPED, c=m.SKIPPED, d=m.SUCCEEDED),
+            status)
+
+    def test_exception_is_failure(self):
+        def run_script(path):
+            raise Exception(path)
+
+        status = m.build(graph(('a', [], [])), run_script)
+
+        self.assertEqual(dict(a=m.FAILED), status)
+
+    def test_independent_scripts_run_in_parallel(self):
+        started = dict(a=threading.Event(), b=threading.Event())
+
+        def run_script(path):
+            started[path].set()
+            other = 'b' if path == 'a' else 'a'
+            return started[other].wait(5)
+
+        status = m.build(
+            graph(('a', [], []), ('b', [], [])), run_script, jobs=2)
+
+        self.assertEqual(dict(a=m.SUCCEEDED, b=m.SUCCEEDED), status)
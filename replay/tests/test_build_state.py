@@ -0,0 +1,84 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import Memory
+from externals import working_directory
+import os
+
+from replay import build_state as m
+
+
+class TestBuildState(unittest.TestCase):
+
+    def test_unknown_key(self):
+        state = m.BuildState(Memory())
+
+        self.assertIsNone(state.lookup('key'))
+        self.assertFalse(state.is_up_to_date('key'))
+
+    def test_recorded_outputs_exist_is_up_to_date(self):
+        datastore = Memory()
+        state = m.BuildState(datastore)
+        (datastore / 'output').content = b''
+
+        state.record('key', ['output'])
+
+        self.assertEqual(['output'], list(state.lookup('key')))
+        self.assertTrue(state.is_up_to_date('key'))
+
+    def test_changed_output_is_not_up_to_date(self):
+        datastore = Memory()
+        state = m.BuildState(datastore)
+        (datastore / 'output').content = b'1'
+        state.record('key', ['output'])
+
+        (datastore / 'output').content = b'2'
+
+        self.assertFalse(state.is_up_to_date('key'))
+
+    @within_temp_dir
+    def test_replaced_local_output_is_not_up_to_date(self):
+        datastore = working_directory() / 'datastore'
+        state = m.BuildState(datastore)
+        (datastore / 'output').content = b'1'
+        state.record('key', ['output'])
+        self.assertTrue(state.is_up_to_date('key'))
+
+        # same size and, with coarse timestamps, same mtime
+        (datastore / 'new').content = b'2'
+        os.rename((datastore / 'new').path, (datastore / 'output').path)
+
+        self.assertFalse(state.is_up_to_date('key'))
+
+    def test_pattern_outputs_are_recorded_by_file(self):
+        datastore = Memory()
+        state = m.BuildState(datastore)
+        (datastore / 'results/a').content = b'a'
+        (datastore / 'results/b').content = b'b'
+
+        state.record('key', ['results/'])
+
+        self.assertEqual(
+            ['results/a', 'results/b'], sorted(state.lookup('key')))
+        self.assertTrue(state.is_up_to_date('key'))
+
+    def test_record_without_versions_is_not_up_to_date(self):
+        datastore = Memory()
+        state = m.BuildState(datastore)
+        (datastore / 'output').content = b''
+        (state.directory / 'key').content = b'{"outputs": ["output"]}'
+
+        self.assertFalse(state.is_up_to_date('key'))
+
+    def test_recorded_output_missing_is_not_up_to_date(self):
+        state = m.BuildState(Memory())
+
+        state.record('key', ['output'])
+
+        self.assertFalse(state.is_up_to_date('key'))
+
+    def test_key_depends_on_spec(self):
+        state = m.BuildState(Memory())
+
+        self.assertNotEqual(
+            state.key('spec1', 'fingerprint'),
+            state.key('spec2', 'fingerprint'))
@@ -0,0 +1,187 @@
+import unittest
+from temp_dir import within_temp_dir
+import mock
+import os
+from externals import Memory, working_directory
+
+from replay import cache as m
+from replay import compression
+from replay import datastores
+from replay import staging
+
+
+def write(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+class TestOutputCache(unittest.TestCase):
+
+    def cache(self, max_size=None):
+        return m.OutputCache((working_directory() / 'cache').path, max_size)
+
+    @within_temp_dir
+    def test_stored_outputs_are_restored(self):
+        cache = self.cache()
+        write('output', b'content')
+        cache.store('key', [('local name', 'output')])
+        datastore = Memory()
+
+        restored = cache.restore(
+            'key', datastore, [('local name', 'some/where')])
+
+        self.assertTrue(restored)
+        self.assertEqual(b'content', (datastore / 'some/where').content)
+
+    @within_temp_dir
+    def test_restored_local_file_is_independent_of_the_cache(self):
+        cache = self.cache()
+        write('output', b'content')
+        cache.store('key', [('local name', 'output')])
+        datastore = working_directory() / 'datastore'
+
+        cache.restore('key', datastore, [('local name', 'output')])
+        write((datastore / 'output').path, b'modified')
+        cache.restore('key', datastore, [('local name', 'other')])
+
+        self.assertEqual(b'content', (datastore / 'other').content)
+        stat = os.stat((datastore / 'other').path)
+        self.assertEqual(1, stat.st_nlink)
+        self.assertTrue(stat.st_mode & 0o200)
+
+    @within_temp_dir
+    def test_stored_file_is_not_changed(self):
+        cache = self.cache()
+        write('output', b'content')
+
+        cache.store('key', [('local name', 'output')])
+
+        stat = os.stat('output')
+        self.assertEqual(1, stat.st_nlink)
+        self.assertTrue(stat.st_mode & 0o200)
+
+    @within_temp_dir
+    def test_disposable_file_becomes_the_object(self):
+        cache = self.cache()
+        write('output', b'content')
+
+        cache.store('key', [('local name', 'output')], disposable=True)
+
+        stat = os.stat('output')
+        self.assertEqual(2, stat.st_nlink)
+        self.assertFalse(stat.st_mode & 0o222)
+
+    @within_temp_dir
+    def test_disposable_file_linked_elsewhere_is_not_linked(self):
+        cache = self.cache()
+        write('output', b'content')
+        os.link('output', 'published')
+
+        cache.store('key', [('local name', 'output')], disposable=True)
+
+        stat = os.stat('published')
+        self.assertEqual(2, stat.st_nlink)
+        self.assertTrue(stat.st_mode & 0o200)
+
+    @within_temp_dir
+    def test_given_digests_are_used(self):
+        cache = self.cache()
+        write('output', b'content')
+
+        with mock.patch('replay.fingerprint.hash_file') as hash_file:
+            cache.store(
+                'key', [('local name', 'output')], {'local name': 'digest'})
+
+        self.assertFalse(hash_file.called)
+        self.assertEqual({'local name': 'digest'}, cache.lookup('key'))
+
+    @within_temp_dir
+    def test_interrupted_restore_leaves_no_partial_outputs(self):
+        cache = self.cache()
+        write('output1', b'1')
+        write('output2', b'2')
+        cache.store('key', [('output1', 'output1'), ('output2', 'output2')])
+        datastore = working_directory() / 'datastore'
+        stage = staging.stage
+
+        def crash_on_second(source, destination, strategy):
+            if source.endswith(cache.lookup('key')['output2']):
+                raise IOError('crash')
+            return stage(source, destination, strategy)
+
+        with mock.patch('replay.staging.stage', crash_on_second):
+            with self.assertRaises(IOError):
+                cache.restore(
+                    'key', datastore,
+                    [('output1', 'output1'), ('output2', 'output2')])
+
+        self.assertFalse(os.path.exists((datastore / 'output1').path))
+        self.assertEqual(
+            [],
+            os.listdir((datastore / datastores.STAGING_DIRECTORY).path))
+
+    @within_temp_dir
+    def test_restored_outputs_are_compressed(self):
+        cache = self.cache()
+        write('output', b'content')
+        cache.store('key', [('output', 'output')])
+
+        for datastore in (working_directory() / 'datastore', Memory()):
+            cache.restore(
+                'key', datastore, [('output', 'output')], compression.GZIP)
+
+            self.assertEqual(
+                compression.GZIP, compression.codec_of(datastore / 'output'))
+
+    @within_temp_dir
+    def test_unknown_key_is_not_restored(self):
+        self.assertFalse(
+            self.cache().restore('key', Memory(), [('local name', 'x')]))
+
+    @within_temp_dir
+    def test_unknown_output_is_not_restored(self):
+        cache = self.cache()
+        write('output', b'content')
+        cache.store('key', [('local name', 'output')])
+
+        restored = cache.restore(
+            'key', Memory(), [('local name', 'x'), ('other', 'y')])
+
+        self.assertFalse(restored)
+
+    @within_temp_dir
+    def test_gc_evicts_least_recently_used_runs(self):
+        cache = self.cache()
+        write('output1', b'1' * 10)
+        write('output2', b'2' * 10)
+        cache.store('old', [('output', 'output1')])
+        cache.store('new', [('output', 'output2')])
+        old_time = os.path.getmtime(cache._run_path('old')) - 10
+        os.utime(cache._run_path('old'), (old_time, old_time))
+
+        size = cache.gc(15)
+
+        self.assertEqual(10, size)
+        self.assertIsNone(cache.lookup('old'))
+        self.assertIsNotNone(cache.lookup('new'))
+
+    @within_temp_dir
+    def test_store_keeps_cache_below_max_size(self):
+        cache = self.cache(max_size=0)
+        write('output', b'content')
+
+        cache.store('key', [('output', 'output')])
+
+        self.assertIsNone(cache.lookup('key'))
+
+    @within_temp_dir
+    def test_outputs_over_max_size_are_not_copied(self):
+        cache = self.cache(max_size=5)
+        write('output', b'content')
+
+        with mock.patch('replay.staging.stage') as stage:
+            stored = cache.store('key', [('output', 'output')])
+
+        self.assertFalse(stored)
+        self.assertFalse(stage.called)
+        self.assertIsNone(cache.lookup('key'))
@@ -0,0 +1,114 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import Memory
+from externals import working_directory
+import gzip
+import io
+import zlib
+
+from replay.tests import fixtures
+from replay import datastores
+import replay.compression as m
+
+
+CONTENT = b'date,value\n2020-01-01,1\n' * 1000
+
+
+def compressed(content, codec):
+    destination = io.BytesIO()
+    m.compress(io.BytesIO(content), destination, codec)
+    return destination.getvalue()
+
+
+def decompressed(content, codec):
+    destination = io.BytesIO()
+    m.decompress(io.BytesIO(content), destination, codec)
+    return destination.getvalue()
+
+
+class TestGzip(unittest.TestCase):
+
+    def test_round_trip(self):
+        content = compressed(CONTENT, m.GZIP)
+
+        self.assertLess(len(content), len(CONTENT) // 10)
+        self.assertEqual(CONTENT, decompressed(content, m.GZIP))
+
+    def test_standard_gzip_file(self):
+        content = compressed(CONTENT, m.GZIP)
+
+        self.assertEqual(
+            CONTENT, gzip.GzipFile(fileobj=io.BytesIO(content)).read())
+
+    def test_compression_is_deterministic(self):
+        self.assertEqual(
+            compressed(CONTENT, m.GZIP), compressed(CONTENT, m.GZIP))
+
+
+@unittest.skipUnless(m.zstandard, 'needs the zstandard package')
+class TestZstd(unittest.TestCase):
+
+    def test_round_trip(self):
+        content = compressed(CONTENT, m.ZSTD)
+
+        self.assertEqual(m.ZSTD, m.detect(content[:m.HEADER_SIZE]))
+        self.assertEqual(CONTENT, decompressed(content, m.ZSTD))
+
+
+class Test_detect(unittest.TestCase):
+
+    def test_gzip(self):
+        content = compressed(CONTENT, m.GZIP)
+        self.assertEqual(m.GZIP, m.detect(content[:m.HEADER_SIZE]))
+
+    def test_files_not_compressed_by_replay(self):
+        foreign_gzip = io.BytesIO()
+        with gzip.GzipFile(fileobj=foreign_gzip, mode='wb') as f:
+            f.write(CONTENT)
+
+        self.assertIsNone(m.detect(foreign_gzip.getvalue()[:m.HEADER_SIZE]))
+        self.assertIsNone(m.detect(zlib.compress(CONTENT)[:m.HEADER_SIZE]))
+        self.assertIsNone(m.detect(CONTENT[:m.HEADER_SIZE]))
+        self.assertIsNone(m.detect(b''))
+
+
+class Test_codec_of(unittest.TestCase):
+
+    @within_temp_dir
+    def test_file(self):
+        (working_directory() / 'compressed').content = compressed(
+            CONTENT, m.GZIP)
+        (working_directory() / 'raw').content = CONTENT
+
+        self.assertEqual(
+            m.GZIP, m.codec_of(working_directory() / 'compressed'))
+        self.assertIsNone(m.codec_of(working_directory() / 'raw'))
+
+    def test_memory(self):
+        datastore = Memory()
+        (datastore / 'a').content = compressed(CONTENT, m.GZIP)
+
+        self.assertEqual(m.GZIP, m.codec_of(datastore / 'a'))
+
+    def test_remote(self):
+        with fixtures.ObjectStore() as store:
+            datastore = datastores.open_datastore(store.url)
+            (datastore / 'a').content = compressed(CONTENT, m.GZIP)
+
+            self.assertEqual(m.GZIP, m.codec_of(datastore / 'a'))
+
+
+class Test_upload_download(unittest.TestCase):
+
+    @within_temp_dir
+    def test_round_trip(self):
+        wd = working_directory()
+        (wd / 'local').content = CONTENT
+        datastore = Memory()
+
+        m.upload((wd / 'local').path, datastore / 'a', m.GZIP)
+        m.download(datastore / 'a', (wd / 'dir/copy').path, m.GZIP)
+
+        self.assertEqual(
+            m.GZIP, m.detect((datastore / 'a').content[:m.HEADER_SIZE]))
+        self.assertEqual(CONTENT, (wd / 'dir/copy').content)
@@ -1,6 +1,15 @@
 import unittest
+from temp_dir import within_temp_dir
+import mock
+import os
+import threading
+import time
 from replay.tests import fixtures
+import replay.context as m
+from replay import exceptions
+from replay import plan_cache
 from replay import plugins
+from replay import report
 from StringIO import StringIO
 
 
@@ -21,6 +30,229 @@ class Test_run(unittest.TestCase):
 
         return TPlugin
 
+    @staticmethod
+    def get_plugin(
+            n, call_trace, enter=None, exit=None, provision=None,
+            **attributes):
+        class TPlugin(plugins.Plugin):
+
+            def prepare(self):
+                call_trace.append((n, 'prepare'))
+
+            def provision(self):
+                call_trace.append((n, 'provision'))
+                if provision:
+                    provision()
+
+            def __enter__(self):
+                self.provision_once()
+                call_trace.append((n, '__enter__'))
+                if enter:
+                    enter()
+
+            def __exit__(self, *exc_info):
+                call_trace.append((n, '__exit__', exc_info[0]))
+                if exit:
+                    return exit()
+
+        for name, value in attributes.items():
+            setattr(TPlugin, name, value)
+        return TPlugin(context=None, script=None)
+
+    def test_failed_setup_exits_entered_plugins(self):
+        call_trace = []
+
+        def fail():
+            raise ValueError
+
+        f = fixtures.PluginContext()
+        with self.assertRaises(ValueError):
+            f.context.run([
+                self.get_plugin(1, call_trace),
+                self.get_plugin(2, call_trace, enter=fail),
+                self.get_plugin(3, call_trace)])
+
+        self.assertEqual(
+            [
+                (1, 'prepare'),
+                (2, 'prepare'),
+                (3, 'prepare'),
+                (1, 'provision'),
+                (1, '__enter__'),
+                (2, 'provision'),
+                (2, '__enter__'),
+                (1, '__exit__', ValueError),
+            ],
+            call_trace)
+
+    def test_error_in_exit_is_passed_to_outer_plugins(self):
+        call_trace = []
+
+        def fail():
+            raise KeyError
+
+        f = fixtures.PluginContext()
+        with self.assertRaises(KeyError):
+            f.context.run([
+                self.get_plugin(1, call_trace),
+                self.get_plugin(2, call_trace, exit=fail)])
+
+        self.assertEqual(
+            [(2, '__exit__', None), (1, '__exit__', KeyError)],
+            call_trace[-2:])
+
+    def test_error_suppressed_by_exit(self):
+        call_trace = []
+
+        def fail():
+            raise ValueError
+
+        f = fixtures.PluginContext()
+        f.context.run([
+            self.get_plugin(1, call_trace),
+            self.get_plugin(2, call_trace, exit=lambda: True),
+            self.get_plugin(3, call_trace, enter=fail)])
+
+        self.assertEqual(
+            [(2, '__exit__', ValueError), (1, '__exit__', None)],
+            call_trace[-2:])
+
+    def test_many_plugins(self):
+        call_trace = []
+
+        f = fixtures.PluginContext()
+        f.context.run(
+            [self.get_plugin(n, call_trace) for n in range(5000)])
+
+        self.assertEqual(4 * 5000, len(call_trace))
+
+    def test_many_concurrently_provisioned_plugins(self):
+        call_trace = []
+
+        f = fixtures.PluginContext()
+        f.context.run(
+            [
+                self.get_plugin(n, call_trace, requires=frozenset())
+                for n in range(500)])
+
+        self.assertEqual(4 * 500, len(call_trace))
+
+    def test_provisions_run_concurrently(self):
+        call_trace = []
+        started = threading.Event()
+
+        def wait_for_other():
+            started.wait(5)
+            if not started.is_set():
+                raise AssertionError('not run concurrently')
+
+        f = fixtures.PluginContext()
+        f.context.run([
+            self.get_plugin(
+                1, call_trace, provision=wait_for_other,
+                requires=frozenset()),
+            self.get_plugin(
+                2, call_trace, provision=started.set,
+                requires=frozenset())])
+
+        self.assertEqual(
+            [(2, '__exit__', None), (1, '__exit__', None)],
+            call_trace[-2:])
+
+    def test_provision_waits_for_required_resource(self):
+        call_trace = []
+
+        f = fixtures.PluginContext()
+        f.context.run([
+            self.get_plugin(1, call_trace, provides=frozenset(['cwd'])),
+            self.get_plugin(2, call_trace, requires=frozenset(['cwd'])),
+            self.get_plugin(3, call_trace, requires=frozenset())])
+
+        self.assertLess(
+            call_trace.index((1, '__enter__')),
+            call_trace.index((2, 'provision')))
+        self.assertIn((3, 'provision'), call_trace)
+
+    def test_plugins_without_requirements_wait_for_all_before(self):
+        call_trace = []
+
+        f = fixtures.PluginContext()
+        f.context.run([
+            self.get_plugin(1, call_trace, requires=frozenset()),
+            self.get_plugin(2, call_trace)])
+
+        self.assertEqual(
+            [(1, 'provision'), (1, '__enter__'),
+             (2, 'provision'), (2, '__enter__')],
+            call_trace[2:6])
+
+    def test_provisioned_plugins_are_exited_after_failure(self):
+        call_trace = []
+        provisioned = threading.Event()
+
+        def fail():
+            provisioned.wait(5)
+            raise ValueError
+
+        f = fixtures.PluginContext()
+        with self.assertRaises(ValueError):
+            f.context.run([
+                self.get_plugin(
+                    1, call_trace, provision=fail, requires=frozenset()),
+                self.get_plugin(
+                    2, call_trace, provision=provisioned.set,
+                    requires=frozenset())])
+
+        self.assertEqual([(2, '__exit__', ValueError)], call_trace[-1:])
+        self.assertNotIn((1, '__exit__', ValueError), call_trace)
+
+    def test_serial_setup(self):
+        call_trace = []
+
+        f = fixtures.PluginContext()
+        f.context.concurrent_setup = False
+        f.context.run([
+            self.get_plugin(1, call_trace),
+            self.get_plugin(2, call_trace, requires=frozenset())])
+
+        self.assertEqual(
+            [(1, 'provision'), (1, '__enter__'),
+             (2, 'provision'), (2, '__enter__')],
+            call_trace[2:6])
+
+    def test_setup_timeout(self):
+        call_trace = []
+
+        f = fixtures.PluginContext()
+        with self.assertRaises(exceptions.Timeout):
+            f.context.run([
+                self.get_plugin(
+                    1, call_trace, enter=lambda: time.sleep(0.1),
+                    timeout=0.01),
+                self.get_plugin(2, call_trace)])
+
+        self.assertEqual(
+            [(1, '__exit__', exceptions.Timeout)], call_trace[-1:])
+
+    def test_setup_commands_are_killed_at_timeout(self):
+        test = self
+
+        class Sleep(plugins.Plugin):
+            timeout = 0.2
+
+            def __enter__(self):
+                self.run_command(['sleep', '10'])
+
+            def __exit__(self, *exc_info):
+                test.assertIsNone(self.remaining_time())
+
+        f = fixtures.PluginContext()
+        start = time.time()
+        with self.assertRaises(exceptions.Timeout):
+            f.context.run([Sleep(context=None, script=None)])
+
+        self.assertLess(time.time() - start, 5)
+
     def test_all_plugins_are_run_in_order(self):
         call_trace = []
         plugin_classes = (
@@ -43,6 +275,30 @@ class Test_run(unittest.TestCase):
             ],
             call_trace)
 
+    def test_plugin_phases_are_reported(self):
+        call_trace = []
+        plugin_classes = (
+            self.get_plugin_class(1, call_trace),
+            self.get_plugin_class(2, call_trace))
+
+        f = fixtures.PluginContext()
+        f.context.report = report.RunReport('script')
+        f.context.run([plugin_class() for plugin_class in plugin_classes])
+
+        self.assertEqual(
+            [report.SETUP, report.SETUP, report.TEARDOWN, report.TEARDOWN],
+            [phase['phase'] for phase in f.context.report.phases])
+        self.assertEqual(4, len(call_trace))
+
+    def test_provision_is_reported(self):
+        f = fixtures.PluginContext()
+        f.context.report = report.RunReport('script')
+        f.context.run([self.get_plugin(1, [], requires=frozenset())])
+
+        self.assertEqual(
+            [report.PROVISION, report.SETUP, report.TEARDOWN],
+            [phase['phase'] for phase in f.context.report.phases])
+
 
 XPlugin = plugins.Plugin
 
@@ -83,6 +339,15 @@ class Test_resolve_plugin_class(unittest.TestCase):
         plugin_class = context().resolve_plugin_class('Execute')
         self.assertIs(plugins.Execute, plugin_class)
 
+    def test_resolution_is_memoized(self):
+        plugin_name = 'replay.tests.test_context.XPlugin'
+        context().resolve_plugin_class(plugin_name)
+
+        with mock.patch.object(
+                m.dottedname, 'resolve', side_effect=ImportError):
+            plugin_class = context().resolve_plugin_class(plugin_name)
+        self.assertIs(XPlugin, plugin_class)
+
 
 class Test_load_plugin(unittest.TestCase):
 
@@ -94,6 +359,14 @@ class Test_load_plugin(unittest.TestCase):
         with self.assertRaises(ValueError):
             context().load_plugin(dict(a='1', b='2'))
 
+    def test_timeout(self):
+        plugin = context().load_plugin(dict(Execute='true', timeout=60))
+        self.assertEqual(60, plugin.timeout)
+
+    def test_invalid_timeout_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            context().load_plugin(dict(Execute='true', timeout='a minute'))
+
 
 class Test_load_plugins(unittest.TestCase):
 
@@ -114,3 +387,53 @@ class Test_load_plugins(unittest.TestCase):
             ''')
         with self.assertRaises(ValueError):
             list(context().load_plugins(f))
+
+
+class Test_load_script(unittest.TestCase):
+
+    SCRIPT = '''\
+Execute: /bin/true
+---
+Execute: /bin/false
+'''
+
+    def load_script(self, plan_cache):
+        c = context()
+        c.plan_cache = plan_cache
+        return c.load_script('a.script')
+
+    @within_temp_dir
+    def test_without_plan_cache(self):
+        with open('a.script', 'w') as f:
+            f.write(self.SCRIPT)
+
+        loaded = self.load_script(None)
+
+        self.assertEqual(
+            ['/bin/true', '/bin/false'],
+            [plugin.script for plugin in loaded])
+
+    @within_temp_dir
+    def test_with_plan_cache(self):
+        with open('a.script', 'w') as f:
+            f.write(self.SCRIPT)
+        cache = plan_cache.PlanCache('plans')
+
+        first = self.load_script(cache)
+        with mock.patch.object(m.yaml, 'load_all') as load_all:
+            second = self.load_script(cache)
+
+        self.assertFalse(load_all.called)
+        self.assertEqual(
+            [plugin.script for plugin in first],
+            [plugin.script for plugin in second])
+        self.assertIsInstance(second[0], plugins.Execute)
+
+    @within_temp_dir
+    def test_invalid_script_raises_ValueError(self):
+        with open('a.script', 'w') as f:
+            f.write('Execute /bin/true')
+
+        with self.assertRaises(ValueError):
+            self.load_script(plan_cache.PlanCache('plans'))
+        self.assertFalse(os.path.exists('plans'))
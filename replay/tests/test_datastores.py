@@ -0,0 +1,307 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import working_directory
+import externals
+import mock
+import os
+import socket
+
+from replay.tests import fixtures
+from replay import exceptions
+from replay import staging
+import replay.datastores as m
+
+
+class TestFileBackend(unittest.TestCase):
+
+    @within_temp_dir
+    def test_files(self):
+        backend = m.FileBackend(os.getcwd())
+        with backend.open_write('a/b') as f:
+            f.write(b'content')
+
+        self.assertEqual(7, backend.stat('a/b').size)
+        self.assertIsNone(backend.stat('a/c'))
+        self.assertEqual(b'ten', backend.read('a/b', 3, 3))
+        self.assertEqual(['a/b'], list(backend.list('a')))
+        self.assertEqual(
+            set(['a/c', 'x/y']), backend.missing(['a', 'a/b', 'a/c', 'x/y']))
+
+    @within_temp_dir
+    def test_download_upload(self):
+        backend = m.FileBackend((working_directory() / 'ds').path)
+        with open('local', 'wb') as f:
+            f.write(b'content')
+
+        backend.upload('local', 'a/b')
+        backend.download('a/b', 'copy/b')
+
+        with open('copy/b', 'rb') as f:
+            self.assertEqual(b'content', f.read())
+
+    @within_temp_dir
+    def test_publish_puts_all_files_in_place_or_none(self):
+        backend = m.FileBackend((working_directory() / 'ds').path)
+        for name in ('a', 'b'):
+            with open(name, 'wb') as f:
+                f.write(name.encode('ascii'))
+
+        def write(path, stream):
+            if path == 'b':
+                raise IOError('crash')
+            stream.write(b'written')
+
+        with self.assertRaises(IOError):
+            backend.publish([('a', 'x/a'), ('b', 'x/b')], write=write)
+        self.assertIsNone(backend.stat('x/a'))
+
+        backend.publish([('a', 'x/a'), ('b', 'x/b')])
+        self.assertEqual(b'a', backend.read('x/a'))
+        self.assertEqual(b'b', backend.read('x/b'))
+        self.assertEqual([], os.listdir('ds/' + m.STAGING_DIRECTORY))
+
+
+class TestExternalBackend(unittest.TestCase):
+
+    def test_files(self):
+        backend = m.ExternalBackend(externals.Memory())
+        with backend.open_write('a/b') as f:
+            f.write(b'content')
+
+        self.assertEqual(7, backend.stat('a/b').size)
+        self.assertIsNone(backend.stat('a/c'))
+        self.assertEqual(b'ten', backend.read('a/b', 3, 3))
+        self.assertEqual(['a/b'], list(backend.list()))
+        self.assertEqual(['a'], list(backend.children()))
+        self.assertEqual(
+            set(['a/c', 'x/y']), backend.missing(['a', 'a/b', 'a/c', 'x/y']))
+
+    def test_version_changes_with_content(self):
+        backend = m.ExternalBackend(externals.Memory())
+        (backend.root / 'a').content = b'1'
+        version = backend.stat('a').version
+
+        (backend.root / 'a').content = b'2'
+
+        self.assertNotEqual(version, backend.stat('a').version)
+
+
+class TestHTTPBackend(unittest.TestCase):
+
+    def backend(self, store, **kwargs):
+        return m.HTTPBackend(store.url, **kwargs)
+
+    def test_put_stat_read(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store)
+            backend._put('a/b', b'content')
+
+            self.assertEqual(7, backend.stat('a/b').size)
+            self.assertIsNone(backend.stat('a/c'))
+            self.assertEqual(b'content', backend.read('a/b'))
+            self.assertEqual(b'ten', backend.read('a/b', 3, 3))
+            self.assertEqual(b'', backend.read('a/b', 7))
+
+    def test_read_from_server_without_ranges(self):
+        with fixtures.ObjectStore(ranges=False) as store:
+            backend = self.backend(store)
+            backend._put('a', b'content')
+
+            self.assertEqual(b'ten', backend.read('a', 3, 3))
+
+    def test_version_changes_with_content(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store)
+            backend._put('a', b'1')
+            version = backend.stat('a').version
+            backend._put('a', b'2')
+
+            self.assertNotEqual(version, backend.stat('a').version)
+
+    def test_list_and_missing_in_one_request_per_directory(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store)
+            for key in ('d/1', 'd/2', 'd/sub/3', 'e'):
+                backend._put(key, b'')
+            del store.requests[:]
+
+            self.assertEqual(
+                ['d/1', 'd/2', 'd/sub/3'], list(backend.list('d')))
+            self.assertEqual(
+                set(['d/4', 'f/1']),
+                backend.missing(['d/1', 'd/2', 'd/sub', 'd/4', 'e', 'f/1']))
+            self.assertEqual(
+                1 + 3, sum(1 for method, _, _ in store.requests))
+
+    def test_list_and_missing_follow_pages(self):
+        with fixtures.ObjectStore(page_size=2) as store:
+            backend = self.backend(store)
+            for key in ('d/1', 'd/2', 'd/3', 'd/sub/4', 'd/sub/5', 'e'):
+                backend._put(key, b'')
+
+            self.assertEqual(
+                ['d/1', 'd/2', 'd/3', 'd/sub/4', 'd/sub/5'],
+                list(backend.list('d')))
+            self.assertEqual(
+                ['d/1', 'd/2', 'd/3', 'd/sub'], list(backend.children('d')))
+            self.assertEqual(
+                set(['d/4']), backend.missing(['d/3', 'd/sub', 'd/4']))
+
+    def test_missing_top_level_key_lists_only_the_top_level(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store)
+            for key in ('d/1', 'd/2', 'e'):
+                backend._put(key, b'')
+            del store.requests[:]
+
+            self.assertEqual(set(['f']), backend.missing(['d', 'e', 'f']))
+            self.assertEqual(
+                [('GET', '', dict(prefix='', delimiter='/'))], store.requests)
+
+    def test_failed_post_is_not_retried(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store)
+            with mock.patch.object(
+                    backend.pool, 'connection',
+                    side_effect=socket.error('connection reset')):
+                with self.assertRaises(exceptions.DatastoreError):
+                    backend._start_upload('a')
+                self.assertEqual(1, backend.pool.connection.call_count)
+
+                with self.assertRaises(exceptions.DatastoreError):
+                    backend.stat('a')
+                self.assertEqual(3, backend.pool.connection.call_count)
+
+    def test_streaming_write_and_read_in_parts(self):
+        content = os.urandom(2500)
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store, part_size=1000)
+            writer = backend.open_write('a')
+            for offset in range(0, len(content), 300):
+                writer.write(content[offset:offset + 300])
+            writer.close()
+
+            self.assertEqual(content, store.objects['a'])
+            self.assertEqual(
+                3, sum(1 for _, _, query in store.requests if 'part' in query))
+            reader = backend.open_read('a')
+            self.assertEqual(content, reader.read())
+
+    def test_small_write_is_a_single_put(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store, part_size=1000)
+            writer = backend.open_write('a')
+            writer.write(b'content')
+            writer.close()
+
+            self.assertEqual([('PUT', 'a', {})], store.requests)
+
+    def test_discarded_write_stores_nothing(self):
+        with fixtures.ObjectStore() as store:
+            remote = m.Remote(self.backend(store, part_size=10))
+            with self.assertRaises(RuntimeError):
+                with (remote / 'a').writable_stream() as f:
+                    f.write(b'partial content')
+                    raise RuntimeError
+
+            self.assertEqual({}, store.objects)
+
+    @within_temp_dir
+    def test_concurrent_multi_part_transfers(self):
+        content = os.urandom(10000)
+        with open('local', 'wb') as f:
+            f.write(content)
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store, part_size=1000, connections=4)
+
+            backend.upload('local', 'a', threads=4)
+            self.assertEqual(content, store.objects['a'])
+
+            backend.download('a', 'dir/copy', threads=4)
+            with open('dir/copy', 'rb') as f:
+                self.assertEqual(content, f.read())
+
+            self.assertLessEqual(store.connections, 4)
+
+    def test_connections_are_reused(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store)
+            for i in range(10):
+                backend._put('a', b'content')
+                backend.stat('a')
+
+            self.assertEqual(1, store.connections)
+
+    def test_server_error_raises_DatastoreError(self):
+        with fixtures.ObjectStore() as store:
+            backend = self.backend(store)
+            with self.assertRaises(exceptions.DatastoreError):
+                backend._complete_upload('a', 'no such upload', 1)
+
+    def test_unreachable_server_raises_DatastoreError(self):
+        with fixtures.ObjectStore() as store:
+            url = store.url
+        backend = m.HTTPBackend(url, timeout=1)
+        with self.assertRaises(exceptions.DatastoreError):
+            backend.stat('a')
+
+
+class TestRemote(unittest.TestCase):
+
+    @within_temp_dir
+    def test_external_interface(self):
+        with fixtures.ObjectStore() as store:
+            datastore = m.open_datastore(store.url)
+            (datastore / 'a/b').content = b'content'
+
+            self.assertTrue((datastore / 'a/b').exists())
+            self.assertTrue((datastore / 'a').exists())
+            self.assertTrue((datastore / 'a').is_dir())
+            self.assertFalse((datastore / 'a/c').exists())
+            self.assertEqual(b'content', (datastore / 'a' / 'b').content)
+            self.assertEqual('b', (datastore / 'a/b').name)
+            self.assertEqual(datastore / 'a', (datastore / 'a/b').parent())
+            self.assertEqual(set(['c']), (datastore / 'a').missing(['b', 'c']))
+
+            (datastore / 'a/b').copy_to(working_directory() / 'local')
+            with open('local', 'rb') as f:
+                self.assertEqual(b'content', f.read())
+
+
+class Test_as_remote(unittest.TestCase):
+
+    @within_temp_dir
+    def test_local_directory(self):
+        (working_directory() / 'ds/a').content = b'content'
+
+        remote = m.as_remote(working_directory() / 'ds', staging.SYMLINK)
+
+        self.assertIsInstance(remote.backend, m.FileBackend)
+        self.assertEqual(b'content', (remote / 'a').content)
+        (remote / 'a').download('local')
+        self.assertTrue(os.path.islink('local'))
+
+    def test_other_external(self):
+        memory = externals.Memory()
+        (memory / 'a').content = b'content'
+
+        remote = m.as_remote(memory)
+
+        self.assertIsInstance(remote.backend, m.ExternalBackend)
+        self.assertEqual(b'content', (remote / 'a').content)
+
+    def test_remote(self):
+        remote = m.open_datastore('https://store.example.com/bucket')
+        self.assertIs(remote, m.as_remote(remote))
+
+
+class Test_open_datastore(unittest.TestCase):
+
+    def test_url(self):
+        datastore = m.open_datastore('https://store.example.com/bucket')
+        self.assertIsInstance(datastore, m.Remote)
+
+    @within_temp_dir
+    def test_path(self):
+        datastore = m.open_datastore('ds')
+        self.assertIsInstance(datastore, externals.File)
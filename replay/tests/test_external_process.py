@@ -1,8 +1,11 @@
 import unittest
-from temp_dir import in_temp_dir
+from temp_dir import in_temp_dir, within_temp_dir
 import replay.external_process as m
+import mock
 import os
+import resource
 import textwrap
+import time
 
 
 class Test_run(unittest.TestCase):
@@ -19,6 +22,85 @@ class Test_run(unittest.TestCase):
         result = m.run(['/bin/sh', '-c', 'exit 31'])
         self.assertEqual(31, result.status)
 
+    def test_killed_status(self):
+        result = m.run(['/bin/sh', '-c', 'kill -9 $$'])
+        self.assertEqual(-9, result.status)
+
+    def test_timeout_kills_process_group(self):
+        start = time.time()
+        result = m.run(['/bin/sh', '-c', 'sleep 10; echo done'], timeout=0.2)
+
+        self.assertTrue(result.timed_out)
+        self.assertNotEqual(0, result.status)
+        self.assertNotIn(b'done', result.stdout)
+        self.assertLess(time.time() - start, 5)
+
+    def test_timeout_kills_process_without_output_pipes(self):
+        start = time.time()
+        result = m.run(
+            ['/bin/sh', '-c', 'exec sleep 10 >/dev/null 2>&1'], timeout=0.2)
+
+        self.assertTrue(result.timed_out)
+        self.assertNotEqual(0, result.status)
+        self.assertLess(time.time() - start, 5)
+
+    def test_timeout_does_not_wait_for_descendants_holding_outputs(self):
+        start = time.time()
+        with mock.patch.object(m, 'KILLED_DRAIN_TIMEOUT', 0.2):
+            result = m.run(
+                ['/bin/sh', '-c', 'setsid sleep 3 & sleep 10'], timeout=0.2)
+
+        self.assertTrue(result.timed_out)
+        self.assertLess(time.time() - start, 2)
+
+    def test_descriptors_above_select_limit(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft <= 1100:
+            self.skipTest('open files are limited to {}'.format(soft))
+        fds = []
+        try:
+            while not fds or fds[-1] <= 1024:
+                fds.append(os.open(os.devnull, os.O_RDONLY))
+            result = m.run(['/bin/sh', '-c', 'echo test output'])
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+        self.assertEqual(b'test output', result.stdout.rstrip())
+
+    def test_descriptors_are_not_inherited(self):
+        read_end, write_end = os.pipe()
+        try:
+            result = m.run(
+                ['/bin/sh', '-c', 'test -e /dev/fd/{}'.format(write_end)])
+        finally:
+            os.close(read_end)
+            os.close(write_end)
+
+        self.assertNotEqual(0, result.status)
+
+    def test_finished_before_timeout(self):
+        result = m.run(['/bin/sh', '-c', 'echo done'], timeout=10)
+
+        self.assertFalse(result.timed_out)
+        self.assertEqual(b'done', result.stdout.rstrip())
+
+    def test_resource_usage(self):
+        program = 'x = bytearray(20 * 1024 * 1024); sum(range(10 ** 6))'
+        result = m.run(['python', '-c', program])
+        usage = result.resource_usage
+        cpu_time = usage.user_time + usage.system_time
+        self.assertLess(0, cpu_time)
+        self.assertLessEqual(0, usage.wall_time)
+        # in kilobytes
+        self.assertLess(20 * 1024, usage.max_rss)
+
+    def test_block_io_usage(self):
+        result = m.run(['/bin/sh', '-c', 'true'])
+
+        self.assertIn('block reads', result.resource_usage.as_dict())
+        self.assertIn('block writes', result.resource_usage.as_dict())
+
     def test_cwd(self):
         wd = os.getcwdu().encode('utf8')
         with in_temp_dir():
@@ -52,3 +134,123 @@ class Test_run(unittest.TestCase):
             ''').splitlines()
         actual = str(result).splitlines()
         self.assertListEqual(expected, actual)
+
+    def test_large_output_does_not_block(self):
+        # more than the pipe buffer on both stdout and stderr
+        command = 'head -c 1000000 /dev/zero; head -c 1000000 /dev/zero >&2'
+        result = m.run(['/bin/sh', '-c', command])
+        self.assertEqual(0, result.status)
+
+    def test_only_tail_of_output_is_kept(self):
+        result = m.run(
+            ['/bin/sh', '-c', 'echo 1234567890'], tail_size=4)
+        self.assertEqual(b'890\n', result.stdout)
+
+    @within_temp_dir
+    def test_output_is_saved_to_log_files(self):
+        result = m.run(
+            ['/bin/sh', '-c', 'echo 1234567890; echo error >&2'],
+            stdout_log='stdout.log',
+            stderr_log='stderr.log',
+            tail_size=4)
+
+        self.assertEqual(b'890\n', result.stdout)
+        with open('stdout.log', 'rb') as f:
+            self.assertEqual(b'1234567890\n', f.read())
+        with open('stderr.log', 'rb') as f:
+            self.assertEqual(b'error\n', f.read())
+
+
+class Test_run_with_limits(unittest.TestCase):
+
+    def run_limited(self, script, **limits):
+        result = m.run(['/bin/sh', '-c', script], limits=m.Limits(**limits))
+        self.assertEqual(0, result.status, str(result))
+        return result.stdout.decode('utf8').strip()
+
+    def test_open_files(self):
+        self.assertEqual('64', self.run_limited('ulimit -n', open_files=64))
+
+    def test_memory(self):
+        program = 'x = bytearray(200 * 1024 * 1024)'
+        result = m.run(
+            ['python', '-c', program],
+            limits=m.Limits(memory=100 * 1024 * 1024))
+
+        self.assertNotEqual(0, result.status)
+        self.assertIn(b'MemoryError', result.stderr)
+
+    def test_nice(self):
+        niceness = int(self.run_limited('nice'))
+
+        self.assertEqual(
+            str(niceness + 5), self.run_limited('nice', nice=5))
+
+    def test_cpus(self):
+        allowed = self.run_limited(
+            'grep Cpus_allowed_list /proc/self/status', cpus=[0])
+
+        self.assertEqual('0', allowed.split()[-1])
+
+    def test_io_priority(self):
+        self.assertEqual(
+            'idle', self.run_limited('ionice', io_priority=m.IO_IDLE))
+        self.assertEqual(
+            'best-effort: prio 7', self.run_limited('ionice', io_priority=7))
+
+    def test_limits_are_in_result(self):
+        limits = m.Limits(open_files=64)
+        result = m.run(['/bin/sh', '-c', 'true'], limits=limits)
+
+        self.assertIs(limits, result.limits)
+        self.assertEqual(('/bin/sh', '-c', 'true'), result.cmdspec)
+
+
+class TestLimits(unittest.TestCase):
+
+    def test_cpu_count(self):
+        limits = m.Limits(cpus=1)
+
+        self.assertEqual(1, len(limits.cpu_ids()))
+        self.assertIn(limits.cpu_ids()[0], m._available_cpus())
+        # chosen once
+        self.assertIs(limits.cpu_ids(), limits.cpu_ids())
+
+    def test_least_loaded_cpus_are_chosen(self):
+        times = [
+            {0: (0, 0), 1: (0, 0), 2: (0, 0), 3: (0, 0)},
+            {0: (90, 100), 1: (10, 100), 2: (100, 100), 3: (0, 100)}]
+
+        with mock.patch.object(
+                m, '_available_cpus', return_value=[0, 1, 2, 3]):
+            with mock.patch.object(m, '_cpu_times', side_effect=times):
+                with mock.patch.object(m.time, 'sleep'):
+                    self.assertEqual([1, 3], m.Limits(cpus=2).cpu_ids())
+
+    def test_idle_cpus_are_rotated_by_process(self):
+        def cpu_ids(pid):
+            with mock.patch.object(
+                    m, '_available_cpus', return_value=[0, 1, 2, 3]):
+                with mock.patch.object(m, '_cpu_times', return_value={}):
+                    with mock.patch.object(m.os, 'getpid', return_value=pid):
+                        return m.Limits(cpus=2).cpu_ids()
+
+        self.assertEqual([0, 1], cpu_ids(4))
+        self.assertEqual([2, 3], cpu_ids(6))
+
+    def test_as_dict(self):
+        self.assertEqual(
+            {'memory': 1024, 'io priority': 'idle'},
+            m.Limits(memory=1024, io_priority=m.IO_IDLE).as_dict())
+
+    def test_find_executable(self):
+        self.assertEqual(
+            os.path.realpath('/bin/sh'),
+            os.path.realpath(m.find_executable('sh')))
+        self.assertIsNone(m.find_executable('no-such-command-here'))
+
+    def test_missing_command_is_error(self):
+        limits = m.Limits(io_priority=m.IO_IDLE)
+        with mock.patch.object(m, 'find_executable', return_value=None):
+            with self.assertRaises(ValueError):
+                limits.command_prefix()
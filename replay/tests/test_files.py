@@ -0,0 +1,26 @@
+import unittest
+from temp_dir import within_temp_dir
+import os
+
+import replay.files as m
+
+
+class Test_makedirs(unittest.TestCase):
+
+    @within_temp_dir
+    def test_creates_parents(self):
+        m.makedirs('a/b')
+        self.assertTrue(os.path.isdir('a/b'))
+
+    @within_temp_dir
+    def test_existing_directory_is_fine(self):
+        os.mkdir('a')
+        m.makedirs('a')
+        m.makedirs('')
+        self.assertEqual(['a'], os.listdir('.'))
+
+    @within_temp_dir
+    def test_file_in_the_way_is_error(self):
+        open('a', 'w').close()
+        with self.assertRaises(OSError):
+            m.makedirs('a/b')
@@ -0,0 +1,157 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import working_directory
+import mock
+import os
+
+from replay.tests import fixtures
+from replay import files
+from replay import fingerprint as m
+
+
+class Test_hash_tree(unittest.TestCase):
+
+    @within_temp_dir
+    def test_content_change_changes_hash(self):
+        wd = working_directory()
+        (wd / 'dir/file').content = b'1'
+        hash1 = m.hash_tree(wd.path)
+
+        (wd / 'dir/file').content = b'2'
+
+        self.assertNotEqual(hash1, m.hash_tree(wd.path))
+
+    @within_temp_dir
+    def test_rename_changes_hash(self):
+        wd = working_directory()
+        (wd / 'dir/file1').content = b'1'
+        hash1 = m.hash_tree((wd / 'dir').path)
+
+        (wd / 'dir2/file2').content = b'1'
+
+        self.assertNotEqual(hash1, m.hash_tree((wd / 'dir2').path))
+
+    @within_temp_dir
+    def test_change_of_file_linked_from_outside_changes_hash(self):
+        wd = working_directory()
+        (wd / 'common/lib.py').content = b'1'
+        (wd / 'script/run.py').content = b'import lib'
+        os.symlink('../common/lib.py', (wd / 'script/lib.py').path)
+        hash1 = m.hash_tree((wd / 'script').path)
+
+        (wd / 'common/lib.py').content = b'2'
+
+        self.assertNotEqual(hash1, m.hash_tree((wd / 'script').path))
+
+    @within_temp_dir
+    def test_replay_directory_is_ignored(self):
+        wd = working_directory()
+        (wd / 'file').content = b'1'
+        hash1 = m.hash_tree(wd.path)
+
+        (wd / '.replay/log').content = b'2'
+
+        self.assertEqual(hash1, m.hash_tree(wd.path))
+
+    @within_temp_dir
+    def test_files_in_replayignore_are_ignored(self):
+        wd = working_directory()
+        (wd / 'file').content = b'1'
+        (wd / '.replayignore').content = b'*.csv'
+        hash1 = m.hash_tree(wd.path)
+
+        (wd / 'data.csv').content = b'2'
+        (wd / '.git/HEAD').content = b'2'
+
+        self.assertEqual(hash1, m.hash_tree(wd.path))
+
+
+class Test_fingerprint(unittest.TestCase):
+
+    def fingerprint(self, script, input_content):
+        f = fixtures.PluginContext(script)
+        (f.datastore / 'input').content = input_content
+        return m.fingerprint([f.plugin])
+
+    def test_input_content_is_part_of_fingerprint(self):
+        script = '''\
+            Inputs:
+                - local: input
+            '''
+        self.assertEqual(
+            self.fingerprint(script, b'1'),
+            self.fingerprint(script, b'1'))
+        self.assertNotEqual(
+            self.fingerprint(script, b'1'),
+            self.fingerprint(script, b'2'))
+
+    def test_datastore_path_is_not_part_of_fingerprint(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - local: output1
+            ''')
+        f2 = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - local: output2
+            ''')
+        self.assertEqual(
+            m.fingerprint([f.plugin]),
+            m.fingerprint([f2.plugin]))
+
+    def test_command_is_part_of_fingerprint(self):
+        f = fixtures.PluginContext('Execute: echo 1')
+        f2 = fixtures.PluginContext('Execute: echo 2')
+        self.assertNotEqual(
+            m.fingerprint([f.plugin]),
+            m.fingerprint([f2.plugin]))
+
+
+class Test_hash_stream(unittest.TestCase):
+
+    @within_temp_dir
+    def test_read_and_readinto_give_the_same_digest(self):
+        content = b'0123456789' * (files.CHUNK_SIZE // 4)
+        (working_directory() / 'file').content = content
+
+        class Stream(object):
+            def __init__(self):
+                self.content = content
+
+            def read(self, size):
+                chunk = self.content[:size]
+                self.content = self.content[size:]
+                return chunk
+
+        self.assertEqual(
+            m.hash_stream(Stream()),
+            m.hash_file((working_directory() / 'file').path))
+
+    @within_temp_dir
+    def test_fast_algorithm(self):
+        (working_directory() / 'file').content = b'content'
+        path = (working_directory() / 'file').path
+
+        self.assertEqual(
+            m.hash_file(path, m.FAST_ALGORITHM),
+            m.hash_file(path, m.FAST_ALGORITHM))
+
+
+class Test_hash_externals(unittest.TestCase):
+
+    @within_temp_dir
+    def test_local_files_are_looked_up_in_cache(self):
+        wd = working_directory()
+        (wd / 'local').content = b'local'
+        remote = fixtures.PluginContext().datastore / 'remote'
+        remote.content = b'remote'
+        cache = mock.Mock()
+        cache.digests.return_value = {(wd / 'local').path: 'cached'}
+
+        digests = m.hash_externals(
+            [remote, wd / 'local'], threads=2, cache=cache)
+
+        self.assertEqual([m.hash_external(remote), 'cached'], digests)
+        cache.digests.assert_called_once_with(
+            [(wd / 'local').path], m.ALGORITHM, 2)
@@ -0,0 +1,81 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import working_directory
+import mock
+import os
+import time
+
+from replay import fingerprint
+import replay.hash_cache as m
+
+
+class TestHashCache(unittest.TestCase):
+
+    def make_file(self, name, content, age=60):
+        path = (working_directory() / name).path
+        with open(path, 'wb') as f:
+            f.write(content)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def digests(self, cache, paths):
+        with mock.patch(
+                'replay.fingerprint.hash_files',
+                side_effect=fingerprint.hash_files) as hash_files:
+            digests = cache.digests(paths)
+        hashed = [
+            path
+            for call in hash_files.call_args_list
+            for path in call[0][0]]
+        return digests, hashed
+
+    @within_temp_dir
+    def test_unchanged_file_is_not_read_again(self):
+        a = self.make_file('a', b'a')
+        b = self.make_file('b', b'b')
+        cache = m.HashCache('hashes.sqlite')
+
+        digests, hashed = self.digests(cache, [a, b])
+        self.assertEqual(fingerprint.hash_file(a), digests[a])
+        self.assertEqual(sorted([a, b]), hashed)
+
+        self.assertEqual((digests, []), self.digests(cache, [a, b]))
+
+    @within_temp_dir
+    def test_modified_file_is_hashed(self):
+        a = self.make_file('a', b'1')
+        cache = m.HashCache('hashes.sqlite')
+        cache.digests([a])
+
+        self.make_file('a', b'2', age=30)
+
+        digests, hashed = self.digests(cache, [a])
+        self.assertEqual([a], hashed)
+        self.assertEqual(fingerprint.hash_file(a), digests[a])
+
+    @within_temp_dir
+    def test_algorithms_are_kept_apart(self):
+        a = self.make_file('a', b'a')
+        cache = m.HashCache('hashes.sqlite')
+        cache.digests([a])
+
+        self.assertEqual(
+            fingerprint.hash_file(a, 'md5'), cache.digests([a], 'md5')[a])
+
+    @within_temp_dir
+    def test_recently_modified_file_is_not_cached(self):
+        a = self.make_file('a', b'a', age=0)
+        cache = m.HashCache('hashes.sqlite')
+        cache.digests([a])
+
+        self.assertEqual([a], self.digests(cache, [a])[1])
+
+    @within_temp_dir
+    def test_read_only_cache_creates_nothing(self):
+        a = self.make_file('a', b'a')
+        cache = m.HashCache('.replay/hashes.sqlite', read_only=True)
+
+        self.assertEqual(
+            fingerprint.hash_file(a), cache.digests([a])[a])
+        self.assertFalse(os.path.exists('.replay'))
@@ -0,0 +1,100 @@
+import unittest
+from temp_dir import within_temp_dir
+
+import replay.history as m
+from replay import report
+
+
+class Execute(object):
+    pass
+
+
+def make_report(
+        script, wall_time, bytes_staged=0, status=report.SUCCEEDED,
+        directory='/scripts'):
+    run_report = report.RunReport(
+        script, directory + '/' + script + '.script')
+    run_report.add_phase(Execute(), report.SETUP, wall_time / 2.0)
+    run_report.bytes_staged = bytes_staged
+    run_report.finish(status)
+    run_report.finished = run_report.started + wall_time
+    return run_report
+
+
+class Test_percentile(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(3, m.percentile(values, 50))
+        self.assertEqual(5, m.percentile(values, 95))
+        self.assertEqual(1, m.percentile(values, 0))
+
+    def test_empty(self):
+        self.assertIsNone(m.percentile([], 50))
+
+
+class TestHistory(unittest.TestCase):
+
+    @within_temp_dir
+    def test_script_stats(self):
+        history = m.History('.replay/history.sqlite')
+        for wall_time in (10, 11, 12, 30):
+            history.record(make_report('slow', wall_time))
+        history.record(make_report('failed', 100, status=report.FAILED))
+
+        stats, = history.script_stats()
+
+        self.assertEqual('slow', stats.script)
+        self.assertEqual(4, stats.runs)
+        self.assertEqual(11, round(stats.p50))
+        self.assertEqual(30, round(stats.p95))
+        self.assertTrue(stats.is_slower(1.5))
+        self.assertFalse(stats.is_slower(3))
+
+    @within_temp_dir
+    def test_scripts_of_the_same_name_are_kept_apart(self):
+        history = m.History('history.sqlite')
+        history.record(make_report('run', 1, directory='/a'))
+        history.record(make_report('run', 100, directory='/b'))
+
+        stats = history.script_stats()
+
+        self.assertEqual(
+            [('run', '/a/run.script', 1), ('run', '/b/run.script', 100)],
+            [(s.script, s.script_path, round(s.p50)) for s in stats])
+        self.assertEqual(
+            [('run', 'Execute', report.SETUP, 50.0, 1),
+             ('run', 'Execute', report.SETUP, 0.5, 1)],
+            history.slowest_phases())
+
+    @within_temp_dir
+    def test_data_growth(self):
+        history = m.History('history.sqlite')
+        for bytes_staged in (100, 110, 1000):
+            history.record(make_report('script', 1, bytes_staged))
+
+        stats, = history.script_stats()
+
+        self.assertTrue(stats.has_more_data(2))
+        self.assertFalse(stats.is_slower(2))
+
+    @within_temp_dir
+    def test_script_stats_of_recent_runs(self):
+        history = m.History('history.sqlite')
+        for wall_time in (100, 1, 1):
+            history.record(make_report('script', wall_time))
+
+        stats, = history.script_stats(runs=2)
+
+        self.assertEqual(2, stats.runs)
+        self.assertEqual(1, round(stats.p95))
+
+    @within_temp_dir
+    def test_slowest_phases(self):
+        history = m.History('history.sqlite')
+        history.record(make_report('fast', 1))
+        history.record(make_report('slow', 10))
+
+        phases = history.slowest_phases(limit=1)
+
+        self.assertEqual([('slow', 'Execute', report.SETUP, 5.0, 1)], phases)
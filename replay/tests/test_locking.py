@@ -0,0 +1,31 @@
+import unittest
+from temp_dir import within_temp_dir
+
+from replay import locking as m
+
+
+class TestFileLock(unittest.TestCase):
+
+    @within_temp_dir
+    def test_exclusive_lock_excludes_others(self):
+        with m.FileLock('dir/lock'):
+            self.assertFalse(m.FileLock('dir/lock').acquire(blocking=False))
+            self.assertFalse(
+                m.FileLock('dir/lock', shared=True).acquire(blocking=False))
+
+    @within_temp_dir
+    def test_released_lock_can_be_acquired(self):
+        with m.FileLock('lock'):
+            pass
+
+        lock = m.FileLock('lock')
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+    @within_temp_dir
+    def test_shared_locks_do_not_exclude_each_other(self):
+        with m.FileLock('lock', shared=True):
+            lock = m.FileLock('lock', shared=True)
+            self.assertTrue(lock.acquire(blocking=False))
+            lock.release()
+            self.assertFalse(m.FileLock('lock').acquire(blocking=False))
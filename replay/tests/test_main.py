@@ -1,12 +1,19 @@
 import unittest
 TODO = unittest.skip('not implemented yet')
 import replay.main as m
+import replay.datastores
 
+import json
 import mock
+import os
 from temp_dir import within_temp_dir
 import pkg_resources
+from externals import File
 from externals import working_directory
 
+from replay.tests import fixtures
+from replay import exceptions
+
 
 class Test_parse_args(unittest.TestCase):
 
@@ -38,6 +45,71 @@ class Test_parse_args(unittest.TestCase):
             args.script_path)
 
 
+class Test_get_wheelhouse(unittest.TestCase):
+
+    def test_default_is_in_virtualenv_parent_directory(self):
+        args = m.parse_args(['--venvs=/venvs', 'scriptname.py'])
+
+        self.assertEqual('/venvs/wheelhouse', m.get_wheelhouse(args))
+
+    def test_wheelhouse(self):
+        args = m.parse_args(['--wheelhouse=/wheels', 'scriptname.py'])
+
+        self.assertEqual('/wheels', m.get_wheelhouse(args))
+
+    def test_no_wheelhouse(self):
+        args = m.parse_args(['--no-wheelhouse', 'scriptname.py'])
+
+        self.assertIsNone(m.get_wheelhouse(args))
+
+
+class Test_remote_datastore(unittest.TestCase):
+
+    URL = 'http://store.example.com/bucket'
+
+    def test_datastore_is_remote(self):
+        args = m.parse_args(['--datastore=' + self.URL, 'scriptname.py'])
+
+        self.assertIsInstance(m.get_datastore(args), replay.datastores.Remote)
+
+    def test_no_local_caches_by_default(self):
+        args = m.parse_args(['--datastore=' + self.URL, 'scriptname.py'])
+
+        self.assertIsNone(m.get_output_cache(args))
+        self.assertIsNone(m.get_plan_cache(args))
+
+    def test_explicit_cache(self):
+        args = m.parse_args(
+            ['--datastore=' + self.URL, '--cache=/cache', 'scriptname.py'])
+
+        self.assertEqual('/cache', m.get_output_cache(args).directory)
+
+    @within_temp_dir
+    def test_run(self):
+        wd = working_directory()
+        (wd / 'copy.script').content = b'''\
+Inputs:
+    - input : input
+---
+Outputs:
+    - output : output
+---
+Execute: cp input output
+'''
+        with fixtures.ObjectStore() as store:
+            store.objects['input'] = b'content'
+            command = [
+                'replay', '--datastore=' + store.url,
+                (wd / 'copy.script').path]
+            with mock.patch('sys.argv', command):
+                m.main()
+
+            self.assertEqual(b'content', store.objects['output'])
+            self.assertTrue(
+                any(key.startswith('.replay/build-state/')
+                    for key in store.objects))
+
+
 class Test_get_virtualenv_parent_dir(unittest.TestCase):
 
     def test_value_of_WORKON_HOME_is_returned(self):
@@ -92,3 +164,338 @@ class Test_main(unittest.TestCase):
         self.assertEqual(
             wd.path.encode('utf8'),
             (ds / 'working_directory').content)
+
+
+class Test_build_main(unittest.TestCase):
+
+    @within_temp_dir
+    def test_scripts_are_run_in_dependency_order(self):
+        wd = working_directory()
+        ds = wd / 'datastore'
+        (wd / 'scripts/second.script').content = b'''\
+Inputs:
+    - a : a
+---
+Outputs:
+    - b : b
+---
+Execute: cp a b
+'''
+        (wd / 'scripts/first.script').content = b'''\
+Outputs:
+    - a : a
+---
+Execute: echo first > a
+'''
+
+        status = m.build_main(
+            ['--datastore=' + ds.path, (wd / 'scripts').path])
+
+        self.assertEqual(0, status)
+        self.assertEqual(b'first', (ds / 'b').content.rstrip())
+
+    @within_temp_dir
+    def test_patterns(self):
+        wd = working_directory()
+        ds = wd / 'datastore'
+        (wd / 'scripts/concatenate.script').content = b'''\
+Inputs:
+    - days: days/*.csv
+---
+Outputs:
+    - all : all
+---
+Execute: cat days/*.csv > all; echo run >> RUNS
+'''.replace(b'RUNS', (wd / 'runs').path.encode('utf8'))
+        (wd / 'scripts/split.script').content = b'''\
+Outputs:
+    - out/: days/
+---
+Execute: mkdir out; echo 1 > out/1.csv; echo 2 > out/2.csv
+'''
+        command = ['--datastore=' + ds.path, (wd / 'scripts').path]
+
+        self.assertEqual(0, m.build_main(command))
+        self.assertEqual(b'1\n2\n', (ds / 'all').content)
+
+        # not rebuilt
+        self.assertEqual(0, m.build_main(command))
+        self.assertEqual(b'run\n', (wd / 'runs').content)
+
+    @within_temp_dir
+    def test_failure_is_reported_in_exit_status(self):
+        wd = working_directory()
+        (wd / 'fail.script').content = b'Execute: exit 1'
+
+        status = m.build_main([(wd / 'fail.script').path])
+
+        self.assertEqual(1, status)
+
+
+class Test_incremental_run(unittest.TestCase):
+
+    def main(self, *args):
+        with mock.patch('sys.argv', ['replay'] + list(args)):
+            m.main()
+
+    @within_temp_dir
+    def test_script_is_run_only_when_inputs_change(self):
+        wd = working_directory()
+        (wd / 'scripts/copy.script').content = b'''\
+Inputs:
+    - input : input
+---
+Outputs:
+    - output : output
+---
+Execute: cp input output
+'''
+        script = (wd / 'scripts/copy.script').path
+        (wd / 'input').content = b'1'
+        self.main('--no-cache', script)
+        self.assertEqual(b'1', (wd / 'output').content)
+
+        # not run
+        with mock.patch('replay.context.Context.run') as run:
+            self.main('--no-cache', script)
+        self.assertFalse(run.called)
+
+        # run again, as the output was modified
+        (wd / 'output').content = b'modified'
+        self.main('--no-cache', script)
+        self.assertEqual(b'1', (wd / 'output').content)
+
+        # run again, as the input changed
+        (wd / 'input').content = b'2'
+        self.main('--no-cache', script)
+        self.assertEqual(b'2', (wd / 'output').content)
+
+    @within_temp_dir
+    def test_run_with_earlier_inputs_replaces_outputs(self):
+        wd = working_directory()
+        (wd / 'scripts/copy.script').content = b'''\
+Inputs:
+    - input : input
+---
+Outputs:
+    - output : output
+---
+Execute: cp input output
+'''
+        script = (wd / 'scripts/copy.script').path
+        for content in (b'A', b'B', b'A'):
+            (wd / 'input').content = content
+            self.main('--no-cache', script)
+
+            self.assertEqual(content, (wd / 'output').content)
+
+    @within_temp_dir
+    def test_run_report_is_written_to_datastore(self):
+        wd = working_directory()
+        (wd / 'scripts/copy.script').content = b'''\
+Inputs:
+    - input : input
+---
+Outputs:
+    - output : output
+---
+Execute: cp input output
+'''
+        (wd / 'input').content = b'12345'
+
+        self.main((wd / 'scripts/copy.script').path)
+
+        script_reports, = (wd / '.replay/reports').children()
+        self.assertTrue(script_reports.name.startswith('copy-'))
+        report, = script_reports.children()
+        record = json.loads(report.content.decode('utf8'))
+        self.assertEqual('succeeded', record['status'])
+        self.assertEqual(5, record['bytes staged'])
+        self.assertEqual(5, record['bytes uploaded'])
+        self.assertIn(
+            ('Execute', 'setup'),
+            [(p['plugin'], p['phase']) for p in record['phases']])
+        process, = record['processes']
+        self.assertEqual(0, process['status'])
+        self.assertEqual(['input'], list(record['manifest']['inputs']))
+        self.assertEqual(
+            record['manifest']['inputs']['input'],
+            record['manifest']['outputs']['output'])
+
+    @within_temp_dir
+    def test_logs_are_kept_in_datastore(self):
+        wd = working_directory()
+        (wd / 'scripts/fail.script').content = b'''\
+Execute: echo failed >&2; exit 1
+'''
+
+        with self.assertRaises(exceptions.ScriptError) as cm:
+            self.main((wd / 'scripts/fail.script').path)
+
+        stderr_log = cm.exception.args[0].stderr_log
+        self.assertTrue(
+            stderr_log.startswith((wd / '.replay/logs/fail-').path))
+        self.assertEqual(b'failed', File(stderr_log).content.rstrip())
+
+    @within_temp_dir
+    def test_force_runs_the_script(self):
+        wd = working_directory()
+        (wd / 'scripts/write.script').content = b'''\
+Outputs:
+    - output : output
+---
+Execute: echo output > output
+'''
+        script = (wd / 'scripts/write.script').path
+        self.main(script)
+        (wd / 'output').content = b'modified'
+
+        self.main('--force', script)
+
+        self.assertEqual(b'output', (wd / 'output').content.rstrip())
+
+
+class Test_output_cache(unittest.TestCase):
+
+    @within_temp_dir
+    def test_same_computation_is_restored_from_cache(self):
+        wd = working_directory()
+        for name in ('a', 'b'):
+            (wd / 'scripts' / name / 'write.script').content = b'''\
+Outputs:
+    - output : ''' + name.encode('ascii') + b'''
+---
+Execute: echo computed > output; echo side effect >> ../../side_effect
+'''
+            (wd / 'scripts' / name / 'script.sh').content = b'#'
+
+        command = ['replay', '--dir=' + (wd / 'tmp/run/dir').path]
+        with mock.patch('sys.argv', command + [
+                (wd / 'scripts/a/write.script').path]):
+            m.main()
+        with mock.patch('sys.argv', command + [
+                (wd / 'scripts/b/write.script').path]):
+            m.main()
+
+        self.assertEqual(b'computed', (wd / 'a').content.rstrip())
+        self.assertEqual(b'computed', (wd / 'b').content.rstrip())
+        self.assertEqual(
+            b'side effect', (wd / 'tmp/side_effect').content.rstrip())
+
+    @within_temp_dir
+    def test_outputs_do_not_share_storage_with_the_cache(self):
+        wd = working_directory()
+        (wd / 'scripts/write.script').content = b'''\
+Outputs:
+    - output : output
+---
+Execute: echo computed > output
+'''
+        script = (wd / 'scripts/write.script').path
+        with mock.patch('sys.argv', ['replay', script]):
+            m.main()
+
+        stat = os.stat((wd / 'output').path)
+        self.assertEqual(1, stat.st_nlink)
+        self.assertTrue(stat.st_mode & 0o200)
+
+        # modified in place, then restored from the cache
+        with open((wd / 'output').path, 'wb') as f:
+            f.write(b'modified')
+        with mock.patch('sys.argv', ['replay', script]):
+            m.main()
+
+        self.assertEqual(b'computed', (wd / 'output').content.rstrip())
+
+
+class Test_cache_main(unittest.TestCase):
+
+    @within_temp_dir
+    def test_gc(self):
+        with mock.patch('sys.argv', ['replay', 'cache', 'gc']):
+            with self.assertRaises(SystemExit) as cm:
+                m.main()
+        self.assertEqual(0, cm.exception.code)
+
+
+class Test_stats_main(unittest.TestCase):
+
+    def main(self, *args):
+        with mock.patch('sys.argv', ['replay'] + list(args)):
+            m.main()
+
+    @within_temp_dir
+    def test_slower_run_is_flagged(self):
+        wd = working_directory()
+        (wd / 'scripts/sleep.script').content = b'''\
+Inputs:
+    - t : t
+---
+Execute: sleep $(cat t)
+'''
+        script = (wd / 'scripts/sleep.script').path
+        for seconds in (b'0', b'0', b'0.5'):
+            (wd / 't').content = seconds
+            self.main('--force', '--no-cache', script)
+
+        history = m.get_history(wd)
+        stats, = history.script_stats()
+        self.assertEqual('sleep', stats.script)
+        self.assertEqual(3, stats.runs)
+        self.assertEqual(1, m.stats_main(['--check', '--slower=2']))
+
+    @within_temp_dir
+    def test_no_history(self):
+        self.assertEqual(1, m.stats_main([]))
+
+
+class Test_plan_main(unittest.TestCase):
+
+    @within_temp_dir
+    def test_plan(self):
+        wd = working_directory()
+        (wd / 'scripts/copy.script').content = b'''\
+Inputs:
+    - a : a
+---
+Outputs:
+    - b : b
+---
+Execute: cp a b
+'''
+        (wd / 'a').content = b'a'
+
+        self.assertEqual(0, m.plan_main([(wd / 'scripts').path]))
+        self.assertFalse(os.path.exists((wd / '.replay').path))
+
+    @within_temp_dir
+    def test_missing_input_fails(self):
+        wd = working_directory()
+        (wd / 'copy.script').content = b'''\
+Inputs:
+    - a : a
+'''
+
+        self.assertEqual(1, m.plan_main([(wd / 'copy.script').path]))
+
+
+class Test_venv_main(unittest.TestCase):
+
+    @within_temp_dir
+    def test_warm_list_prune(self):
+        wd = working_directory()
+        (wd / 'deps.script').content = b'PythonDependencies:'
+        venvs = '--venvs=' + (wd / 'venvs').path
+
+        self.assertEqual(
+            0, m.venv_main(['warm', venvs, (wd / 'deps.script').path]))
+        self.assertEqual(1, len(os.listdir((wd / 'venvs').path)) // 2)
+
+        self.assertEqual(0, m.venv_main(['list', venvs]))
+
+        self.assertEqual(0, m.venv_main(['prune', venvs]))
+        self.assertEqual(
+            [],
+            [
+                name for name in os.listdir((wd / 'venvs').path)
+                if not name.endswith('.lock')])
@@ -0,0 +1,103 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import Memory
+from externals import working_directory
+import mock
+
+import replay.patterns as m
+
+
+class Test_split(unittest.TestCase):
+
+    def test_glob(self):
+        self.assertEqual(
+            ('data/daily', ['2020-*', '*.csv']),
+            m.split('data/daily/2020-*/*.csv'))
+
+    def test_directory(self):
+        self.assertEqual(('data', ['**', '*']), m.split('data/'))
+
+
+class Test_matches(unittest.TestCase):
+
+    def test_glob_matches_in_one_directory(self):
+        self.assertTrue(m.matches('d/*.csv', 'd/a.csv'))
+        self.assertFalse(m.matches('d/*.csv', 'd/x/a.csv'))
+        self.assertFalse(m.matches('d/*.csv', 'e/a.csv'))
+
+    def test_recursive(self):
+        self.assertTrue(m.matches('d/**/*.csv', 'd/a.csv'))
+        self.assertTrue(m.matches('d/**/*.csv', 'd/x/y/a.csv'))
+
+    def test_directory_matches_everything_under_it(self):
+        self.assertTrue(m.matches('d/', 'd/x/.hidden'))
+        self.assertFalse(m.matches('d/', 'dx/a'))
+
+
+class Test_overlap(unittest.TestCase):
+
+    def test_paths(self):
+        self.assertTrue(m.overlap('a', 'a'))
+        self.assertFalse(m.overlap('a', 'b'))
+
+    def test_pattern_and_path(self):
+        self.assertTrue(m.overlap('d/a.csv', 'd/*.csv'))
+        self.assertFalse(m.overlap('d/a.txt', 'd/*.csv'))
+
+    def test_patterns_with_nested_bases(self):
+        self.assertTrue(m.overlap('d/', 'd/x/*.csv'))
+        self.assertFalse(m.overlap('d/*.csv', 'e/*.csv'))
+
+
+class Test_expand(unittest.TestCase):
+
+    def make_files(self, root):
+        for path in ('d/a.csv', 'd/b.txt', 'd/x/c.csv', 'e/f.csv'):
+            (root / path).content = b''
+
+    @within_temp_dir
+    def test_local_directory(self):
+        self.make_files(working_directory())
+
+        self.assertEqual(
+            ['d/a.csv'], list(m.expand(working_directory().path, 'd/*.csv')))
+        self.assertEqual(
+            ['d/a.csv', 'd/b.txt', 'd/x/c.csv'],
+            list(m.expand(working_directory(), 'd/')))
+
+    @within_temp_dir
+    def test_only_directories_that_can_match_are_listed(self):
+        self.make_files(working_directory())
+        entries = m._local_entries(working_directory().path)
+
+        with mock.patch(
+                'replay.patterns._local_entries',
+                return_value=mock.Mock(side_effect=entries)) as local:
+            self.assertEqual(
+                ['d/a.csv'],
+                list(m.expand(working_directory().path, 'd/*.csv')))
+
+        self.assertEqual(
+            [mock.call('d')], local.return_value.call_args_list)
+
+    def test_external(self):
+        datastore = Memory()
+        self.make_files(datastore)
+
+        self.assertEqual(
+            ['d/a.csv', 'd/x/c.csv', 'e/f.csv'],
+            list(m.expand(datastore, '**/*.csv')))
+
+    def test_missing_directory(self):
+        self.assertEqual([], list(m.expand(Memory(), 'd/')))
+
+
+class Test_expand_mapping(unittest.TestCase):
+
+    def test_files_go_under_the_directory(self):
+        datastore = Memory()
+        (datastore / 'd/x/a.csv').content = b''
+
+        self.assertEqual(
+            [('d/x/a.csv', 'local/x/a.csv')],
+            list(m.expand_mapping(datastore, 'd/**/*.csv', 'local/')))
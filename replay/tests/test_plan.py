@@ -0,0 +1,170 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import working_directory
+import mock
+import os
+
+from replay.tests import fixtures
+from replay import build_state
+from replay import fingerprint
+from replay import plan_cache
+import replay.plan as m
+
+
+PRODUCER = b'''\
+Inputs:
+    - raw: raw
+---
+Outputs:
+    - mid: mid
+---
+Execute: cp raw mid
+'''
+
+CONSUMER = b'''\
+Inputs:
+    - mid: mid
+---
+Outputs:
+    - out: out
+---
+Execute: cp mid out
+'''
+
+
+class Test_plan(unittest.TestCase):
+
+    def set_up(self):
+        self.wd = working_directory()
+        f = fixtures.PluginContext()
+        self.context = f.context
+        self.context.datastore = self.wd / 'ds'
+        (self.wd / 'ds/raw').content = b'data'
+        (self.wd / 'scripts/producer.script').content = PRODUCER
+        (self.wd / 'scripts/consumer.script').content = CONSUMER
+
+    def script(self, name):
+        return (self.wd / 'scripts' / name).path
+
+    def plan(self, *names):
+        script_plans = m.plan(self.context, [self.script(n) for n in names])
+        return [
+            (os.path.basename(p.path), p.action, p.reason)
+            for p in script_plans]
+
+    def record_run(self, name):
+        path = self.script(name)
+        run_fingerprint = fingerprint.fingerprint(
+            m.load_script(self.context, path))
+        state = build_state.BuildState(self.context.datastore)
+        with open(path) as f:
+            key = state.key(f.read(), run_fingerprint)
+        state.record(key, ['mid'])
+        return run_fingerprint
+
+    @within_temp_dir
+    def test_estimates_are_by_script_path(self):
+        self.set_up()
+        history = mock.Mock()
+        history.script_stats.return_value = [
+            mock.Mock(
+                script='producer', script_path='/elsewhere/producer.script',
+                p50=100),
+            mock.Mock(
+                script='producer', script_path=self.script('producer.script'),
+                p50=1)]
+
+        script_plan, = m.plan(
+            self.context, [self.script('producer.script')], history)
+
+        self.assertEqual(1, script_plan.estimate)
+
+    @within_temp_dir
+    def test_new_scripts_run_in_dependency_order(self):
+        self.set_up()
+        self.assertEqual(
+            [
+                ('producer.script', m.RUN, None),
+                ('consumer.script', m.RUN,
+                    'inputs rebuilt by ' + self.script('producer.script'))],
+            self.plan('consumer.script', 'producer.script'))
+
+    @within_temp_dir
+    def test_up_to_date(self):
+        self.set_up()
+        (self.wd / 'ds/mid').content = b'data'
+        self.record_run('producer.script')
+
+        self.assertEqual(
+            [
+                ('producer.script', m.UP_TO_DATE, None),
+                ('consumer.script', m.RUN, None)],
+            self.plan('producer.script', 'consumer.script'))
+
+    @within_temp_dir
+    def test_overwritten_output_is_not_up_to_date(self):
+        self.set_up()
+        (self.wd / 'ds/mid').content = b'data'
+        self.record_run('producer.script')
+        (self.wd / 'ds/mid').content = b'other data'
+
+        self.assertEqual(
+            [('producer.script', m.RUN, None)],
+            self.plan('producer.script'))
+
+    @within_temp_dir
+    def test_restore(self):
+        self.set_up()
+        self.context.output_cache = mock.Mock()
+        self.context.output_cache.lookup.return_value = dict(mid='digest')
+
+        self.assertEqual(
+            [('producer.script', m.RESTORE, None)],
+            self.plan('producer.script'))
+
+    @within_temp_dir
+    def test_missing_input_is_an_error_and_dependents_are_skipped(self):
+        self.set_up()
+        os.remove((self.wd / 'ds/raw').path)
+
+        self.assertEqual(
+            [
+                ('producer.script', m.ERROR, 'missing inputs: raw'),
+                ('consumer.script', m.SKIP,
+                    'depends on ' + self.script('producer.script'))],
+            self.plan('producer.script', 'consumer.script'))
+
+    @within_temp_dir
+    def test_invalid_script_is_an_error(self):
+        self.set_up()
+        (self.wd / 'scripts/bad.script').content = b'NoSuchPlugin: 1'
+
+        (name, action, _), = self.plan('bad.script')
+        self.assertEqual(('bad.script', m.ERROR), (name, action))
+
+    @within_temp_dir
+    def test_new_virtualenvs_are_listed(self):
+        self.set_up()
+        (self.wd / 'scripts/deps.script').content = (
+            b'PythonDependencies:\n  - roman')
+
+        script_plan, = m.plan(self.context, [self.script('deps.script')])
+        self.assertEqual(1, len(script_plan.new_virtualenvs))
+
+    @within_temp_dir
+    def test_nothing_is_written(self):
+        self.set_up()
+        self.context.plan_cache = plan_cache.PlanCache(
+            (self.wd / 'plans').path, read_only=True)
+
+        def files():
+            return sorted(
+                os.path.join(dirpath, name)
+                for dirpath, dirnames, filenames in os.walk('.')
+                for name in dirnames + filenames)
+        before = files()
+        m.plan(
+            self.context,
+            [self.script('producer.script'), self.script('consumer.script')])
+
+        self.assertEqual(before, files())
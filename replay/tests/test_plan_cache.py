@@ -0,0 +1,131 @@
+import unittest
+from temp_dir import within_temp_dir
+import datetime
+import json
+import mock
+import os
+import time
+
+import replay.plan_cache as m
+
+
+def write(path, content, age=60):
+    with open(path, 'w') as f:
+        f.write(content)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+class Parser(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, content):
+        self.calls.append(content)
+        return [content.decode('utf8').upper()]
+
+
+class TestPlanCache(unittest.TestCase):
+
+    @within_temp_dir
+    def test_unchanged_script_is_not_parsed_again(self):
+        write('a.script', 'spec')
+        parse = Parser()
+
+        first = m.PlanCache('plans').load('a.script', parse)
+        second = m.PlanCache('plans').load('a.script', parse)
+
+        self.assertEqual(['SPEC'], first)
+        self.assertEqual(['SPEC'], second)
+        self.assertEqual(1, len(parse.calls))
+
+    @within_temp_dir
+    def test_changed_script_is_parsed_again(self):
+        write('a.script', 'spec')
+        parse = Parser()
+        m.PlanCache('plans').load('a.script', parse)
+
+        write('a.script', 'other', age=30)
+        specs = m.PlanCache('plans').load('a.script', parse)
+
+        self.assertEqual(['OTHER'], specs)
+        self.assertEqual(2, len(parse.calls))
+
+    @within_temp_dir
+    def test_touched_script_with_same_content_is_not_parsed_again(self):
+        write('a.script', 'spec')
+        parse = Parser()
+        m.PlanCache('plans').load('a.script', parse)
+
+        write('a.script', 'spec', age=30)
+        specs = m.PlanCache('plans').load('a.script', parse)
+
+        self.assertEqual(['SPEC'], specs)
+        self.assertEqual(1, len(parse.calls))
+
+    @within_temp_dir
+    def test_recently_modified_script_is_checked_by_content(self):
+        write('a.script', 'spec', age=0)
+        parse = Parser()
+        m.PlanCache('plans').load('a.script', parse)
+
+        # same size and modification time, different content
+        stat = os.stat('a.script')
+        write('a.script', 'SPEC')
+        os.utime('a.script', (stat.st_atime, stat.st_mtime))
+        specs = m.PlanCache('plans').load('a.script', parse)
+
+        self.assertEqual(['SPEC'], specs)
+        self.assertEqual(2, len(parse.calls))
+
+    @within_temp_dir
+    def test_broken_entry_is_ignored(self):
+        write('a.script', 'spec')
+        cache = m.PlanCache('plans')
+        os.makedirs('plans')
+        with open(cache._entry_path('a.script'), 'wb') as f:
+            f.write(b'not json')
+        parse = Parser()
+
+        self.assertEqual(['SPEC'], cache.load('a.script', parse))
+        self.assertEqual(1, len(parse.calls))
+
+    @within_temp_dir
+    def test_parse_error_is_not_cached(self):
+        write('a.script', 'spec')
+
+        def parse(content):
+            raise ValueError('bad spec')
+
+        with self.assertRaises(ValueError):
+            m.PlanCache('plans').load('a.script', parse)
+        self.assertEqual(
+            ['SPEC'], m.PlanCache('plans').load('a.script', Parser()))
+
+    @within_temp_dir
+    def test_entries_are_json(self):
+        write('a.script', 'spec')
+        cache = m.PlanCache('plans')
+        cache.load('a.script', Parser())
+
+        with open(cache._entry_path('a.script')) as f:
+            entry = json.load(f)
+        self.assertEqual(['SPEC'], entry['specs'])
+
+    @within_temp_dir
+    def test_specs_not_representable_in_json_are_not_cached(self):
+        write('a.script', 'spec')
+        parse = mock.Mock(return_value=[{'Execute': datetime.date.today()}])
+
+        m.PlanCache('plans').load('a.script', parse)
+        m.PlanCache('plans').load('a.script', parse)
+
+        self.assertEqual(2, parse.call_count)
+        self.assertFalse(os.path.exists('plans'))
+
+    def test_strings_are_native(self):
+        specs = [{'Execute': ['a', u'\xe9']}]
+
+        self.assertTrue(m._is_json(specs))
+        self.assertFalse(m._is_json([{1: 'a'}]))
@@ -1,17 +1,26 @@
 import unittest
 TODO = unittest.skip('not implemented yet')
-from distutils.spawn import find_executable
 
 from temp_dir import within_temp_dir
 import getpass
 import os
+import posixpath
 import externals
+from externals import Memory
+from externals import working_directory
+import mock
 
 from replay.tests import fixtures
 
+from replay import cache
+from replay import compression
+from replay import datastores
 from replay import external_process
 from replay import plugins
 from replay import exceptions
+from replay import fingerprint
+from replay import report
+from replay import staging
 
 
 class TestInputs(unittest.TestCase):
@@ -27,6 +36,37 @@ class TestInputs(unittest.TestCase):
         with self.assertRaises(exceptions.MissingInput):
             f.plugin.__enter__()
 
+    @within_temp_dir
+    def test_all_missing_inputs_are_reported(self):
+        f = fixtures.PluginContext(
+            '''\
+            Inputs:
+                - a: dir/a
+                - b: dir/b
+                - c: c
+            ''')
+        f.context.datastore = externals.working_directory() / 'datastore'
+        (f.context.datastore / 'dir/b').content = b'b'
+
+        with self.assertRaises(exceptions.MissingInput) as cm:
+            f.plugin.prepare()
+
+        self.assertEqual(('c', 'dir/a'), cm.exception.args)
+
+    @within_temp_dir
+    def test_existence_is_checked_once(self):
+        f = self.local_datastore_fixture(staging.COPY)
+
+        with mock.patch(
+                'replay.plugins.missing_datastore_paths',
+                return_value=set()) as missing_datastore_paths:
+            f.plugin.fingerprint()
+            f.plugin.prepare()
+            with f.plugin:
+                pass
+
+        self.assertEqual(1, missing_datastore_paths.call_count)
+
     @within_temp_dir
     def test_inputs_are_downloaded_from_datastore(self):
         f = fixtures.PluginContext(
@@ -42,6 +82,194 @@ class TestInputs(unittest.TestCase):
                 b'hello',
                 (externals.working_directory() / 'an input file').content)
 
+    def local_datastore_fixture(self, input_staging, check_inputs=False):
+        f = fixtures.PluginContext(
+            '''\
+            Inputs:
+                - an input file: input/datastore/path
+            ''')
+        f.context.datastore = externals.working_directory() / 'datastore'
+        f.context.input_staging = input_staging
+        f.context.check_inputs = check_inputs
+        (f.context.datastore / 'input/datastore/path').content = b'hello'
+        return f
+
+    @within_temp_dir
+    def test_compressed_inputs_are_decompressed(self):
+        f = self.local_datastore_fixture(staging.SYMLINK)
+        f.context.compression = compression.GZIP
+        outputs = list(f.context.load_plugins(
+            '''\
+            Outputs:
+                - an output file: input/datastore/path
+            '''))[0]
+        with outputs:
+            (working_directory() / 'an output file').content = b'compressed'
+
+        with f.plugin:
+            self.assertEqual(
+                b'compressed', (working_directory() / 'an input file').content)
+            self.assertFalse(os.path.islink('an input file'))
+
+    @within_temp_dir
+    def test_inputs_are_not_sniffed_without_compression(self):
+        f = self.local_datastore_fixture(staging.SYMLINK)
+
+        with mock.patch('replay.compression.codec_of') as codec_of:
+            with f.plugin:
+                self.assertTrue(os.path.islink('an input file'))
+
+        self.assertFalse(codec_of.called)
+
+    @within_temp_dir
+    def test_inputs_are_linked_from_local_datastore(self):
+        f = self.local_datastore_fixture(staging.HARDLINK)
+
+        with f.plugin:
+            self.assertTrue(
+                os.path.samefile(
+                    'an input file',
+                    'datastore/input/datastore/path'))
+
+    @within_temp_dir
+    def test_inputs_are_copied_by_default(self):
+        f = self.local_datastore_fixture(staging.COPY)
+
+        with f.plugin:
+            self.assertFalse(
+                os.path.samefile(
+                    'an input file',
+                    'datastore/input/datastore/path'))
+            self.assertEqual(
+                b'hello',
+                (externals.working_directory() / 'an input file').content)
+
+    @within_temp_dir
+    def test_modified_input_is_error(self):
+        f = self.local_datastore_fixture(staging.HARDLINK, check_inputs=True)
+
+        with self.assertRaises(exceptions.ModifiedInput):
+            with f.plugin:
+                with open('an input file', 'ab') as input_file:
+                    input_file.write(b' world')
+
+    @within_temp_dir
+    def test_input_modified_through_symlink_is_error(self):
+        f = self.local_datastore_fixture(staging.SYMLINK, check_inputs=True)
+
+        with self.assertRaises(exceptions.ModifiedInput):
+            with f.plugin:
+                self.assertTrue(os.path.islink('an input file'))
+                with open('an input file', 'ab') as input_file:
+                    input_file.write(b' world')
+
+    @within_temp_dir
+    def test_removed_input_is_error(self):
+        f = self.local_datastore_fixture(staging.COPY, check_inputs=True)
+
+        with self.assertRaises(exceptions.ModifiedInput):
+            with f.plugin:
+                os.remove('datastore/input/datastore/path')
+
+    @within_temp_dir
+    def test_unmodified_input_is_not_error(self):
+        f = self.local_datastore_fixture(staging.HARDLINK, check_inputs=True)
+
+        with f.plugin:
+            pass
+
+    def pattern_fixture(self, spec, input_staging=staging.COPY):
+        f = fixtures.PluginContext(
+            '''\
+            Inputs:
+                - ''' + spec)
+        f.context.datastore = externals.working_directory() / 'datastore'
+        f.context.input_staging = input_staging
+        for path in ('d/1.csv', 'd/2.csv', 'd/x/3.csv', 'd/4.txt'):
+            (f.context.datastore / path).content = path.encode('ascii')
+        return f
+
+    @within_temp_dir
+    def test_glob_input(self):
+        f = self.pattern_fixture('days: d/*.csv')
+
+        with f.plugin:
+            self.assertEqual(
+                ['1.csv', '2.csv'], sorted(os.listdir('days')))
+            self.assertEqual(
+                b'd/1.csv',
+                (externals.working_directory() / 'days/1.csv').content)
+
+    @within_temp_dir
+    def test_directory_input_is_staged_file_by_file(self):
+        f = self.pattern_fixture('days: d/', staging.SYMLINK)
+
+        with f.plugin:
+            self.assertFalse(os.path.islink('days'))
+            self.assertFalse(os.path.islink('days/x'))
+            self.assertTrue(os.path.islink('days/x/3.csv'))
+            self.assertEqual(
+                b'd/x/3.csv',
+                (externals.working_directory() / 'days/x/3.csv').content)
+            (externals.working_directory() / 'days/new.csv').content = b'new'
+
+        self.assertFalse(os.path.exists('datastore/d/new.csv'))
+
+    @within_temp_dir
+    def test_directory_input_is_copied_by_default(self):
+        f = self.pattern_fixture('days: d/')
+
+        with f.plugin:
+            self.assertFalse(os.path.islink('days'))
+            self.assertEqual(
+                b'd/x/3.csv',
+                (externals.working_directory() / 'days/x/3.csv').content)
+
+    @within_temp_dir
+    def test_pattern_without_match_is_missing(self):
+        f = self.pattern_fixture('days: d/*.json')
+
+        with self.assertRaises(exceptions.MissingInput) as cm:
+            f.plugin.prepare()
+
+        self.assertEqual(('d/*.json',), cm.exception.args)
+
+    @within_temp_dir
+    def test_files_matching_a_pattern_are_fingerprinted(self):
+        f = self.pattern_fixture('days: d/*.csv')
+        fingerprint_ = f.plugin.fingerprint()
+
+        (f.context.datastore / 'd/3.csv').content = b''
+
+        f = self.pattern_fixture('days: d/*.csv')
+        self.assertNotEqual(fingerprint_, f.plugin.fingerprint())
+
+    @within_temp_dir
+    def test_input_digests_are_in_the_report(self):
+        f = self.local_datastore_fixture(staging.COPY)
+        f.context.report = report.RunReport('script')
+
+        with f.plugin:
+            pass
+
+        path = (f.context.datastore / 'input/datastore/path').path
+        self.assertEqual(
+            dict(
+                algorithm=fingerprint.ALGORITHM,
+                inputs={'input/datastore/path': fingerprint.hash_file(path)},
+                outputs={}),
+            f.context.report.manifest)
+
+    @within_temp_dir
+    def test_fingerprint_uses_the_hash_cache(self):
+        f = self.local_datastore_fixture(staging.COPY)
+        path = (f.context.datastore / 'input/datastore/path').path
+        f.context.hash_cache = mock.Mock()
+        f.context.hash_cache.digests.return_value = {path: 'cached'}
+
+        self.assertEqual(
+            ['Inputs', 'an input file', 'cached'], f.plugin.fingerprint())
+
 
 class TestOutputs(unittest.TestCase):
 
@@ -62,6 +290,134 @@ class TestOutputs(unittest.TestCase):
             b'data',
             (f.datastore / 'output/datastore/path').content)
 
+    @within_temp_dir
+    def test_outputs_are_uploaded_to_local_datastore(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - output1: output/1
+                - output2: output/2
+            ''')
+        f.context.datastore = externals.working_directory() / 'datastore'
+
+        with f.plugin:
+            (externals.working_directory() / 'output1').content = b'1'
+            (externals.working_directory() / 'output2').content = b'2'
+
+        self.assertEqual(b'1', (f.context.datastore / 'output/1').content)
+        self.assertEqual(b'2', (f.context.datastore / 'output/2').content)
+        self.assertEqual(
+            [],
+            os.listdir(
+                (
+                    f.context.datastore / plugins.DATASTORE_STAGING_DIRECTORY
+                ).path))
+
+    @within_temp_dir
+    def test_outputs_are_compressed(self):
+        for datastore in (Memory(), working_directory() / 'datastore'):
+            f = fixtures.PluginContext(
+                '''\
+                Outputs:
+                    - output: output/path
+                ''')
+            f.context.datastore = datastore
+            f.context.compression = compression.GZIP
+
+            with f.plugin:
+                (working_directory() / 'output').content = b'data' * 100
+
+            content = (datastore / 'output/path').content
+            self.assertEqual(
+                compression.GZIP,
+                compression.detect(content[:compression.HEADER_SIZE]))
+            self.assertLess(len(content), 100)
+
+    @within_temp_dir
+    def test_outputs_are_hashed_once_for_report_and_cache(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - output: output/path
+            ''')
+        f.context.datastore = working_directory() / 'datastore'
+        f.context.report = report.RunReport('script')
+        f.context.output_cache = cache.OutputCache(
+            (working_directory() / 'cache').path)
+        f.context.run_fingerprint = 'run'
+
+        with mock.patch(
+                'replay.fingerprint.hash_files',
+                side_effect=fingerprint.hash_files) as hash_files:
+            with f.plugin:
+                (working_directory() / 'output').content = b'data'
+
+        self.assertEqual(1, hash_files.call_count)
+        digest = fingerprint.hash_file('output')
+        self.assertEqual(
+            {'output/path': digest}, f.context.report.manifest['outputs'])
+        self.assertEqual(
+            {'output': digest}, f.context.output_cache.lookup('run'))
+
+    @within_temp_dir
+    def test_pattern_outputs(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - out/*.csv: results/
+            ''')
+
+        with f.plugin:
+            for name in ('a.csv', 'b.csv', 'c.txt'):
+                (externals.working_directory() / 'out' / name).content = b'x'
+
+        self.assertEqual(['results/*.csv'], list(f.plugin.datastore_paths()))
+        self.assertTrue((f.datastore / 'results/a.csv').exists())
+        self.assertTrue((f.datastore / 'results/b.csv').exists())
+        self.assertFalse((f.datastore / 'results/c.txt').exists())
+
+    @within_temp_dir
+    def test_pattern_without_output_is_missing(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - out/: results/
+            ''')
+
+        with self.assertRaises(exceptions.MissingOutput) as cm:
+            with f.plugin:
+                pass
+
+        self.assertEqual(('out/',), cm.exception.args)
+
+    def test_patterns_are_expanded_against_given_names(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - out/: results/
+                - plain: plain
+            ''')
+
+        self.assertEqual(
+            [('out/x/a', 'results/x/a'), ('plain', 'plain')],
+            f.plugin.output_names(['out/x/a', 'other', 'plain']))
+
+    @within_temp_dir
+    def test_output_digests_are_in_the_report(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - output: output/path
+            ''')
+        f.context.report = report.RunReport('script')
+
+        with f.plugin:
+            (externals.working_directory() / 'output').content = b'data'
+
+        self.assertEqual(
+            {'output/path': fingerprint.hash_file('output')},
+            f.context.report.manifest['outputs'])
+
     @within_temp_dir
     def test_output_file_missing_is_error(self):
         f = fixtures.PluginContext(
@@ -74,6 +430,77 @@ class TestOutputs(unittest.TestCase):
             with f.plugin:
                 pass
 
+    @within_temp_dir
+    def test_all_missing_outputs_are_reported(self):
+        f = fixtures.PluginContext(
+            '''\
+            Outputs:
+                - dir/a: a
+                - dir/b: b
+                - ./c: c
+            ''')
+
+        with self.assertRaises(exceptions.MissingOutput) as cm:
+            with f.plugin:
+                (externals.working_directory() / 'dir/b').content = b'b'
+
+        self.assertEqual(('c', 'dir/a'), cm.exception.args)
+
+
+class Test_missing_datastore_paths(unittest.TestCase):
+
+    @within_temp_dir
+    def test_local_datastore(self):
+        datastore = externals.working_directory()
+        (datastore / 'a/x').content = b''
+        (datastore / 'y').content = b''
+
+        self.assertEqual(
+            set(['a/z', 'b/x', 'z']),
+            plugins.missing_datastore_paths(
+                datastore, ['a/x', 'a/z', 'b/x', 'y', 'z']))
+
+    def test_other_datastore(self):
+        datastore = externals.Memory()
+        (datastore / 'a/x').content = b''
+
+        self.assertEqual(
+            set(['a/z']),
+            plugins.missing_datastore_paths(datastore, ['a/x', 'a/z']))
+
+
+class TestRemoteDatastore(unittest.TestCase):
+
+    @within_temp_dir
+    def test_inputs_and_outputs(self):
+        with fixtures.ObjectStore() as store:
+            f = fixtures.PluginContext()
+            f.context.datastore = datastores.open_datastore(store.url)
+            f.context.check_inputs = True
+            (f.context.datastore / 'in/a').content = b'content'
+            inputs = plugins.Inputs(f.context, [{'data/a': 'in/a'}])
+            outputs = plugins.Outputs(f.context, [{'b': 'out/b'}])
+
+            with inputs:
+                with outputs:
+                    with open('data/a', 'rb') as a:
+                        with open('b', 'wb') as b:
+                            b.write(a.read())
+
+            self.assertEqual(b'content', store.objects['out/b'])
+
+    @within_temp_dir
+    def test_modified_input_detected(self):
+        with fixtures.ObjectStore() as store:
+            f = fixtures.PluginContext()
+            f.context.datastore = datastores.open_datastore(store.url)
+            f.context.check_inputs = True
+            (f.context.datastore / 'a').content = b'content'
+
+            with self.assertRaises(exceptions.ModifiedInput):
+                with plugins.Inputs(f.context, [{'a': 'a'}]):
+                    (f.context.datastore / 'a').content = b'modified'
+
 
 class TestWorkingDirectory(unittest.TestCase):
 
@@ -126,9 +553,110 @@ class TestCopyScript(unittest.TestCase):
         with plugins.CopyScript(fixtures.FIXTURES_DIR):
             self.assertTrue(os.path.exists(DEFAULT_FIXTURE_KNOWN_FILE))
 
+    def make_script_dir(self):
+        script_dir = externals.working_directory() / 'script'
+        (script_dir / 'script.py').content = b'print(1)'
+        (script_dir / 'data/sample.csv').content = b'1,2'
+        (script_dir / '.git/HEAD').content = b'ref'
+        (script_dir / '.replayignore').content = b'data/'
+        os.symlink('script.py', (script_dir / 'link.py').path)
+        os.mkdir('run')
+        return script_dir.path
+
+    @within_temp_dir
+    def test_ignored_files_are_not_copied(self):
+        script_dir = self.make_script_dir()
+
+        os.chdir('run')
+        with plugins.CopyScript(script_dir):
+            self.assertTrue(os.path.exists('script.py'))
+            self.assertFalse(os.path.exists('data'))
+            self.assertFalse(os.path.exists('.git'))
+
+    @within_temp_dir
+    def test_symlinks_are_copied_as_links(self):
+        script_dir = self.make_script_dir()
+
+        os.chdir('run')
+        with plugins.CopyScript(script_dir):
+            self.assertEqual('script.py', os.readlink('link.py'))
+
+    @within_temp_dir
+    def test_links_outside_the_script_directory_are_copied(self):
+        script_dir = self.make_script_dir()
+        (externals.working_directory() / 'common/lib.py').content = b'lib'
+        os.symlink(
+            '../common/lib.py', os.path.join(script_dir, 'lib.py'))
+
+        os.chdir('run')
+        with plugins.CopyScript(script_dir):
+            self.assertFalse(os.path.islink('lib.py'))
+            self.assertEqual(
+                b'lib', (externals.working_directory() / 'lib.py').content)
+
+    @within_temp_dir
+    def test_hardlinked_script_files(self):
+        script_dir = self.make_script_dir()
+
+        os.chdir('run')
+        with plugins.CopyScript(script_dir, strategy=staging.HARDLINK):
+            self.assertEqual(
+                os.stat(os.path.join(script_dir, 'script.py')).st_ino,
+                os.stat('script.py').st_ino)
+
+
+class TestCopyScriptAndInputs(unittest.TestCase):
+
+    @within_temp_dir
+    def test_inputs_are_staged_into_copied_directories(self):
+        script_dir = externals.working_directory() / 'script'
+        (script_dir / 'script.py').content = b'print(1)'
+        (script_dir / 'data/input.csv').content = b'script'
+        (script_dir / 'data/other.csv').content = b'other'
+        # copied before data/, while the inputs are staged
+        for i in range(200):
+            (script_dir / 'a/{}.py'.format(i)).content = b''
+        f = fixtures.PluginContext()
+        f.context.datastore = externals.working_directory() / 'datastore'
+        (f.context.datastore / 'd/input.csv').content = b'input'
+        seen = []
+
+        class Check(plugins.Plugin):
+
+            def __enter__(self):
+                seen.append((
+                    sorted(os.listdir('data')),
+                    (working_directory() / 'data/input.csv').content))
+
+            def __exit__(self, *exc_info):
+                pass
+
+        for _ in range(5):
+            f.context.run(
+                [plugins.TemporaryDirectory(f.context),
+                 plugins.CopyScript(script_dir.path)]
+                + list(f.context.load_plugins(
+                    '''\
+                    Inputs:
+                        - data/input.csv: d/input.csv
+                    '''))
+                + [Check(context=None, script=None)])
+
+        self.assertEqual(
+            [(['input.csv', 'other.csv'], b'input')] * 5, seen)
+
 
 class TestPythonDependencies(unittest.TestCase):
 
+    def test_local_requirements_wait_for_the_script_copy(self):
+        f = fixtures.PluginContext()
+
+        local = plugins.PythonDependencies(f.context, ['./libs/pkg'])
+        remote = plugins.PythonDependencies(f.context, ['roman'])
+
+        self.assertIn(plugins.SCRIPT_COPIED, local.requires)
+        self.assertEqual(frozenset(), remote.requires)
+
     @within_temp_dir
     def test_virtualenv_is_created_in_context_specified_dir(self):
         f = fixtures.PluginContext(
@@ -205,6 +733,99 @@ class TestPythonDependencies(unittest.TestCase):
         # if result.status: print(result)
         self.assertEqual(b'XXIII', result.stdout.rstrip())
 
+    @within_temp_dir
+    def test_packages_are_installed_from_wheelhouse(self):
+        f1 = fixtures.PluginContext(
+            '''\
+            PythonDependencies:
+                - roman==2.0.0
+            ''')
+        wheelhouse = externals.working_directory() / 'wheelhouse'
+        f1.context.wheelhouse = wheelhouse.path
+        with f1.plugin:
+            pass
+        self.assertTrue(
+            any(wheel.name.startswith('roman-2.0.0')
+                for wheel in wheelhouse.children()))
+
+        # a different virtualenv, without access to the package index
+        f2 = fixtures.PluginContext(
+            '''\
+            PythonDependencies:
+                - roman
+            ''')
+        f2.context.wheelhouse = wheelhouse.path
+        f2.context.index_server_url = 'file:/nonexistent/index'
+        with f2.plugin:
+            python = f2.plugin.virtualenv_dir / 'bin/python'
+
+        result = external_process.run(
+            [python.path, '-c', 'import roman; print(roman.toRoman(23))'])
+        self.assertEqual(b'XXIII', result.stdout.rstrip())
+
+    @within_temp_dir
+    def test_virtualenv_is_layered_on_one_with_subset_of_packages(self):
+        base = fixtures.PluginContext(
+            '''\
+            PythonDependencies:
+                - roman==2.0.0
+            ''')
+        with base.plugin:
+            pass
+        f = fixtures.PluginContext(
+            '''\
+            PythonDependencies:
+                - roman==2.0.0
+                - some_package
+            ''')
+
+        install = mock.patch.object(
+            plugins.PythonDependencies, '_install_packages')
+        with install as _install_packages:
+            with f.plugin:
+                python = f.plugin.virtualenv_dir / 'bin/python'
+
+        _install_packages.assert_called_once_with(
+            ['some_package'], f.context.index_server_url)
+        self.assertEqual(
+            base.plugin.virtualenv_name, f.plugin.virtualenv.base)
+        result = external_process.run(
+            [python.path, '-c', 'import roman; print(roman.toRoman(23))'])
+        self.assertEqual(b'XXIII', result.stdout.rstrip())
+
+    @within_temp_dir
+    def test_incomplete_virtualenv_is_rebuilt(self):
+        f = fixtures.PluginContext(
+            '''\
+            PythonDependencies:
+            ''')
+        (f.plugin.virtualenv_dir / 'partial').content = b''
+
+        with f.plugin:
+            pass
+
+        self.assertFalse((f.plugin.virtualenv_dir / 'partial').exists())
+        self.assertTrue(
+            (f.plugin.virtualenv_dir / f.plugin.COMPLETE_MARKER).exists())
+
+    @within_temp_dir
+    def test_virtualenv_creation_failure_is_an_error(self):
+        f = fixtures.PluginContext(
+            '''\
+            PythonDependencies:
+            ''')
+        failure = external_process.Result(
+            cmdspec=('virtualenv',), status=1, stdout=b'', stderr=b'')
+        orig_path = os.environ.get('PATH')
+
+        with mock.patch.object(external_process, 'run', return_value=failure):
+            with self.assertRaises(exceptions.MissingPythonDependency):
+                f.plugin.__enter__()
+
+        self.assertFalse(
+            (f.plugin.virtualenv_dir / f.plugin.COMPLETE_MARKER).exists())
+        self.assertEqual(orig_path, os.environ.get('PATH'))
+
 
 class Test_PythonDependencies_virtualenv_name(unittest.TestCase):
 
@@ -251,7 +872,7 @@ class Test_PythonDependencies_virtualenv_name(unittest.TestCase):
         self.assertEqual('_replay_e8a8bbe2f9fd4e9286aeedab2a5009e2', ve_name1)
 
 
-POSTGRES_IS_AVAILABLE = find_executable('psql')
+POSTGRES_IS_AVAILABLE = external_process.find_executable('psql')
 
 
 @unittest.skipUnless(
@@ -344,6 +965,175 @@ class TestPostgres(unittest.TestCase):
             external_process.run(['dropdb', f.plugin.database])
 
 
+class TestPostgresPool(unittest.TestCase):
+
+    def fixture(self):
+        f = fixtures.PluginContext(
+            '''\
+            Postgres:
+                template: seeded
+                template version: 1
+                pool size: 1
+            ''')
+        return f
+
+    def result(self, stdout=b'', status=0):
+        return external_process.Result(
+            cmdspec=(), status=status, stdout=stdout, stderr=b'')
+
+    def test_pooled_database_is_renamed_instead_of_created(self):
+        plugin = self.fixture().plugin
+        pool_database = plugin.pool_prefix + '1'
+        results = [self.result(pool_database.encode('utf8')), self.result()]
+
+        with mock.patch.object(
+                external_process, 'run', side_effect=results) as run:
+            plugin.__enter__()
+        plugin.PGDATABASE.restore()
+
+        commands = [call[0][0] for call in run.call_args_list]
+        self.assertNotIn('createdb', [command[0] for command in commands])
+        self.assertIn(
+            'ALTER DATABASE "{}" RENAME TO "{}"'.format(
+                pool_database, plugin.database),
+            commands[1][-1])
+
+    def test_pool_is_keyed_by_template_version(self):
+        plugin1 = self.fixture().plugin
+        plugin2 = self.fixture().plugin
+        plugin2.template_version = 2
+
+        with mock.patch.object(external_process, 'run') as run:
+            prefix1 = plugin1.pool_prefix
+            prefix2 = plugin2.pool_prefix
+
+        self.assertNotEqual(prefix1, prefix2)
+        self.assertTrue(prefix1.startswith(plugin1.template_prefix))
+        self.assertTrue(prefix2.startswith(plugin1.template_prefix))
+        # the template is not read
+        self.assertFalse(run.called)
+
+    def test_failed_refill_does_not_fail_the_run(self):
+        plugin = self.fixture().plugin
+        # list pool, createdb, dropdb, list stale, list pool, createdb
+        results = [self.result()] * 5 + [self.result(status=1)]
+
+        with mock.patch.object(
+                external_process, 'run', side_effect=results) as run:
+            with plugin:
+                pass
+
+        self.assertEqual('createdb', run.call_args_list[-1][0][0][0])
+
+    def test_stale_pool_databases_are_dropped(self):
+        plugin = self.fixture().plugin
+        stale = plugin.template_prefix + 'old_1'
+        current = plugin.pool_prefix + '1'
+        listing = (stale + '\n' + current).encode('utf8')
+        results = [
+            self.result(listing), self.result(), self.result(current)]
+
+        with mock.patch.object(
+                external_process, 'run', side_effect=results) as run:
+            plugin.fill_pool()
+
+        self.assertEqual(
+            ['dropdb', stale], run.call_args_list[1][0][0])
+        self.assertEqual(3, run.call_count)
+
+    def test_database_is_created_from_template_if_pool_is_empty(self):
+        plugin = self.fixture().plugin
+        results = [self.result(), self.result()]
+
+        with mock.patch.object(
+                external_process, 'run', side_effect=results) as run:
+            plugin.__enter__()
+        plugin.PGDATABASE.restore()
+
+        self.assertEqual(
+            ['createdb', '--template=seeded', plugin.database],
+            run.call_args_list[-1][0][0])
+
+
+@unittest.skipUnless(
+    fixtures.LocalPostgres.is_available(),
+    'PostgreSQL server tools not available'
+)
+class TestPostgresTemplate(unittest.TestCase):
+
+    TEMPLATE = 'replay_test_template'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.postgres = fixtures.LocalPostgres()
+        cls.postgres.__enter__()
+        psql = ['psql', '--no-psqlrc', '--tuples-only', '--no-align']
+        cls.psql = psql
+        external_process.run(['createdb', cls.TEMPLATE])
+        external_process.run(
+            psql + ['--dbname=' + cls.TEMPLATE,
+                    '--command=CREATE TABLE seed (x int)'])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.postgres.__exit__(None, None, None)
+
+    def tearDown(self):
+        for database in self.fixture().plugin.pool_databases():
+            external_process.run(['dropdb', database])
+
+    def fixture(self, pool_size=0):
+        return fixtures.PluginContext(
+            '''\
+            Postgres:
+                script name: template
+                template: {}
+                pool size: {}
+            '''.format(self.TEMPLATE, pool_size))
+
+    def check_seed_table_exists(self):
+        result = external_process.run(
+            self.psql + ['--command=SELECT count(*) FROM seed'])
+        self.assertEqual(0, result.status, str(result))
+
+    def test_database_is_created_from_template(self):
+        with self.fixture().plugin:
+            self.check_seed_table_exists()
+
+    def test_pool_is_filled_after_run(self):
+        plugin = self.fixture(pool_size=2).plugin
+
+        with plugin:
+            pass
+
+        self.assertEqual(2, len(plugin.pool_databases()))
+
+    def test_database_is_claimed_from_pool(self):
+        self.fixture(pool_size=1).plugin.fill_pool()
+        plugin = self.fixture(pool_size=1).plugin
+        pool_databases = plugin.pool_databases()
+
+        with plugin:
+            self.check_seed_table_exists()
+            self.assertEqual([], plugin.pool_databases())
+
+        self.assertEqual(1, len(plugin.pool_databases()))
+        self.assertNotEqual(pool_databases, plugin.pool_databases())
+
+    def test_missing_template_is_an_error(self):
+        f = fixtures.PluginContext(
+            '''\
+            Postgres:
+                template: replay_test_no_such_template
+            ''')
+        orig_environ = os.environ.copy()
+
+        with self.assertRaises(exceptions.DatabaseError):
+            f.plugin.__enter__()
+
+        self.assertDictEqual(orig_environ, os.environ.copy())
+
+
 class Test_EnvironKeyState(unittest.TestCase):
 
     def test_nonexistent_key(self):
@@ -442,3 +1232,104 @@ class TestExecute(unittest.TestCase):
         self.assertEqual(
             b'hello from /bin/sh',
             (wd / 'output').content.rstrip())
+
+    @within_temp_dir
+    def test_timeout(self):
+        f = fixtures.PluginContext(
+            '''\
+            Execute: sleep 10
+            timeout: 0.2
+            ''')
+
+        with self.assertRaises(exceptions.Timeout):
+            f.context.run([f.plugin])
+
+    @within_temp_dir
+    def test_output_is_saved_to_log_file(self):
+        wd = externals.working_directory()
+
+        f = fixtures.PluginContext(
+            u'''\
+            Execute:
+                echo hello stdout; echo hello stderr >&2
+            ''')
+
+        f.context.log_directory = (wd / 'logs').path
+
+        with f.plugin:
+            pass
+
+        self.assertEqual(
+            b'hello stdout',
+            (wd / 'logs' / plugins.Execute.STDOUT_LOG).content.rstrip())
+        self.assertEqual(
+            b'hello stderr',
+            (wd / 'logs' / plugins.Execute.STDERR_LOG).content.rstrip())
+
+    @within_temp_dir
+    def test_logs_are_kept_after_the_run(self):
+        f = fixtures.PluginContext(
+            u'''\
+            Execute:
+                echo failed >&2; exit 1
+            ''')
+        f.context.report = report.RunReport('script')
+        temporary_directory = plugins.TemporaryDirectory(f.context)
+
+        with mock.patch('tempfile.tempdir', os.getcwd()):
+            with self.assertRaises(exceptions.ScriptError) as cm:
+                f.context.run([temporary_directory, f.plugin])
+
+        key = posixpath.join(
+            plugins.LOGS_DIRECTORY, f.context.report.script_id,
+            f.context.report.run_id, plugins.Execute.STDERR_LOG)
+        self.assertEqual(b'failed', (f.datastore / key).content.rstrip())
+        self.assertTrue(cm.exception.args[0].stderr_log.endswith(key))
+        self.assertFalse(
+            [name for name in os.listdir('.')
+             if name.startswith('replay-logs-')])
+
+    @within_temp_dir
+    def test_limits(self):
+        f = fixtures.PluginContext(
+            '''\
+            Execute:
+                script: ulimit -n > output
+                open files: 64
+                memory: 1G
+            ''')
+        f.context.report = report.RunReport('script')
+
+        f.context.run([f.plugin])
+
+        self.assertEqual(
+            b'64', (externals.working_directory() / 'output').content.strip())
+        process, = f.context.report.processes
+        self.assertEqual(
+            {'open files': 64, 'memory': 1024 ** 3}, process['limits'])
+
+    def test_limits_do_not_change_fingerprint(self):
+        f = fixtures.PluginContext()
+        plain, = f.context.load_plugins('Execute: run')
+        limited, = f.context.load_plugins(
+            '''\
+            Execute:
+                script: run
+                cpus: 2
+                nice: 10
+            ''')
+
+        self.assertEqual(plain.fingerprint(), limited.fingerprint())
+
+    def test_invalid_limits(self):
+        f = fixtures.PluginContext()
+        for spec in (
+                'Execute: {cpus: 2}',
+                'Execute: {script: run, cpus: 0}',
+                'Execute: {script: run, cpus: [a]}',
+                'Execute: {script: run, memory: lots}',
+                'Execute: {script: run, nice: 20}',
+                'Execute: {script: run, io priority: 8}',
+                'Execute: {script: run, threads: 2}'):
+            with self.assertRaises(ValueError):
+                list(f.context.load_plugins(spec))
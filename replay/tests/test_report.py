@@ -0,0 +1,86 @@
+import unittest
+from externals import Memory
+import json
+
+import replay.report as m
+from replay import external_process
+
+
+class Plugin(object):
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def __enter__(self):
+        if self.error:
+            raise self.error
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class TestRunReport(unittest.TestCase):
+
+    def test_timed_plugin_phases(self):
+        report = m.RunReport('script')
+
+        with report.timed(Plugin()):
+            pass
+
+        self.assertEqual(
+            [('Plugin', m.SETUP), ('Plugin', m.TEARDOWN)],
+            [(phase['plugin'], phase['phase']) for phase in report.phases])
+
+    def test_failed_setup_is_timed(self):
+        report = m.RunReport('script')
+
+        with self.assertRaises(ValueError):
+            with report.timed(Plugin(ValueError())):
+                pass
+
+        self.assertEqual([m.SETUP], [p['phase'] for p in report.phases])
+
+    def test_script_id_tells_apart_scripts_of_the_same_name(self):
+        report1 = m.RunReport('run', '/a/run.yaml')
+        report2 = m.RunReport('run', '/b/run.yaml')
+
+        self.assertEqual('script', m.RunReport('script').script_id)
+        self.assertTrue(report1.script_id.startswith('run-'))
+        self.assertNotEqual(report1.script_id, report2.script_id)
+
+    def test_process(self):
+        report = m.RunReport('script')
+
+        report.add_process(external_process.run(['/bin/sh', '-c', 'true']))
+
+        process, = report.processes
+        self.assertEqual(0, process['status'])
+        self.assertIn('max rss', process)
+        self.assertIn('user time', process)
+
+    def test_process_limits(self):
+        report = m.RunReport('script')
+
+        report.add_process(
+            external_process.run(
+                ['/bin/sh', '-c', 'true'],
+                limits=external_process.Limits(open_files=64)))
+
+        process, = report.processes
+        self.assertEqual({'open files': 64}, process['limits'])
+
+    def test_write(self):
+        datastore = Memory()
+        report = m.RunReport('script')
+        report.bytes_staged = 3
+        report.finish(m.SUCCEEDED)
+
+        written = report.write(datastore)
+
+        record = json.loads(written.content.decode('utf8'))
+        self.assertEqual('script', record['script'])
+        self.assertEqual(m.SUCCEEDED, record['status'])
+        self.assertEqual(3, record['bytes staged'])
+        self.assertLessEqual(0, record['wall time'])
+        self.assertTrue(
+            (datastore / m.REPORTS_DIRECTORY / 'script').is_dir())
@@ -0,0 +1,119 @@
+import unittest
+from temp_dir import within_temp_dir
+import os
+import mock
+
+from replay import staging as m
+
+
+def write(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class Test_stage(unittest.TestCase):
+
+    @within_temp_dir
+    def test_copy(self):
+        write('source', b'content')
+
+        self.assertEqual(m.COPY, m.stage('source', 'dir/destination'))
+
+        self.assertEqual(b'content', read('dir/destination'))
+        self.assertFalse(os.path.samefile('source', 'dir/destination'))
+
+    @within_temp_dir
+    def test_hardlink(self):
+        write('source', b'content')
+
+        self.assertEqual(
+            m.HARDLINK, m.stage('source', 'destination', m.HARDLINK))
+
+        self.assertTrue(os.path.samefile('source', 'destination'))
+
+    @within_temp_dir
+    def test_symlink(self):
+        write('source', b'content')
+
+        self.assertEqual(
+            m.SYMLINK, m.stage('source', 'destination', m.SYMLINK))
+
+        self.assertTrue(os.path.islink('destination'))
+        self.assertEqual(b'content', read('destination'))
+
+    @within_temp_dir
+    def test_existing_destination_is_replaced_not_overwritten(self):
+        write('source', b'new')
+        write('old', b'old')
+        os.link('old', 'destination')
+
+        m.stage('source', 'destination')
+
+        self.assertEqual(b'new', read('destination'))
+        self.assertEqual(b'old', read('old'))
+
+    @within_temp_dir
+    def test_unsupported_strategy_falls_back(self):
+        write('source', b'content')
+
+        def unsupported(source, destination):
+            raise OSError(m.errno.EXDEV, 'cross-device link')
+
+        with mock.patch.dict(m._IMPLEMENTATIONS, hardlink=unsupported):
+            strategy = m.stage(
+                'source', 'destination', (m.HARDLINK, m.COPY))
+
+        self.assertEqual(m.COPY, strategy)
+        self.assertEqual(b'content', read('destination'))
+
+    def test_unknown_strategy_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            m.stage('source', 'destination', 'teleport')
+
+
+class Test_publish(unittest.TestCase):
+
+    @within_temp_dir
+    def test_files_are_put_in_place(self):
+        write('a', b'a')
+        write('b', b'b')
+        os.mkdir('destination')
+        write('destination/b', b'old b')
+
+        m.publish(
+            [('a', 'destination/x/a'), ('b', 'destination/b')],
+            'staging',
+            threads=2)
+
+        self.assertEqual(b'a', read('destination/x/a'))
+        self.assertEqual(b'b', read('destination/b'))
+        self.assertFalse(os.path.exists('staging'))
+
+    @within_temp_dir
+    def test_no_file_is_put_in_place_on_error(self):
+        write('a', b'a')
+
+        with self.assertRaises(EnvironmentError):
+            m.publish(
+                [('a', 'destination/a'), ('missing', 'destination/b')],
+                'staging')
+
+        self.assertFalse(os.path.exists('destination/a'))
+        self.assertFalse(os.path.exists('staging'))
+
+    @within_temp_dir
+    def test_put(self):
+        write('a', b'a')
+
+        def put(source, path):
+            write(path, read(source).upper())
+
+        m.publish([('a', 'destination/a')], 'staging', put=put)
+
+        self.assertEqual(b'A', read('destination/a'))
+        self.assertFalse(os.path.exists('staging'))
@@ -0,0 +1,145 @@
+import unittest
+from temp_dir import within_temp_dir
+import mock
+import os
+import time
+
+import replay.trash as m
+
+
+def wait_until_removed(path, timeout=10):
+    deadline = time.time() + timeout
+    while os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def make_tree(path):
+    os.makedirs(os.path.join(path, 'sub'))
+    with open(os.path.join(path, 'sub', 'file'), 'w') as f:
+        f.write('content')
+
+
+class Test_discard(unittest.TestCase):
+
+    @within_temp_dir
+    def test_directory_is_moved_to_trash_immediately(self):
+        make_tree('work')
+        with mock.patch.object(m, '_remove_in_background') as remove:
+            m.discard('work')
+
+        self.assertFalse(os.path.exists('work'))
+        (trashed,), _ = remove.call_args
+        self.assertEqual(os.path.abspath(m.TRASH), os.path.dirname(trashed))
+        self.assertTrue(
+            os.path.exists(os.path.join(trashed, 'sub', 'file')))
+
+    @within_temp_dir
+    def test_trash_is_removed_in_background(self):
+        make_tree('work')
+        m.discard('work')
+
+        trash = os.path.abspath(m.TRASH)
+        for name in os.listdir(trash):
+            wait_until_removed(os.path.join(trash, name))
+        self.assertEqual([], os.listdir(trash))
+
+    @within_temp_dir
+    def test_trash_is_private_to_the_user(self):
+        make_tree('work')
+        with mock.patch.object(m, '_remove_in_background'):
+            m.discard('work')
+
+        self.assertIn(str(os.getuid()), m.TRASH)
+        self.assertEqual(0o700, os.stat(m.TRASH).st_mode & 0o777)
+
+    @within_temp_dir
+    def test_trash_of_another_user_is_not_used(self):
+        make_tree('work')
+        os.mkdir(m.TRASH)
+        with mock.patch.object(m.os, 'getuid', return_value=os.getuid() + 1):
+            with mock.patch.object(m, '_remove_in_background') as remove:
+                m.discard('work')
+
+        self.assertFalse(os.path.exists('work'))
+        self.assertFalse(remove.called)
+        self.assertEqual([], os.listdir(m.TRASH))
+
+    @within_temp_dir
+    def test_removed_right_away_when_rename_fails(self):
+        make_tree('work')
+        with mock.patch.object(m.os, 'rename', side_effect=OSError(18, '')):
+            with mock.patch.object(m, '_remove_in_background') as remove:
+                m.discard('work')
+
+        self.assertFalse(os.path.exists('work'))
+        self.assertFalse(remove.called)
+
+
+class Test_reap(unittest.TestCase):
+
+    @within_temp_dir
+    def test_old_trash_reaped(self):
+        os.makedirs(m.TRASH)
+        old = os.path.join(
+            m.TRASH, '{:.0f}-1-x'.format(time.time() - m.REAP_AGE - 1))
+        new = os.path.join(m.TRASH, '{:.0f}-1-y'.format(time.time()))
+        make_tree(old)
+        make_tree(new)
+
+        reaped = m.reap(os.getcwd())
+        wait_until_removed(old)
+
+        self.assertEqual([os.path.join(os.getcwd(), old)], reaped)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+    @within_temp_dir
+    def test_trash_of_another_user_is_not_reaped(self):
+        os.makedirs(m.TRASH)
+        old = os.path.join(
+            m.TRASH, '{:.0f}-1-x'.format(time.time() - m.REAP_AGE - 1))
+        make_tree(old)
+
+        with mock.patch.object(m.os, 'getuid', return_value=os.getuid() + 1):
+            with mock.patch.object(m, '_remove_in_background') as remove:
+                reaped = m.reap(os.getcwd())
+
+        self.assertEqual([], reaped)
+        self.assertFalse(remove.called)
+
+    @within_temp_dir
+    def test_temporary_directory_of_finished_process_reaped(self):
+        make_tree('replay-12345-abc')
+        make_tree('replay-{}-def'.format(os.getpid()))
+        make_tree('other')
+
+        with mock.patch.object(
+                m, '_is_running', lambda pid: pid == os.getpid()):
+            reaped = m.reap(os.getcwd())
+
+        self.assertEqual(
+            [os.path.join(os.getcwd(), 'replay-12345-abc')], reaped)
+        self.assertEqual(
+            ['other', 'replay-{}-def'.format(os.getpid())],
+            sorted(name for name in os.listdir('.') if name != m.TRASH))
+
+    @within_temp_dir
+    def test_reap_trash_leaves_other_directories(self):
+        make_tree('replay-12345-abc')
+
+        with mock.patch.object(m, '_is_running', lambda pid: False):
+            self.assertEqual([], m.reap_trash(os.getcwd()))
+
+        self.assertTrue(os.path.exists('replay-12345-abc'))
+
+
+class Test_make_temporary_directory(unittest.TestCase):
+
+    def test_recognized_by_reap(self):
+        path = m.make_temporary_directory()
+        try:
+            self.assertEqual(
+                os.getpid(),
+                m._temporary_directory_pid(os.path.basename(path)))
+        finally:
+            os.rmdir(path)
@@ -0,0 +1,104 @@
+import unittest
+from temp_dir import within_temp_dir
+from externals import working_directory
+import mock
+import os
+
+import replay.tree as m
+
+
+class TestIgnoreRules(unittest.TestCase):
+
+    def test_name_pattern(self):
+        rules = m.IgnoreRules(['*.csv'])
+        self.assertTrue(rules.is_ignored('data/sample.csv', False))
+        self.assertFalse(rules.is_ignored('data/sample.py', False))
+
+    def test_directory_pattern(self):
+        rules = m.IgnoreRules(['data/'])
+        self.assertTrue(rules.is_ignored('data', True))
+        self.assertFalse(rules.is_ignored('data', False))
+
+    def test_path_pattern(self):
+        rules = m.IgnoreRules(['/samples/*.csv'])
+        self.assertTrue(rules.is_ignored('samples/a.csv', False))
+        self.assertFalse(rules.is_ignored('other/samples/a.csv', False))
+
+    def test_comments_and_empty_lines(self):
+        rules = m.IgnoreRules(['# *.py', '', '  '])
+        self.assertFalse(rules.is_ignored('a.py', False))
+
+    @within_temp_dir
+    def test_load_extends_defaults(self):
+        wd = working_directory()
+        (wd / m.IGNORE_FILE).content = b'*.csv\n'
+
+        rules = m.IgnoreRules.load(wd.path)
+
+        self.assertTrue(rules.is_ignored('a.csv', False))
+        self.assertTrue(rules.is_ignored('.git', True))
+
+
+class Test_walk(unittest.TestCase):
+
+    def make_tree(self):
+        wd = working_directory()
+        (wd / 'tree/a.py').content = b''
+        (wd / 'tree/dir/b.py').content = b''
+        (wd / 'tree/.git/HEAD').content = b''
+        (wd / 'tree/__pycache__/a.pyc').content = b''
+        os.symlink('dir', (wd / 'tree/link').path)
+        return (wd / 'tree').path
+
+    def walk(self, directory):
+        return [(relpath, kind) for relpath, _, kind in m.walk(directory)]
+
+    @within_temp_dir
+    def test_walk(self):
+        directory = self.make_tree()
+
+        self.assertEqual(
+            [
+                ('a.py', m.FILE),
+                ('dir', m.DIRECTORY),
+                (os.path.join('dir', 'b.py'), m.FILE),
+                ('link', m.LINK),
+            ],
+            self.walk(directory))
+
+    @within_temp_dir
+    def test_links_outside_are_followed(self):
+        directory = self.make_tree()
+        wd = working_directory()
+        (wd / 'common/lib.py').content = b''
+        (wd / 'common/pkg/c.py').content = b''
+        os.symlink('../common/lib.py', (wd / 'tree/lib.py').path)
+        os.symlink('../common/pkg', (wd / 'tree/pkg').path)
+        os.symlink('../missing', (wd / 'tree/missing').path)
+        os.symlink('..', (wd / 'tree/up').path)
+
+        entries = list(m.walk(directory))
+
+        self.assertEqual(
+            [
+                ('a.py', m.FILE),
+                ('dir', m.DIRECTORY),
+                (os.path.join('dir', 'b.py'), m.FILE),
+                ('lib.py', m.FILE),
+                ('link', m.LINK),
+                ('missing', m.LINK),
+                ('pkg', m.DIRECTORY),
+                (os.path.join('pkg', 'c.py'), m.FILE),
+                ('up', m.LINK),
+            ],
+            [(relpath, kind) for relpath, _, kind in entries])
+        self.assertEqual(
+            os.path.realpath((wd / 'common/lib.py').path), entries[3][1])
+
+    @within_temp_dir
+    def test_walk_without_scandir(self):
+        directory = self.make_tree()
+        expected = self.walk(directory)
+
+        with mock.patch.object(m, 'scandir', None):
+            self.assertEqual(expected, self.walk(directory))
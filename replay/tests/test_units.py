@@ -0,0 +1,29 @@
+import unittest
+
+from replay import units as m
+
+
+class Test_parse_size(unittest.TestCase):
+
+    def test_bytes(self):
+        self.assertEqual(512, m.parse_size('512'))
+
+    def test_units(self):
+        self.assertEqual(10 * 1024 ** 2, m.parse_size('10M'))
+        self.assertEqual(10 * 1024 ** 2, m.parse_size('10mb'))
+        self.assertEqual(int(2.5 * 1024 ** 3), m.parse_size('2.5G'))
+
+    def test_invalid_size_raises_ValueError(self):
+        with self.assertRaises(ValueError):
+            m.parse_size('ten megabytes')
+
+
+class Test_format_size(unittest.TestCase):
+
+    def test_bytes(self):
+        self.assertEqual('512', m.format_size(512))
+
+    def test_units(self):
+        self.assertEqual('1.5K', m.format_size(1536))
+        self.assertEqual('2.0G', m.format_size(2 * 1024 ** 3))
+        self.assertEqual('2048.0T', m.format_size(2 * 1024 ** 5))
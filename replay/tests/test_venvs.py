@@ -0,0 +1,212 @@
+import unittest
+from temp_dir import within_temp_dir
+import mock
+import os
+
+from replay import external_process
+from replay import locking
+from replay import venvs as m
+
+
+def make_virtualenv(
+        pool, name, content=b'x' * 10000, last_used=None,
+        python_dependencies=None, base=None):
+    virtualenv = pool[m.NAME_PREFIX + name]
+    os.makedirs(virtualenv.path)
+    with open(os.path.join(virtualenv.path, 'content'), 'wb') as f:
+        f.write(content)
+    if python_dependencies is None:
+        python_dependencies = [name]
+    virtualenv.write_marker(python_dependencies, base)
+    if last_used is not None:
+        os.utime(virtualenv.complete_marker, (last_used, last_used))
+    return virtualenv
+
+
+class Test_disk_usage(unittest.TestCase):
+
+    @within_temp_dir
+    def test_hard_links_are_counted_once(self):
+        os.mkdir('dir')
+        with open('dir/file', 'wb') as f:
+            f.write(b'x' * 10000)
+        size = m.disk_usage('dir')
+
+        os.link('dir/file', 'dir/link')
+
+        self.assertLess(0, size)
+        self.assertEqual(size, m.disk_usage('dir'))
+
+
+class TestVirtualenvPool(unittest.TestCase):
+
+    @within_temp_dir
+    def test_virtualenvs(self):
+        pool = m.VirtualenvPool('venvs')
+        make_virtualenv(pool, 'a')
+        os.makedirs('venvs/not_a_replay_virtualenv')
+
+        virtualenvs = pool.virtualenvs()
+
+        self.assertEqual([m.NAME_PREFIX + 'a'], [v.name for v in virtualenvs])
+        self.assertEqual(['a'], virtualenvs[0].python_dependencies)
+        self.assertLess(0, virtualenvs[0].size)
+
+    @within_temp_dir
+    def test_prune_removes_least_recently_used(self):
+        pool = m.VirtualenvPool('venvs')
+        old = make_virtualenv(pool, 'old', last_used=1000)
+        new = make_virtualenv(pool, 'new', last_used=2000)
+
+        removed = pool.prune(new.size)
+
+        self.assertEqual([old.name], [v.name for v in removed])
+        self.assertFalse(os.path.exists(old.path))
+        self.assertTrue(new.is_complete)
+
+    @within_temp_dir
+    def test_prune_keeps_virtualenvs_in_use(self):
+        pool = m.VirtualenvPool('venvs')
+        virtualenv = make_virtualenv(pool, 'used')
+
+        with locking.FileLock(virtualenv.lock_path, shared=True):
+            self.assertTrue(virtualenv.is_in_use)
+            removed = pool.prune(0)
+
+        self.assertEqual([], removed)
+        self.assertTrue(virtualenv.is_complete)
+
+    @within_temp_dir
+    def test_prune_removes_incomplete_virtualenvs(self):
+        pool = m.VirtualenvPool('venvs')
+        virtualenv = pool[m.NAME_PREFIX + 'partial']
+        os.makedirs(virtualenv.path)
+
+        removed = pool.prune(10 ** 9)
+
+        self.assertEqual([virtualenv.name], [v.name for v in removed])
+        self.assertFalse(os.path.exists(virtualenv.path))
+
+    @within_temp_dir
+    def test_prune_keeps_bases_of_remaining_virtualenvs(self):
+        pool = m.VirtualenvPool('venvs')
+        base = make_virtualenv(pool, 'base', last_used=1000)
+        layer = make_virtualenv(pool, 'layer', last_used=2000, base=base)
+
+        removed = pool.prune(base.size)
+
+        # the least recently used base is kept while the layer remains
+        self.assertEqual([layer.name], [v.name for v in removed])
+        self.assertTrue(base.is_complete)
+
+    @within_temp_dir
+    def test_prune_removes_base_after_its_layers(self):
+        pool = m.VirtualenvPool('venvs')
+        base = make_virtualenv(pool, 'base', last_used=1000)
+        layer = make_virtualenv(pool, 'layer', last_used=2000, base=base)
+
+        removed = pool.prune(0)
+
+        self.assertEqual(
+            [layer.name, base.name], [v.name for v in removed])
+
+    @within_temp_dir
+    def test_find_base_with_most_dependencies(self):
+        pool = m.VirtualenvPool('venvs')
+        make_virtualenv(pool, 'a', python_dependencies=['a'])
+        ab = make_virtualenv(pool, 'ab', python_dependencies=['a', 'b'])
+        make_virtualenv(pool, 'abd', python_dependencies=['a', 'b', 'd'])
+
+        base = pool.find_base(['a', 'b', 'c'])
+
+        self.assertEqual(ab.name, base.name)
+
+    @within_temp_dir
+    def test_find_base_needs_proper_subset(self):
+        pool = m.VirtualenvPool('venvs')
+        make_virtualenv(pool, 'a', python_dependencies=['a'])
+        make_virtualenv(pool, 'empty', python_dependencies=[])
+
+        self.assertIsNone(pool.find_base(['a']))
+        self.assertIsNone(pool.find_base(['b']))
+
+    @within_temp_dir
+    def test_find_base_skips_layered_virtualenvs(self):
+        pool = m.VirtualenvPool('venvs')
+        base = make_virtualenv(pool, 'a', python_dependencies=['a'])
+        make_virtualenv(
+            pool, 'ab', python_dependencies=['a', 'b'], base=base)
+
+        self.assertEqual(base.name, pool.find_base(['a', 'b', 'c']).name)
+
+    @within_temp_dir
+    def test_touch_updates_last_used(self):
+        pool = m.VirtualenvPool('venvs')
+        virtualenv = make_virtualenv(pool, 'a', last_used=1000)
+
+        virtualenv.touch()
+
+        self.assertLess(1000, virtualenv.last_used)
+
+
+WHEEL = 'a-1.0-py3-none-any.whl'
+
+
+class TestWheelhouse(unittest.TestCase):
+
+    @within_temp_dir
+    def test_install_from_missing_wheelhouse_fails(self):
+        wheelhouse = m.Wheelhouse('wheelhouse')
+
+        result = wheelhouse.install(['pip'], ['roman'])
+
+        self.assertNotEqual(0, result.status)
+
+    @within_temp_dir
+    def test_wheels_are_built_without_the_lock_then_moved_in(self):
+        wheelhouse = m.Wheelhouse('wheelhouse')
+        installs_possible = []
+
+        def pip_wheel(args, **kwargs):
+            wheel_dir = args[args.index('wheel') + 1][len('--wheel-dir='):]
+            open(os.path.join(wheel_dir, WHEEL), 'w').close()
+            lock = locking.FileLock(wheelhouse.lock_path, shared=True)
+            installs_possible.append(lock.acquire(blocking=False))
+            lock.release()
+            return external_process.Result(
+                cmdspec=tuple(args), status=0, stdout=b'', stderr=b'')
+
+        with mock.patch('replay.external_process.run', pip_wheel):
+            result = wheelhouse.add(['pip'], ['a'])
+
+        self.assertEqual(0, result.status)
+        self.assertEqual([True], installs_possible)
+        self.assertEqual([WHEEL], wheelhouse.wheels())
+        self.assertEqual(
+            sorted(['wheelhouse', 'wheelhouse.lock']), sorted(os.listdir('.')))
+
+    @within_temp_dir
+    def test_failed_build_adds_no_wheels(self):
+        wheelhouse = m.Wheelhouse('wheelhouse')
+
+        def pip_wheel(args, **kwargs):
+            wheel_dir = args[args.index('wheel') + 1][len('--wheel-dir='):]
+            open(os.path.join(wheel_dir, WHEEL), 'w').close()
+            return external_process.Result(
+                cmdspec=tuple(args), status=1, stdout=b'', stderr=b'')
+
+        with mock.patch('replay.external_process.run', pip_wheel):
+            wheelhouse.add(['pip'], ['a'])
+
+        self.assertEqual([], wheelhouse.wheels())
+        self.assertEqual([], os.listdir('.'))
+
+    @within_temp_dir
+    def test_wheels(self):
+        os.mkdir('wheelhouse')
+        for name in ('b-1.0-py2.py3-none-any.whl', 'a-1.0.tar.gz'):
+            open(os.path.join('wheelhouse', name), 'w').close()
+
+        self.assertEqual(
+            ['b-1.0-py2.py3-none-any.whl'],
+            m.Wheelhouse('wheelhouse').wheels())
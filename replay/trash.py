@@ -0,0 +1,163 @@
+'''I remove directories without making the caller wait for the removal.
+
+A discarded directory is renamed into a trash directory next to it - on
+the same filesystem, so this is instant - and is removed by a detached
+process, that outlives replay. The trash is private to the user, as it
+might be in a shared directory, e.g. /tmp.
+
+Leftovers of interrupted runs are reaped on the next start: old trash
+and temporary directories of replay processes no longer running.
+'''
+
+import errno
+import logging
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+import uuid
+
+
+log = logging.getLogger(__name__)
+
+TRASH = '.replay-trash-{}'.format(os.getuid())
+
+# prefix of temporary working directories, followed by the process id
+TEMPORARY_DIRECTORY_PREFIX = 'replay-'
+
+# seconds after which trash is assumed to be abandoned by its remover
+REAP_AGE = 10 * 60
+
+
+def trash_directory(path):
+    '''I return the trash directory for `path`'''
+    return os.path.join(os.path.dirname(os.path.abspath(path)), TRASH)
+
+
+def _is_own_directory(path):
+    '''I return True if `path` is a directory - not a link - of this user'''
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid()
+
+
+def _make_trash(trash):
+    '''I create the `trash` directory, accessible to this user only'''
+    try:
+        os.mkdir(trash, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if not _is_own_directory(trash):
+        raise OSError(errno.EPERM, 'not a directory of this user', trash)
+    os.chmod(trash, 0o700)
+
+
+def make_temporary_directory():
+    '''I return a new temporary directory, that reap can recognize'''
+    return tempfile.mkdtemp(
+        prefix='{}{}-'.format(TEMPORARY_DIRECTORY_PREFIX, os.getpid()))
+
+
+def discard(path):
+    '''I remove the directory `path` in the background.
+
+    `path` is gone by the time I return. If it can not be moved to
+    the trash, it is removed right away.
+    '''
+    trash = trash_directory(path)
+    trashed = os.path.join(
+        trash,
+        '{:.0f}-{}-{}'.format(time.time(), os.getpid(), uuid.uuid4().hex))
+    try:
+        _make_trash(trash)
+        os.rename(path, trashed)
+    except OSError as e:
+        log.debug('discard: can not move %s to trash (%s)', path, e)
+        shutil.rmtree(path)
+        return
+    log.debug('discard: %s -> %s', path, trashed)
+    _remove_in_background(trashed)
+
+
+def _remove_in_background(path):
+    # the shell exits right after starting rm, so rm is not our child:
+    # it outlives us and is never left as a zombie
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.call(
+            ['/bin/sh', '-c', 'rm -rf -- "$1" &', 'sh', path],
+            stdin=devnull, stdout=devnull, stderr=devnull,
+            close_fds=True, preexec_fn=os.setsid)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _trash_age(name, now):
+    try:
+        return now - int(name.split('-', 1)[0])
+    except ValueError:
+        return now
+
+
+def _temporary_directory_pid(name):
+    if not name.startswith(TEMPORARY_DIRECTORY_PREFIX):
+        return None
+    try:
+        return int(name[len(TEMPORARY_DIRECTORY_PREFIX):].split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+def reap_trash(directory):
+    '''I remove the abandoned trash in `directory` in the background \
+    and return the paths reaped.
+    '''
+    reaped = []
+    now = time.time()
+    trash = os.path.join(directory, TRASH)
+    if _is_own_directory(trash):
+        for name in os.listdir(trash):
+            path = os.path.join(trash, name)
+            if _trash_age(name, now) > REAP_AGE and _is_own_directory(path):
+                _remove_in_background(path)
+                reaped.append(path)
+    if reaped:
+        log.debug('reap_trash: %s', reaped)
+    return reaped
+
+
+def reap(directory=None):
+    '''I remove the leftovers of earlier runs in the background: \
+    the abandoned trash and the temporary directories of this user's \
+    replay processes no longer running in `directory` (default: the system \
+    temporary directory).
+
+    I return the paths reaped.
+    '''
+    if directory is None:
+        directory = tempfile.gettempdir()
+    reaped = reap_trash(directory)
+    for name in os.listdir(directory):
+        pid = _temporary_directory_pid(name)
+        if pid is None or _is_running(pid):
+            continue
+        path = os.path.join(directory, name)
+        if _is_own_directory(path):
+            try:
+                discard(path)
+            except OSError as e:
+                log.debug('reap: can not remove %s (%s)', path, e)
+                continue
+            log.debug('reap: %s', path)
+            reaped.append(path)
+    return reaped
@@ -0,0 +1,152 @@
+'''I walk script directories, leaving out the files not part of the script.
+
+A script directory can have an IGNORE_FILE with glob patterns,
+one per line, of the files to leave out in addition to the defaults:
+
+- empty lines and lines starting with # are skipped
+- a pattern ending with / matches only directories
+- a pattern containing / is matched against the path relative to
+  the script directory, other patterns against the name of the file
+
+Ignored directories are not entered at all.
+'''
+
+import fnmatch
+import os
+
+try:
+    from os import scandir
+except ImportError:  # python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+IGNORE_FILE = '.replayignore'
+
+DEFAULT_IGNORE_PATTERNS = (
+    '.replay/',
+    '.git/',
+    '.hg/',
+    '.svn/',
+    '__pycache__/',
+    '*.pyc',
+)
+
+# kinds of entries
+DIRECTORY = 'dir'
+FILE = 'file'
+LINK = 'link'
+
+
+class IgnoreRules(object):
+
+    '''I decide which files of a script directory to leave out'''
+
+    def __init__(self, patterns=DEFAULT_IGNORE_PATTERNS):
+        self.name_patterns = []
+        self.path_patterns = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            directory_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if '/' in pattern:
+                self.path_patterns.append(
+                    (pattern.lstrip('/'), directory_only))
+            else:
+                self.name_patterns.append((pattern, directory_only))
+
+    @classmethod
+    def load(cls, directory):
+        '''I return the default rules extended with those in the \
+        IGNORE_FILE of `directory`.
+        '''
+        patterns = list(DEFAULT_IGNORE_PATTERNS)
+        path = os.path.join(directory, IGNORE_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                patterns.extend(f.read().splitlines())
+        return cls(patterns)
+
+    def is_ignored(self, relpath, is_directory):
+        name = os.path.basename(relpath)
+        for pattern, directory_only in self.name_patterns:
+            if directory_only and not is_directory:
+                continue
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        for pattern, directory_only in self.path_patterns:
+            if directory_only and not is_directory:
+                continue
+            if fnmatch.fnmatchcase(relpath, pattern):
+                return True
+        return False
+
+
+def _entries(directory):
+    '''I yield (name, path, kind) for the entries of `directory`'''
+    if scandir is not None:
+        for entry in scandir(directory):
+            if entry.is_symlink():
+                kind = LINK
+            elif entry.is_dir():
+                kind = DIRECTORY
+            else:
+                kind = FILE
+            yield entry.name, entry.path, kind
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.islink(path):
+                kind = LINK
+            elif os.path.isdir(path):
+                kind = DIRECTORY
+            else:
+                kind = FILE
+            yield name, path, kind
+
+
+def _is_within(path, directory):
+    return path == directory or path.startswith(directory + os.sep)
+
+
+def walk(directory, rules=None):
+    '''I yield (relative path, path, kind) of the entries under \
+    `directory` not ignored by `rules`, sorted, parents before children.
+
+    Symbolic links within `directory` are not followed. Those pointing
+    outside are yielded as the file or directory they point to (path is
+    then the target), so that a copy of the tree has no dangling links.
+    Links to missing targets or to a directory being walked (a cycle)
+    stay links.
+    '''
+    if rules is None:
+        rules = IgnoreRules.load(directory)
+    root = os.path.realpath(directory)
+
+    def resolve(path, kind, walking):
+        if kind != LINK:
+            return path, kind
+        target = os.path.realpath(path)
+        if (_is_within(target, root)
+                or not os.path.exists(target)
+                or any(_is_within(parent, target) for parent in walking)):
+            return path, LINK
+        return target, DIRECTORY if os.path.isdir(target) else FILE
+
+    def walk_directory(path, relpath, walking):
+        for name, child, kind in sorted(_entries(path)):
+            child, kind = resolve(child, kind, walking)
+            child_relpath = os.path.join(relpath, name) if relpath else name
+            if rules.is_ignored(child_relpath, kind == DIRECTORY):
+                continue
+            yield child_relpath, child, kind
+            if kind == DIRECTORY:
+                for item in walk_directory(
+                        child, child_relpath,
+                        walking + [os.path.realpath(child)]):
+                    yield item
+    return walk_directory(directory, '', [root])
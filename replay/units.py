@@ -0,0 +1,36 @@
+'''I convert human friendly quantities to numbers.
+'''
+
+import re
+
+
+_SIZE_UNITS = {
+    '': 1,
+    'K': 1024,
+    'M': 1024 ** 2,
+    'G': 1024 ** 3,
+    'T': 1024 ** 4,
+}
+
+
+def parse_size(size):
+    '''I return the number of bytes in `size`, e.g. "512", "10M", "2.5G"
+    '''
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(size), re.I)
+    if not match:
+        raise ValueError('invalid size: {!r}'.format(size))
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS[unit.upper()])
+
+
+def format_size(size):
+    '''I return `size` bytes in human friendly form, e.g. "1.5G"'''
+    for unit in ('', 'K', 'M', 'G'):
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'T'
+    if unit:
+        return '{:.1f}{}'.format(size, unit)
+    return '{}'.format(int(size))
@@ -0,0 +1,321 @@
+'''I manage the virtualenvs cached by PythonDependencies \
+and the wheelhouse they are built from.
+
+Each virtualenv <name> in the parent directory has
+
+- a lock file <name>.lock: held exclusively while the virtualenv is built
+  or removed, and shared while a run uses it
+- a completion marker in the virtualenv, with the dependencies and the
+  size of the virtualenv; its modification time is the last use
+
+A virtualenv can be layered on a base virtualenv with a subset of its
+dependencies: a .pth file makes the packages of the base available and
+only the missing packages are installed. Bases are kept as long as
+a virtualenv is layered on them.
+
+The wheelhouse is a directory of wheels built for earlier virtualenvs,
+so that packages are downloaded and built only once.
+'''
+
+import errno
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from replay import external_process
+from replay import files
+from replay import locking
+
+
+log = logging.getLogger(__name__)
+
+NAME_PREFIX = '_replay_'
+COMPLETE_MARKER = 'replay-complete.json'
+# default wheelhouse in the virtualenv parent directory
+WHEELHOUSE = 'wheelhouse'
+# .pth file in the site-packages of a virtualenv layered on a base
+BASE_PTH = '_replay_base.pth'
+# keep pip configuration of the user out of virtualenv builds
+PIP_ENV = {'PIP_CONFIG_FILE': os.devnull}
+
+
+def disk_usage(path):
+    '''I return the bytes allocated to files under `path`, \
+    counting hard linked files once.
+    '''
+    seen = set()
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_blocks * 512
+    return total
+
+
+class Virtualenv(object):
+
+    '''I am a virtualenv in a VirtualenvPool'''
+
+    def __init__(self, parent_dir, name):
+        self.name = name
+        self.path = os.path.join(parent_dir, name)
+        self.lock_path = self.path + '.lock'
+        self.complete_marker = os.path.join(self.path, COMPLETE_MARKER)
+
+    @property
+    def is_complete(self):
+        return os.path.exists(self.complete_marker)
+
+    def read_marker(self):
+        try:
+            with open(self.complete_marker, 'rb') as f:
+                return json.loads(f.read().decode('utf8'))
+        except (IOError, ValueError):
+            return {}
+
+    def write_marker(self, python_dependencies, base=None):
+        '''I mark the virtualenv as complete'''
+        marker = {
+            'python dependencies': sorted(python_dependencies),
+            'size': disk_usage(self.path),
+        }
+        if base is not None:
+            marker['base'] = base.name
+        temporary_marker = self.complete_marker + '.tmp'
+        with open(temporary_marker, 'wb') as f:
+            f.write(json.dumps(marker, sort_keys=True).encode('utf8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary_marker, self.complete_marker)
+
+    @property
+    def python_dependencies(self):
+        return self.read_marker().get('python dependencies', [])
+
+    @property
+    def size(self):
+        size = self.read_marker().get('size')
+        if size is None:
+            size = disk_usage(self.path)
+        return size
+
+    @property
+    def base(self):
+        '''I am the name of the virtualenv this one is layered on or None'''
+        return self.read_marker().get('base')
+
+    def site_packages(self):
+        python = os.path.join(self.path, 'bin', 'python')
+        result = external_process.run([
+            python, '-c',
+            'import sysconfig; print(sysconfig.get_paths()["purelib"])'])
+        if result.status != 0:
+            raise OSError(str(result))
+        return result.stdout.decode('utf8').strip()
+
+    def layer_on(self, base):
+        '''I make the packages of `base` available in the virtualenv'''
+        log.debug('Virtualenv: layer %s on %s', self.name, base.name)
+        pth = os.path.join(self.site_packages(), BASE_PTH)
+        with open(pth, 'w') as f:
+            # processes the .pth files of the base as well
+            f.write(
+                'import site; site.addsitedir({!r})\n'.format(
+                    base.site_packages()))
+
+    @property
+    def last_used(self):
+        try:
+            return os.path.getmtime(self.complete_marker)
+        except OSError:
+            return os.path.getmtime(self.path)
+
+    def touch(self):
+        '''I record a use of the virtualenv'''
+        try:
+            os.utime(self.complete_marker, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    @property
+    def is_in_use(self):
+        lock = locking.FileLock(self.lock_path)
+        if lock.acquire(blocking=False):
+            lock.release()
+            return False
+        return True
+
+    def remove(self):
+        '''I remove the virtualenv if it is not in use or being built.
+
+        I return True if it was removed.
+        '''
+        lock = locking.FileLock(self.lock_path)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            log.debug('Virtualenv: remove %s', self.path)
+            # make it incomplete first, so a partial removal is never used
+            if self.is_complete:
+                os.remove(self.complete_marker)
+            shutil.rmtree(self.path, ignore_errors=True)
+        finally:
+            lock.release()
+        return True
+
+
+class VirtualenvPool(object):
+
+    '''I am the set of replay virtualenvs in a directory'''
+
+    def __init__(self, parent_dir):
+        self.parent_dir = parent_dir
+
+    def __getitem__(self, name):
+        return Virtualenv(self.parent_dir, name)
+
+    def virtualenvs(self):
+        if not os.path.isdir(self.parent_dir):
+            return []
+        return [
+            self[name]
+            for name in sorted(os.listdir(self.parent_dir))
+            if name.startswith(NAME_PREFIX)
+            and os.path.isdir(os.path.join(self.parent_dir, name))]
+
+    def find_base(self, python_dependencies):
+        '''I return the complete virtualenv with the most dependencies \
+        that are all in `python_dependencies`, or None.
+        '''
+        python_dependencies = set(python_dependencies)
+        bases = []
+        for virtualenv in self.virtualenvs():
+            if virtualenv.base is not None:
+                # no layers on layers
+                continue
+            dependencies = set(virtualenv.python_dependencies)
+            if (virtualenv.is_complete
+                    and dependencies
+                    and dependencies < python_dependencies):
+                bases.append((len(dependencies), virtualenv.name, virtualenv))
+        if not bases:
+            return None
+        return max(bases)[2]
+
+    def prune(self, max_size):
+        '''I remove incomplete virtualenvs not being built, and the least \
+        recently used ones until the total size is at most `max_size`.
+
+        Virtualenvs in use and bases of remaining virtualenvs
+        are never removed.
+        I return the removed virtualenvs.
+        '''
+        removed = []
+        candidates = []
+        for virtualenv in self.virtualenvs():
+            if virtualenv.is_complete:
+                candidates.append(virtualenv)
+            elif virtualenv.remove():
+                removed.append(virtualenv)
+
+        sizes = dict((v.name, v.size) for v in candidates)
+        total = sum(sizes.values())
+        candidates.sort(key=lambda v: v.last_used)
+        while total > max_size:
+            bases = set(v.base for v in candidates)
+            for virtualenv in candidates:
+                if virtualenv.name not in bases and virtualenv.remove():
+                    break
+            else:
+                break
+            candidates.remove(virtualenv)
+            removed.append(virtualenv)
+            total -= sizes[virtualenv.name]
+        return removed
+
+
+class Wheelhouse(object):
+
+    '''I am a directory of wheels shared by virtualenv builds.
+
+    Wheels are built in a private directory, then moved in under an
+    exclusive lock, and installed from under a shared one, so that
+    installs never see partially written wheels - nor wait for builds.
+    `pip` is the command line of a pip in the virtualenv to use.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+
+    def install(self, pip, requirements, timeout=None):
+        '''I install `requirements` from wheels only.
+
+        I return the external_process.Result of pip, killed after
+        `timeout` seconds if given.
+        '''
+        with locking.FileLock(self.lock_path, shared=True):
+            if not os.path.isdir(self.path):
+                return external_process.Result(
+                    cmdspec=tuple(pip), status=1, stdout=b'',
+                    stderr=b'no wheelhouse at ' + self.path.encode('utf8'))
+            return external_process.run(
+                list(pip)
+                + ['install', '--no-index', '--find-links=' + self.path]
+                + list(requirements),
+                env=PIP_ENV,
+                timeout=timeout)
+
+    def add(self, pip, requirements, index_server_url=None, timeout=None):
+        '''I build wheels of `requirements` and all their dependencies, \
+        reusing the wheels already present.
+
+        I return the external_process.Result of pip, killed after
+        `timeout` seconds if given.
+        '''
+        log.debug('Wheelhouse: add %s to %s', requirements, self.path)
+        parent = os.path.dirname(os.path.abspath(self.path))
+        files.makedirs(parent)
+        # on the filesystem of the wheelhouse, for the renames
+        build_directory = tempfile.mkdtemp(
+            prefix=os.path.basename(self.path) + '.tmp-', dir=parent)
+        try:
+            result = external_process.run(
+                list(pip)
+                + ['wheel', '--wheel-dir=' + build_directory,
+                   '--find-links=' + self.path]
+                + (['--index-url=' + index_server_url]
+                   if index_server_url else [])
+                + list(requirements),
+                env=PIP_ENV,
+                timeout=timeout)
+            if result.status == 0:
+                self._move_wheels(build_directory)
+            return result
+        finally:
+            shutil.rmtree(build_directory, ignore_errors=True)
+
+    def _move_wheels(self, build_directory):
+        with locking.FileLock(self.lock_path):
+            files.makedirs(self.path)
+            for name in os.listdir(build_directory):
+                if (name.endswith('.whl')
+                        and not os.path.exists(os.path.join(self.path, name))):
+                    os.rename(
+                        os.path.join(build_directory, name),
+                        os.path.join(self.path, name))
+
+    def wheels(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            name for name in os.listdir(self.path) if name.endswith('.whl'))